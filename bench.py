@@ -0,0 +1,124 @@
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+
+# Бенчмарки горячих путей бота. Сеть и Телеграм не нужны: расписание берется из сохраненной страницы
+# (parser.py сам пишет debug_<группа>.html при каждой загрузке).
+# Пример: python bench.py inline --html debug_ИБ-41.html
+
+
+def _report(name: str, timings: list) -> None:
+    timings = sorted(timings)
+    p = lambda q: timings[min(len(timings) - 1, int(len(timings) * q))] * 1e6
+    print(
+        f"{name}: n={len(timings)}, "
+        f"p50={p(0.50):.1f} мкс, p95={p(0.95):.1f} мкс, p99={p(0.99):.1f} мкс, "
+        f"mean={statistics.mean(timings) * 1e6:.1f} мкс"
+    )
+
+
+def _load_schedule(group: str, html_path: str) -> None:
+    import parser
+
+    if not os.path.exists(html_path):
+        sys.exit(f"Нет файла {html_path}. Запустите бота один раз или укажите --html")
+
+    with open(html_path, encoding="utf-8") as f:
+        schedule = parser.parse_html(group, f.read())
+    if schedule is None:
+        sys.exit(f"Не удалось разобрать {html_path}")
+    parser.store_schedule(group, schedule)
+
+
+def bench_inline(args) -> None:
+    """Задержка ответа на inline-запрос на прогретом кеше"""
+    import bot
+
+    _load_schedule(args.group, args.html or f"debug_{args.group}.html")
+    queries = [f"{args.group} сегодня", f"{args.group} завтра", f"{args.group} неделя 1", args.group]
+
+    async def run():
+        # Прогрев: первый вызов рендерит тексты
+        for query in queries:
+            await bot.build_inline_results(query, user_id=0)
+
+        for query in queries:
+            timings = []
+            for _ in range(args.iterations):
+                start = time.perf_counter()
+                await bot.build_inline_results(query, user_id=0)
+                timings.append(time.perf_counter() - start)
+            _report(f"inline '{query}'", timings)
+
+    asyncio.run(run())
+
+
+def bench_callbacks(args) -> None:
+    """Кодирование и разбор callback_data и выбор обработчика, в том числе на тысячах групп"""
+    import parser
+    import callbacks
+
+    # Синтетический реестр групп, как будто бот работает на весь университет
+    for i in range(args.groups):
+        parser.GROUP_URLS.setdefault(f"ГР-{i:05d}", f"{parser.ALTSTU_BASE_URL}/m/s/{7000000000 + i}/")
+    callbacks._groups_by_id.update({callbacks.group_id(group): group for group in parser.GROUP_URLS})
+    groups = list(parser.GROUP_URLS)
+
+    payloads = [callbacks.encode_group(group) for group in groups]
+    payloads += [callbacks.encode_view("today"), callbacks.encode_week(2), callbacks.encode_day(1, 5), callbacks.encode_page(2, 1)]
+    longest = max(len(payload.encode("utf-8")) for payload in payloads)
+    print(f"Групп: {len(groups)}, самая длинная callback_data: {longest} байт (лимит {callbacks.MAX_CALLBACK_BYTES})")
+    if any(callbacks.decode(callbacks.encode_group(group)).group != group for group in groups):
+        sys.exit("Ошибка: decode(encode_group(g)) != g")
+
+    import bot
+    samples = {
+        "group": payloads[len(groups) // 2],
+        "day": callbacks.encode_day(1, 5),
+        "legacy day_1_5": "day_1_5",
+    }
+    for name, data in samples.items():
+        timings = []
+        for _ in range(args.iterations):
+            start = time.perf_counter()
+            callback = callbacks.decode(data)
+            bot.CALLBACK_ROUTES.get(callback.action)
+            timings.append(time.perf_counter() - start)
+        _report(f"decode+route '{name}'", timings)
+
+    timings = []
+    for i in range(args.iterations):
+        group = groups[i % len(groups)]
+        start = time.perf_counter()
+        callbacks.encode_group(group)
+        timings.append(time.perf_counter() - start)
+    _report("encode_group", timings)
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description="Бенчмарки бота расписания")
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+
+    inline = subparsers.add_parser("inline", help="ответ на inline-запрос из кеша")
+    inline.add_argument("--group", default="ИБ-41")
+    inline.add_argument("--html", help="сохраненная страница расписания (по умолчанию debug_<группа>.html)")
+    inline.add_argument("--iterations", type=int, default=10000)
+    inline.set_defaults(func=bench_inline)
+
+    callbacks_parser = subparsers.add_parser("callbacks", help="разбор callback_data и выбор обработчика")
+    callbacks_parser.add_argument("--groups", type=int, default=5000, help="сколько синтетических групп добавить")
+    callbacks_parser.add_argument("--iterations", type=int, default=100000)
+    callbacks_parser.set_defaults(func=bench_callbacks)
+
+    args = arg_parser.parse_args()
+    # Логи парсера на каждый предмет сильно искажают замеры
+    logging.disable(logging.INFO)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
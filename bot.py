@@ -1,15 +1,38 @@
+import time
+# Момент старта процесса, от него считаются фазы запуска в отчете --profile-startup
+STARTED_AT = time.perf_counter()
 import os
 import logging
 import asyncio
+import signal
+import argparse
 from dotenv import load_dotenv
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, ConversationHandler
-from telegram.error import TelegramError, NetworkError, TimedOut
+from telegram import Update, InputFile, InlineQueryResultArticle, InputTextMessageContent, InlineQueryResultsButton
+from telegram.ext import Application, ApplicationHandlerStop, CommandHandler, CallbackQueryHandler, InlineQueryHandler, TypeHandler, ContextTypes, ConversationHandler
+from telegram.error import TelegramError, NetworkError, TimedOut, BadRequest
 from telegram.request import HTTPXRequest
 import parser
 import db  
+import profiling
+import keyboards
+import render
+import diff
+import circuit
+import shared_cache
+import timeslots
+import ics
+import exams
+import search
+import reminders
+import ratelimit
+import freshness
+import usage
+import callbacks
 from datetime import datetime
+from collections import OrderedDict
+from typing import List, Optional
 
+profiling.record_startup_phase("imports", STARTED_AT)
 
 load_dotenv()
 
@@ -23,22 +46,107 @@ logger = logging.getLogger(__name__)
 
 CHOOSING_GROUP, CHOOSING_SCHEDULE = range(2)
 
+# ID админов через запятую, им доступны /trace и /profile
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x}
+
+# Хеши последнего отправленного (текст, клавиатура) по сообщениям, чтобы не дергать API зря
+MAX_RENDERED_MESSAGES = 10000
+rendered_messages = OrderedDict()
+
+def _message_key(query):
+    if query.inline_message_id:
+        return query.inline_message_id
+    return (query.message.chat_id, query.message.message_id)
+
+def _content_hash(text: str, kwargs: dict) -> int:
+    # Клавиатуры - неизменяемые TelegramObject'ы и хешируются по содержимому
+    return hash((text, kwargs.get("reply_markup"), kwargs.get("parse_mode")))
+
+def _remember_content(key, content_hash: int) -> None:
+    rendered_messages[key] = content_hash
+    rendered_messages.move_to_end(key)
+    if len(rendered_messages) > MAX_RENDERED_MESSAGES:
+        rendered_messages.popitem(last=False)
+
+async def _answer_query(query, text: str = None) -> None:
+    try:
+        await query.answer(text)
+    except TelegramError as e:
+        # Например, на этот callback уже ответили - это не повод не показывать расписание
+        logger.warning(f"Не удалось ответить на callback: {e}")
+
+async def edit_message(query, text: str, **kwargs):
+    """
+    Отвечает на callback и редактирует сообщение параллельно.
+    Если текст и клавиатура не поменялись с прошлого раза - запрос на редактирование не отправляется.
+    """
+    key = _message_key(query)
+    content_hash = _content_hash(text, kwargs)
+
+    if rendered_messages.get(key) == content_hash:
+        logger.info("Содержимое сообщения не изменилось, пропускаем edit_message_text")
+        await _answer_query(query)
+        return None
+
+    with profiling.span("edit_message_text"):
+        try:
+            _, result = await asyncio.gather(_answer_query(query), query.edit_message_text(text, **kwargs))
+        except BadRequest as e:
+            # Сообщение уже в нужном виде (например, после перезапуска бота) - это не ошибка
+            if "not modified" not in str(e).lower():
+                raise
+            result = None
+
+    _remember_content(key, content_hash)
+    return result
+
+async def reply_message(message, text: str, **kwargs):
+    """reply_text с замером времени"""
+    with profiling.span("reply_text"):
+        sent = await message.reply_text(text, **kwargs)
+    _remember_content((sent.chat_id, sent.message_id), _content_hash(text, kwargs))
+    return sent
+
+def _get_user_groups(user_id: int) -> List[str]:
+    """Основная группа пользователя и дополнительные, [] - группа не выбрана"""
+    with profiling.span("get_user_group"):
+        return db.get_user_groups(user_id)
+
+def _get_user_subgroup(user_id: int, groups: List[str]) -> Optional[str]:
+    """Подгруппа пользователя. Совмещенное расписание нескольких групп по подгруппам не фильтруется."""
+    if len(groups) != 1:
+        return None
+    with profiling.span("get_user_group"):
+        return db.get_user_subgroup(user_id)
+
+def _schedule_pages(groups: List[str], view: str, subgroup: Optional[str] = None) -> List[str]:
+    """Одна группа - готовый текст из render (вариант подгруппы тоже готовый), несколько - совмещенное расписание всех групп"""
+    with profiling.span("render"):
+        if len(groups) > 1:
+            return render.merged_pages(groups, view)
+        return [render.get_text(groups[0], view, subgroup)]
+
+def _now_text(groups: List[str]) -> str:
+    """Текущее и следующее занятие каждой из групп пользователя"""
+    with profiling.span("render"):
+        return "\n\n".join(timeslots.get_text(group).strip() for group in groups)
+
+def _groups_title(groups: List[str]) -> str:
+    if len(groups) == 1:
+        return f"Выбрана группа: *{groups[0]}*"
+    return f"Выбраны группы: *{', '.join(groups)}*"
+
 # Словарь для хранения выбранной группы пользователем (временное хранилище), если впадлу использовать БД, хотя объективно она тут не нужна, но эт уже моя шиза
 # user_groups = {}
 
+@profiling.traced("start")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     # Тут группы свои ставим, которые надо (тестировал только на 3ех, как будет при 4 и более я хз)
     try:
-        keyboard = [
-            [
-                InlineKeyboardButton("ИБ-41", callback_data="group_ИБ-41"),
-                InlineKeyboardButton("ИБ-42", callback_data="group_ИБ-42"),
-                InlineKeyboardButton("ИБ-43", callback_data="group_ИБ-43"),
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.message.reply_text(
+        reply_markup = keyboards.GROUP_KEYBOARD
+        
+        await reply_message(
+            update.message,
             "🎓 Добро пожаловать в бот расписания АлтГТУ!\n\n"
             "Выберите вашу группу:",
             reply_markup=reply_markup
@@ -47,38 +155,31 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         return CHOOSING_GROUP
     except Exception as e:
         logger.error(f"Ошибка в обработчике start: {e}")
-        await update.message.reply_text("Произошла ошибка. Пожалуйста, попробуйте еще раз позже.")
+        await reply_message(update.message, "Произошла ошибка. Пожалуйста, попробуйте еще раз позже.")
         return ConversationHandler.END
 
-async def group_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+@profiling.traced("group_selected")
+async def group_selected(update: Update, context: ContextTypes.DEFAULT_TYPE, callback: callbacks.Callback) -> int:
     """Обработчик выбора группы."""
     try:
         query = update.callback_query
-        await query.answer()
         
         # Получаем выбранную группу
-        group = query.data.split("_")[1]
+        group = callback.group
+        if group is None:
+            # Кнопка со старой группой, которой больше нет в списке
+            await edit_message(query, "Выберите вашу группу:", reply_markup=keyboards.GROUP_KEYBOARD)
+            return CHOOSING_GROUP
         
         # Сохраняем выбор пользователя в базе данных
         user_id = update.effective_user.id
-        db.save_user_group(user_id, group)
+        with profiling.span("save_user_group"):
+            db.save_user_group(user_id, group)
         
-        keyboard = [
-            [
-                InlineKeyboardButton("На сегодня", callback_data="schedule_today"),
-                InlineKeyboardButton("На завтра", callback_data="schedule_tomorrow"),
-            ],
-            [
-                InlineKeyboardButton("Неделя 1", callback_data="schedule_week_1"),
-                InlineKeyboardButton("Неделя 2", callback_data="schedule_week_2"),
-            ],
-            [
-                InlineKeyboardButton("Изменить группу", callback_data="change_group"),
-            ],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = keyboards.MAIN_MENU
         
-        await query.edit_message_text(
+        await edit_message(
+            query,
             f"Выбрана группа: *{group}*\n\n"
             "Выберите период расписания:",
             reply_markup=reply_markup,
@@ -89,118 +190,71 @@ async def group_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     except Exception as e:
         logger.error(f"Ошибка в обработчике group_selected: {e}")
         try:
-            await query.edit_message_text("Произошла ошибка. Пожалуйста, попробуйте еще раз.")
+            await edit_message(query, "Произошла ошибка. Пожалуйста, попробуйте еще раз.")
         except:
             pass
         return ConversationHandler.END
 
-async def schedule_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+@profiling.traced("schedule_selected")
+async def schedule_selected(update: Update, context: ContextTypes.DEFAULT_TYPE, callback: callbacks.Callback) -> int:
     # Тут тоже группы меняем
     try:
         query = update.callback_query
-        await query.answer()
         
         user_id = update.effective_user.id
-        group = db.get_user_group(user_id)
+        groups = _get_user_groups(user_id)
+        group = groups[0] if groups else None
+        subgroup = _get_user_subgroup(user_id, groups)
         
         if not group:
             # Если группа не выбрана, предлагаем выбрать
-            keyboard = [
-                [
-                    InlineKeyboardButton("ИБ-41", callback_data="group_ИБ-41"),
-                    InlineKeyboardButton("ИБ-42", callback_data="group_ИБ-42"),
-                    InlineKeyboardButton("ИБ-43", callback_data="group_ИБ-43"),
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = keyboards.GROUP_KEYBOARD
             
-            await query.edit_message_text(
+            await edit_message(
+                query,
                 "Выберите группу:",
                 reply_markup=reply_markup
             )
             return CHOOSING_GROUP
         
-        schedule_type = query.data.split("_")[1]
+        # В журнале использования виды одного обработчика различаем
+        profiling.annotate(view=callback.view or f"week_{callback.week}")
         
-        if schedule_type == "today":
+        if callback.view == "now":
+            # Текущее и следующее занятие
+            schedule_text = _now_text(groups)
+            reply_markup = keyboards.BACK_KEYBOARD
+            
+        elif callback.view == "today":
             # Расписание на сегодня
-            schedule_text = parser.get_today_schedule(group)
+            schedule_text = _schedule_pages(groups, "today", subgroup)[0]
             # Добавляем кнопку "Назад"
-            keyboard = [
-                [InlineKeyboardButton("« Назад", callback_data="back_to_menu")],
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = keyboards.BACK_KEYBOARD
             
-        elif schedule_type == "tomorrow":
+        elif callback.view == "tomorrow":
             
-            schedule_text = parser.get_tomorrow_schedule(group)
+            schedule_text = _schedule_pages(groups, "tomorrow", subgroup)[0]
            
-            keyboard = [
-                [InlineKeyboardButton("« Назад", callback_data="back_to_menu")],
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = keyboards.BACK_KEYBOARD
             
-        elif schedule_type.startswith("week"):
+        elif callback.action == callbacks.WEEK:
             
-            week_number = int(query.data.split("_")[2])
-            schedule_text = parser.get_week_schedule(group, week_number)
+            week_number = callback.week
+            pages = _schedule_pages(groups, f"week_{week_number}", subgroup)
+            schedule_text = pages[0]
             
-            # Добавляем кнопки навигации по дням для недельного расписания
-            schedule = parser.parse_schedule(group)
-            
-            if schedule:
-                for week in schedule.weeks:
-                    if week.number == week_number and week.days:
-                        # Сортируем дни по дате
-                        sorted_days = sorted(week.days, key=lambda d: 
-                            datetime.strptime(d.date, "%d.%m.%y") if "." in d.date else datetime.now())
-                        
-                        # Создаем кнопки для каждого дня недели
-                        keyboard_days = []
-                        row = []
-                        
-                        for day in sorted_days:
-                            day_button = InlineKeyboardButton(
-                                f"{day.date} ({day.weekday})", 
-                                callback_data=f"day_{week_number}_{day.date}"
-                            )
-                            row.append(day_button)
-                            
-                            # Максимум 2 кнопки в ряду
-                            if len(row) == 2:
-                                keyboard_days.append(row)
-                                row = []
-                        
-                        # Добавляем оставшиеся кнопки, если есть
-                        if row:
-                            keyboard_days.append(row)
-                        
-                        # Добавляем кнопку "Назад"
-                        keyboard_days.append([InlineKeyboardButton("« Назад", callback_data="back_to_menu")])
-                        reply_markup = InlineKeyboardMarkup(keyboard_days)
-                        
-                        # Отправляем сообщение
-                        await query.edit_message_text(
-                            schedule_text,
-                            reply_markup=reply_markup,
-                            parse_mode="Markdown"
-                        )
-                        return CHOOSING_SCHEDULE
-            
-           
-            keyboard = [
-                [InlineKeyboardButton("« Назад", callback_data="back_to_menu")],
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            if len(groups) > 1:
+                reply_markup = keyboards.merged_page_keyboard(week_number, 0, len(pages))
+            else:
+                # Клавиатура навигации по дням собирается при обновлении расписания, тут берем готовую
+                reply_markup = keyboards.week_keyboard(group, week_number, subgroup=subgroup)
         else:
             schedule_text = "Неизвестный тип расписания."
             # Добавляем кнопку "Назад"
-            keyboard = [
-                [InlineKeyboardButton("« Назад", callback_data="back_to_menu")],
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = keyboards.BACK_KEYBOARD
         
-        await query.edit_message_text(
+        await edit_message(
+            query,
             schedule_text,
             reply_markup=reply_markup,
             parse_mode="Markdown"
@@ -210,165 +264,185 @@ async def schedule_selected(update: Update, context: ContextTypes.DEFAULT_TYPE)
     except Exception as e:
         logger.error(f"Ошибка в обработчике schedule_selected: {e}")
         try:
-            await query.edit_message_text("Произошла ошибка при получении расписания. Пожалуйста, попробуйте еще раз.")
-            keyboard = [
-                [InlineKeyboardButton("« Назад", callback_data="back_to_menu")],
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_reply_markup(reply_markup=reply_markup)
+            await edit_message(
+                query,
+                "Произошла ошибка при получении расписания. Пожалуйста, попробуйте еще раз.",
+                reply_markup=keyboards.BACK_KEYBOARD
+            )
         except:
             pass
         return CHOOSING_SCHEDULE
 
-async def show_day_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+@profiling.traced("show_day_schedule")
+async def show_day_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE, callback: callbacks.Callback) -> int:
     """Показывает расписание на конкретный день."""
     try:
         query = update.callback_query
-        await query.answer()
         
         user_id = update.effective_user.id
-        group = db.get_user_group(user_id)
+        groups = _get_user_groups(user_id)
+        group = groups[0] if groups else None
+        subgroup = _get_user_subgroup(user_id, groups)
         
         if not group:
             # Если группа не выбрана, предлагаем выбрать. Тут меняем на свои группы
-            keyboard = [
-                [
-                    InlineKeyboardButton("ИБ-41", callback_data="group_ИБ-41"),
-                    InlineKeyboardButton("ИБ-42", callback_data="group_ИБ-42"),
-                    InlineKeyboardButton("ИБ-43", callback_data="group_ИБ-43"),
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = keyboards.GROUP_KEYBOARD
             
-            await query.edit_message_text(
+            await edit_message(
+                query,
                 "Выберите группу:",
                 reply_markup=reply_markup
             )
             return CHOOSING_GROUP
         
-        # Получаем данные из callback
-        data_parts = query.data.split("_")
-        week_number = int(data_parts[1])
-        date = data_parts[2]
+        week_number = callback.week
         
-        # Получаем расписание
-        schedule = parser.parse_schedule(group)
+        # Получаем расписание (обновляем, если кеш устарел)
+        with profiling.span("parse_schedule"):
+            schedule = parser.parse_schedule(group)
         if not schedule:
-            await query.edit_message_text(
+            await edit_message(
+                query,
                 f"Не удалось получить расписание для группы {group}",
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("« Назад", callback_data="back_to_menu")]])
+                reply_markup=keyboards.BACK_KEYBOARD
             )
             return CHOOSING_SCHEDULE
         
-        # Ищем нужный день
-        day_schedule = None
-        day_obj = None
-        week_obj = None
-        
-        for week in schedule.weeks:
-            if week.number == week_number:
-                week_obj = week
-                for day in week.days:
-                    if day.date == date:
-                        day_obj = day
-                        break
-                break
-        
-        if not day_obj:
-            await query.edit_message_text(
-                f"Расписание на {date} для группы {group} не найдено",
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("« Назад", callback_data=f"schedule_week_{week_number}")]])
+        # Тексты дней отрендерены заранее, берем по индексу
+        view = render.week_view(group, week_number, schedule, subgroup)
+        day_index = None
+        if view:
+            if callback.date is not None:
+                # Старые кнопки с датой в callback_data
+                day_index = view.day_index.get(callback.date)
+            elif callback.index < len(view.day_texts):
+                day_index = callback.index
+        
+        if day_index is None:
+            await edit_message(
+                query,
+                f"Расписание на этот день для группы {group} не найдено",
+                reply_markup=keyboards.back_to_week_keyboard(week_number)
             )
             return CHOOSING_SCHEDULE
         
-        # Формируем текст расписания на выбранный день
-        result = f"*Расписание группы {group} на {day_obj.date} ({day_obj.weekday})*\n\n"
+        result = view.day_texts[day_index]
         
-        if day_obj.subjects:
-            for subject in day_obj.subjects:
-                result += f"{subject}\n"
-        else:
-            result += "Занятий нет"
+        # Кнопки навигации (пред./след. день, к неделе, в меню) берем из кеша клавиатур
+        reply_markup = keyboards.day_keyboard(group, week_number, day_index, schedule, subgroup) or keyboards.back_to_week_keyboard(week_number)
         
-        # Создаем кнопки навигации
-        keyboard = []
+        await edit_message(
+            query,
+            result,
+            reply_markup=reply_markup,
+            parse_mode="Markdown"
+        )
         
-        # Кнопки для перехода к предыдущему и следующему дню
-        if week_obj:
-            day_index = week_obj.days.index(day_obj)
-            row = []
-            
-            # Кнопка для предыдущего дня
-            if day_index > 0:
-                prev_day = week_obj.days[day_index - 1]
-                row.append(InlineKeyboardButton(
-                    f"« {prev_day.date}",
-                    callback_data=f"day_{week_number}_{prev_day.date}"
-                ))
-            
-            # Кнопка для следующего дня
-            if day_index < len(week_obj.days) - 1:
-                next_day = week_obj.days[day_index + 1]
-                row.append(InlineKeyboardButton(
-                    f"{next_day.date} »",
-                    callback_data=f"day_{week_number}_{next_day.date}"
-                ))
-            
-            if row:
-                keyboard.append(row)
+        return CHOOSING_SCHEDULE
+    except Exception as e:
+        logger.error(f"Ошибка в обработчике show_day_schedule: {e}")
+        try:
+            await edit_message(
+                query,
+                "Произошла ошибка при получении расписания. Пожалуйста, попробуйте еще раз.",
+                reply_markup=keyboards.BACK_KEYBOARD
+            )
+        except:
+            pass
+        return CHOOSING_SCHEDULE
+
+@profiling.traced("show_week_page")
+async def show_week_page(update: Update, context: ContextTypes.DEFAULT_TYPE, callback: callbacks.Callback) -> int:
+    """Показывает страницу недельного расписания."""
+    try:
+        query = update.callback_query
         
-        # Кнопка для возврата к недельному расписанию
-        keyboard.append([InlineKeyboardButton("К неделе", callback_data=f"schedule_week_{week_number}")])
-        keyboard.append([InlineKeyboardButton("« Назад в меню", callback_data="back_to_menu")])
+        user_id = update.effective_user.id
+        groups = _get_user_groups(user_id)
+        group = groups[0] if groups else None
+        subgroup = _get_user_subgroup(user_id, groups)
         
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        if not group:
+            await edit_message(
+                query,
+                "Выберите группу:",
+                reply_markup=keyboards.GROUP_KEYBOARD
+            )
+            return CHOOSING_GROUP
         
-        await query.edit_message_text(
-            result,
-            reply_markup=reply_markup,
+        week_number = callback.week
+        page = callback.index
+        
+        if len(groups) > 1:
+            # Совмещенное расписание нескольких групп листается без кнопок дней
+            pages = _schedule_pages(groups, f"week_{week_number}", subgroup)
+            page = min(page, len(pages) - 1)
+            await edit_message(
+                query,
+                pages[page],
+                reply_markup=keyboards.merged_page_keyboard(week_number, page, len(pages)),
+                parse_mode="Markdown"
+            )
+            return CHOOSING_SCHEDULE
+        
+        with profiling.span("parse_schedule"):
+            schedule = parser.parse_schedule(group)
+        view = render.week_view(group, week_number, schedule, subgroup) if schedule else None
+        
+        if not view:
+            await edit_message(
+                query,
+                f"Расписание на неделю {week_number} для группы {group} не найдено",
+                reply_markup=keyboards.BACK_KEYBOARD
+            )
+            return CHOOSING_SCHEDULE
+        
+        # После обновления расписания страниц могло стать меньше
+        page = min(page, len(view.pages) - 1)
+        
+        await edit_message(
+            query,
+            view.pages[page],
+            reply_markup=keyboards.week_keyboard(group, week_number, page, schedule, subgroup),
             parse_mode="Markdown"
         )
         
         return CHOOSING_SCHEDULE
     except Exception as e:
-        logger.error(f"Ошибка в обработчике show_day_schedule: {e}")
+        logger.error(f"Ошибка в обработчике show_week_page: {e}")
         try:
-            await query.edit_message_text("Произошла ошибка при получении расписания. Пожалуйста, попробуйте еще раз.")
-            keyboard = [
-                [InlineKeyboardButton("« Назад", callback_data="back_to_menu")],
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_reply_markup(reply_markup=reply_markup)
+            await edit_message(
+                query,
+                "Произошла ошибка при получении расписания. Пожалуйста, попробуйте еще раз.",
+                reply_markup=keyboards.BACK_KEYBOARD
+            )
         except:
             pass
         return CHOOSING_SCHEDULE
 
-async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+@profiling.traced("back_to_menu")
+async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, callback: callbacks.Callback) -> int:
     """Возвращает пользователя к меню выбора расписания."""
     try:
         query = update.callback_query
-        await query.answer()
         
         user_id = update.effective_user.id
-        group = db.get_user_group(user_id)
+        groups = _get_user_groups(user_id)
         
-        keyboard = [
-            [
-                InlineKeyboardButton("На сегодня", callback_data="schedule_today"),
-                InlineKeyboardButton("На завтра", callback_data="schedule_tomorrow"),
-            ],
-            [
-                InlineKeyboardButton("Неделя 1", callback_data="schedule_week_1"),
-                InlineKeyboardButton("Неделя 2", callback_data="schedule_week_2"),
-            ],
-            [
-                InlineKeyboardButton("Изменить группу", callback_data="change_group"),
-            ],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        if not groups:
+            # Если группа не выбрана, предлагаем выбрать
+            await edit_message(
+                query,
+                "Выберите группу:",
+                reply_markup=keyboards.GROUP_KEYBOARD
+            )
+            return CHOOSING_GROUP
         
-        await query.edit_message_text(
-            f"Выбрана группа: *{group}*\n\n"
+        reply_markup = keyboards.MAIN_MENU
+        
+        await edit_message(
+            query,
+            f"{_groups_title(groups)}\n\n"
             "Выберите период расписания:",
             reply_markup=reply_markup,
             parse_mode="Markdown"
@@ -379,22 +453,16 @@ async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         logger.error(f"Ошибка в обработчике back_to_menu: {e}")
         return CHOOSING_SCHEDULE
 
-async def change_group(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+@profiling.traced("change_group")
+async def change_group(update: Update, context: ContextTypes.DEFAULT_TYPE, callback: callbacks.Callback) -> int:
     """Возвращает пользователя к выбору группы."""
     try:
         query = update.callback_query
-        await query.answer()
-        
-        keyboard = [
-            [
-                InlineKeyboardButton("ИБ-41", callback_data="group_ИБ-41"),
-                InlineKeyboardButton("ИБ-42", callback_data="group_ИБ-42"),
-                InlineKeyboardButton("ИБ-43", callback_data="group_ИБ-43"),
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(
+        
+        reply_markup = keyboards.GROUP_KEYBOARD
+        
+        await edit_message(
+            query,
             "Выберите вашу группу:",
             reply_markup=reply_markup
         )
@@ -404,195 +472,592 @@ async def change_group(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         logger.error(f"Ошибка в обработчике change_group: {e}")
         return CHOOSING_GROUP
 
+@profiling.traced("toggle_group")
+async def toggle_group(update: Update, context: ContextTypes.DEFAULT_TYPE, callback: callbacks.Callback) -> int:
+    """Добавляет дополнительную группу к расписанию пользователя или убирает ее."""
+    try:
+        query = update.callback_query
+        
+        user_id = update.effective_user.id
+        groups = _get_user_groups(user_id)
+        if not groups:
+            await edit_message(query, "Выберите группу:", reply_markup=keyboards.GROUP_KEYBOARD)
+            return CHOOSING_GROUP
+        
+        if callback.group is None:
+            # Кнопка со старой группой, которой больше нет в списке - показываем актуальный список
+            await edit_message(
+                query,
+                "Этой группы больше нет в списке. Расписание каких групп показывать вместе:",
+                reply_markup=keyboards.groups_keyboard(groups)
+            )
+            return CHOOSING_SCHEDULE
+        
+        if callback.group == groups[0]:
+            await _answer_query(query, "Это основная группа, она меняется кнопкой «Изменить группу»")
+            return CHOOSING_SCHEDULE
+        
+        if callback.group in groups:
+            db.remove_user_group(user_id, callback.group)
+        else:
+            db.add_user_group(user_id, callback.group)
+        groups = _get_user_groups(user_id)
+        
+        await edit_message(
+            query,
+            "Расписание каких групп показывать вместе:",
+            reply_markup=keyboards.groups_keyboard(groups)
+        )
+        
+        return CHOOSING_SCHEDULE
+    except Exception as e:
+        logger.error(f"Ошибка в обработчике toggle_group: {e}")
+        return CHOOSING_SCHEDULE
+
+@profiling.traced("groups_command")
+async def groups_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /groups: выбор дополнительных групп для совмещенного расписания."""
+    try:
+        user_id = update.effective_user.id
+        groups = _get_user_groups(user_id)
+        
+        if not groups:
+            await reply_message(update.message, "Сначала выберите свою группу:", reply_markup=keyboards.GROUP_KEYBOARD)
+            return
+        
+        await reply_message(
+            update.message,
+            "Расписание каких групп показывать вместе:",
+            reply_markup=keyboards.groups_keyboard(groups)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка в обработчике groups_command: {e}")
+        await reply_message(update.message, "Произошла ошибка. Пожалуйста, попробуйте еще раз позже.")
+
+def _subgroup_choice(group: str, subgroup: Optional[str]):
+    # Текст и клавиатура выбора подгруппы; (текст, None) - в расписании группы нет занятий по подгруппам
+    with profiling.span("parse_schedule"):
+        schedule = parser.parse_schedule(group)
+    subgroups = schedule.subgroups() if schedule else []
+    if not subgroups:
+        return f"В расписании группы {group} нет занятий по подгруппам", None
+    current = subgroup if subgroup in subgroups else None
+    return (
+        f"Группа *{group}*. Выберите подгруппу - занятия других подгрупп показываться не будут:",
+        keyboards.subgroups_keyboard(subgroups, current)
+    )
+
+@profiling.traced("subgroup_selected")
+async def subgroup_selected(update: Update, context: ContextTypes.DEFAULT_TYPE, callback: callbacks.Callback) -> int:
+    """Сохраняет подгруппу пользователя и возвращает в меню."""
+    try:
+        query = update.callback_query
+        
+        user_id = update.effective_user.id
+        groups = _get_user_groups(user_id)
+        if not groups:
+            await edit_message(query, "Выберите группу:", reply_markup=keyboards.GROUP_KEYBOARD)
+            return CHOOSING_GROUP
+        
+        if callback.subgroup is not None:
+            with profiling.span("parse_schedule"):
+                schedule = parser.parse_schedule(groups[0])
+            if not schedule or callback.subgroup not in schedule.subgroups():
+                # Старая кнопка (до смены группы или обновления расписания) - такой подгруппы сейчас нет
+                text, reply_markup = _subgroup_choice(groups[0], db.get_user_subgroup(user_id))
+                await edit_message(
+                    query,
+                    f"Подгруппы {callback.subgroup} сейчас нет.\n\n{text}",
+                    parse_mode="Markdown",
+                    reply_markup=reply_markup or keyboards.BACK_KEYBOARD
+                )
+                return CHOOSING_SCHEDULE
+        
+        db.save_user_subgroup(user_id, callback.subgroup)
+        
+        await edit_message(
+            query,
+            f"Выбрана группа: *{render.subgroup_title(groups[0], callback.subgroup)}*\n\n"
+            "Выберите период расписания:",
+            reply_markup=keyboards.MAIN_MENU,
+            parse_mode="Markdown"
+        )
+        
+        return CHOOSING_SCHEDULE
+    except Exception as e:
+        logger.error(f"Ошибка в обработчике subgroup_selected: {e}")
+        return CHOOSING_SCHEDULE
+
+@profiling.traced("subgroup_command")
+async def subgroup_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /subgroup: выбор подгруппы основной группы."""
+    try:
+        user_id = update.effective_user.id
+        groups = _get_user_groups(user_id)
+        
+        if not groups:
+            await reply_message(update.message, "Сначала выберите свою группу:", reply_markup=keyboards.GROUP_KEYBOARD)
+            return
+        
+        with profiling.span("get_user_group"):
+            subgroup = db.get_user_subgroup(user_id)
+        text, reply_markup = _subgroup_choice(groups[0], subgroup)
+        await reply_message(update.message, text, parse_mode="Markdown", reply_markup=reply_markup)
+    except Exception as e:
+        logger.error(f"Ошибка в обработчике subgroup_command: {e}")
+        await reply_message(update.message, "Произошла ошибка. Пожалуйста, попробуйте еще раз позже.")
+
+@profiling.traced("exams_command")
+async def exams_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /exams: ближайшие экзамены и разовые занятия своих групп, /exams all - всех групп."""
+    try:
+        user_id = update.effective_user.id
+        
+        if context.args and context.args[0].lower() in ("all", "все"):
+            groups = list(parser.GROUP_URLS)
+            subgroup = None
+        else:
+            groups = _get_user_groups(user_id)
+            if not groups:
+                await reply_message(update.message, "⚠️ Сначала нужно выбрать группу:", reply_markup=keyboards.GROUP_KEYBOARD)
+                return
+            subgroup = _get_user_subgroup(user_id, groups)
+        
+        # Индекс событий и текст собираются при обновлении расписания, тут берем готовое
+        with profiling.span("render"):
+            text = exams.get_text(groups, subgroup)
+        
+        await reply_message(update.message, text, parse_mode="Markdown")
+    except Exception as e:
+        logger.error(f"Ошибка в обработчике exams_command: {e}")
+        await reply_message(update.message, "Произошла ошибка. Пожалуйста, попробуйте еще раз позже.")
+
+@profiling.traced("find_command")
+async def find_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /find <предмет>: ближайшие занятия по названию, типу или преподавателю."""
+    try:
+        query = " ".join(context.args or [])
+        if not search.tokenize(query):
+            await reply_message(update.message, "Напишите, что искать, например: /find матан")
+            return
+        
+        user_id = update.effective_user.id
+        groups = _get_user_groups(user_id)
+        if not groups:
+            await reply_message(update.message, "⚠️ Сначала нужно выбрать группу:", reply_markup=keyboards.GROUP_KEYBOARD)
+            return
+        subgroup = _get_user_subgroup(user_id, groups)
+        
+        # Индекс по токенам строится при обновлении расписания, тут только поиск по нему
+        with profiling.span("render"):
+            text = search.get_text(groups, query, subgroup)
+        
+        await reply_message(update.message, text, parse_mode="Markdown")
+    except Exception as e:
+        logger.error(f"Ошибка в обработчике find_command: {e}")
+        await reply_message(update.message, "Произошла ошибка. Пожалуйста, попробуйте еще раз позже.")
+
+@profiling.traced("remind_command")
+async def remind_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /remind <минуты>|off: напоминания перед занятиями основной группы."""
+    try:
+        user_id = update.effective_user.id
+        offsets = ", ".join(str(offset) for offset in reminders.REMINDER_OFFSETS)
+        
+        if not context.args:
+            offset = await asyncio.to_thread(db.get_reminder, user_id)
+            current = f"за {offset} мин до занятия" if offset else "выключены"
+            await reply_message(
+                update.message,
+                f"Напоминания {current}.\n\nВключить: /remind <минуты> ({offsets})\nВыключить: /remind off"
+            )
+            return
+        
+        arg = context.args[0].lower()
+        if arg in ("off", "выкл"):
+            await asyncio.to_thread(db.save_reminder, user_id, None)
+            await reply_message(update.message, "🔕 Напоминания выключены")
+            return
+        
+        if not arg.isdigit() or int(arg) not in reminders.REMINDER_OFFSETS:
+            await reply_message(update.message, f"Напоминать можно за {offsets} минут, например: /remind 15")
+            return
+        
+        if not _get_user_groups(user_id):
+            await reply_message(update.message, "⚠️ Сначала нужно выбрать группу:", reply_markup=keyboards.GROUP_KEYBOARD)
+            return
+        
+        # Рассылающий процесс перечитывает подписчиков раз в reminders.SUBSCRIBERS_RELOAD секунд
+        await asyncio.to_thread(db.save_reminder, user_id, int(arg))
+        await reply_message(update.message, f"⏰ Буду напоминать за {arg} мин до занятий основной группы")
+    except Exception as e:
+        logger.error(f"Ошибка в обработчике remind_command: {e}")
+        await reply_message(update.message, "Произошла ошибка. Пожалуйста, попробуйте еще раз позже.")
+
+@profiling.traced("help_command")
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /help."""
     try:
-        keyboard = [
-            [
-                InlineKeyboardButton("ИБ-41", callback_data="group_ИБ-41"),
-                InlineKeyboardButton("ИБ-42", callback_data="group_ИБ-42"),
-                InlineKeyboardButton("ИБ-43", callback_data="group_ИБ-43"),
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = keyboards.GROUP_KEYBOARD
         
         help_text = (
             "🔍 *Справка по боту расписания АлтГТУ*\n\n"
-            "Этот бот позволяет просматривать расписание занятий для групп ИБ-41, ИБ-42, ИБ-43.\n\n"
+            f"Этот бот позволяет просматривать расписание занятий для групп {', '.join(parser.GROUP_URLS)}.\n\n"
             "Выберите группу для начала работы:"
         )
-        await update.message.reply_text(help_text, parse_mode="Markdown", reply_markup=reply_markup)
+        await reply_message(update.message, help_text, parse_mode="Markdown", reply_markup=reply_markup)
     except Exception as e:
         logger.error(f"Ошибка в обработчике help_command: {e}")
-        await update.message.reply_text("Произошла ошибка. Пожалуйста, попробуйте еще раз позже.")
+        await reply_message(update.message, "Произошла ошибка. Пожалуйста, попробуйте еще раз позже.")
 
+@profiling.traced("next_command")
+async def next_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /next: текущее и следующее занятие всех групп пользователя."""
+    try:
+        user_id = update.effective_user.id
+        groups = _get_user_groups(user_id)
+        
+        if not groups:
+            reply_markup = keyboards.GROUP_KEYBOARD
+            
+            await reply_message(
+                update.message,
+                "⚠️ Сначала нужно выбрать группу:",
+                reply_markup=reply_markup
+            )
+            return
+        
+        schedule_text = _now_text(groups)
+        
+        # Добавляем кнопки навигации
+        reply_markup = keyboards.COMMAND_KEYBOARDS["now"]
+        
+        await reply_message(update.message, schedule_text, parse_mode="Markdown", reply_markup=reply_markup)
+    except Exception as e:
+        logger.error(f"Ошибка в обработчике next_command: {e}")
+        await reply_message(update.message, "Произошла ошибка. Пожалуйста, попробуйте еще раз позже.")
+
+@profiling.traced("ics_command")
+async def ics_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /ics - расписание основной группы файлом для календаря (подписка - на одну группу)."""
+    try:
+        user_id = update.effective_user.id
+        with profiling.span("get_user_group"):
+            group = db.get_user_group(user_id)
+        
+        if not group:
+            reply_markup = keyboards.GROUP_KEYBOARD
+            
+            await reply_message(
+                update.message,
+                "⚠️ Сначала нужно выбрать группу:",
+                reply_markup=reply_markup
+            )
+            return
+        
+        with profiling.span("render"):
+            calendar = ics.get_calendar(group)
+        if calendar is None:
+            await reply_message(update.message, f"Не удалось получить расписание для группы {group}")
+            return
+        
+        caption = f"Расписание группы {group} для календаря"
+        url = ics.subscription_url(group)
+        if url:
+            caption += f"\n\nПодписка, которая обновляется сама:\n{url}"
+        
+        # Тот же файл уже загружали - отправляем по file_id без повторной загрузки
+        file_id = ics.cached_file_id(calendar)
+        document = file_id or InputFile(calendar.data, filename=calendar.filename)
+        with profiling.span("send_document"):
+            message = await update.message.reply_document(document=document, caption=caption)
+        if not file_id and message.document:
+            ics.remember_file_id(calendar, message.document.file_id)
+    except Exception as e:
+        logger.error(f"Ошибка в обработчике ics_command: {e}")
+        await reply_message(update.message, "Произошла ошибка. Пожалуйста, попробуйте еще раз позже.")
+
+@profiling.traced("today_command")
 async def today_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /today."""
     try:
         user_id = update.effective_user.id
-        group = db.get_user_group(user_id)
+        groups = _get_user_groups(user_id)
+        group = groups[0] if groups else None
+        subgroup = _get_user_subgroup(user_id, groups)
         
         if not group:
-            keyboard = [
-                [
-                    InlineKeyboardButton("ИБ-41", callback_data="group_ИБ-41"),
-                    InlineKeyboardButton("ИБ-42", callback_data="group_ИБ-42"),
-                    InlineKeyboardButton("ИБ-43", callback_data="group_ИБ-43"),
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = keyboards.GROUP_KEYBOARD
             
-            await update.message.reply_text(
+            await reply_message(
+                update.message,
                 "⚠️ Сначала нужно выбрать группу:",
                 reply_markup=reply_markup
             )
             return
         
-        schedule_text = parser.get_today_schedule(group)
+        schedule_text = _schedule_pages(groups, "today", subgroup)[0]
         
         # Добавляем кнопки навигации
-        keyboard = [
-            [
-                InlineKeyboardButton("На завтра", callback_data="schedule_tomorrow"),
-                InlineKeyboardButton("Неделя 1", callback_data="schedule_week_1"),
-            ],
-            [
-                InlineKeyboardButton("Неделя 2", callback_data="schedule_week_2"),
-                InlineKeyboardButton("Изменить группу", callback_data="change_group"),
-            ],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = keyboards.COMMAND_KEYBOARDS["today"]
         
-        await update.message.reply_text(schedule_text, parse_mode="Markdown", reply_markup=reply_markup)
+        await reply_message(update.message, schedule_text, parse_mode="Markdown", reply_markup=reply_markup)
     except Exception as e:
         logger.error(f"Ошибка в обработчике today_command: {e}")
-        await update.message.reply_text("Произошла ошибка. Пожалуйста, попробуйте еще раз позже.")
+        await reply_message(update.message, "Произошла ошибка. Пожалуйста, попробуйте еще раз позже.")
 
+@profiling.traced("tomorrow_command")
 async def tomorrow_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /tomorrow."""
     try:
         user_id = update.effective_user.id
-        group = db.get_user_group(user_id)
+        groups = _get_user_groups(user_id)
+        group = groups[0] if groups else None
+        subgroup = _get_user_subgroup(user_id, groups)
         
         if not group:
-            keyboard = [
-                [
-                    InlineKeyboardButton("ИБ-41", callback_data="group_ИБ-41"),
-                    InlineKeyboardButton("ИБ-42", callback_data="group_ИБ-42"),
-                    InlineKeyboardButton("ИБ-43", callback_data="group_ИБ-43"),
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = keyboards.GROUP_KEYBOARD
             
-            await update.message.reply_text(
+            await reply_message(
+                update.message,
                 "⚠️ Сначала нужно выбрать группу:",
                 reply_markup=reply_markup
             )
             return
         
-        schedule_text = parser.get_tomorrow_schedule(group)
+        schedule_text = _schedule_pages(groups, "tomorrow", subgroup)[0]
         
         # Добавляем кнопки навигации
-        keyboard = [
-            [
-                InlineKeyboardButton("На сегодня", callback_data="schedule_today"),
-                InlineKeyboardButton("Неделя 1", callback_data="schedule_week_1"),
-            ],
-            [
-                InlineKeyboardButton("Неделя 2", callback_data="schedule_week_2"),
-                InlineKeyboardButton("Изменить группу", callback_data="change_group"),
-            ],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = keyboards.COMMAND_KEYBOARDS["tomorrow"]
         
-        await update.message.reply_text(schedule_text, parse_mode="Markdown", reply_markup=reply_markup)
+        await reply_message(update.message, schedule_text, parse_mode="Markdown", reply_markup=reply_markup)
     except Exception as e:
         logger.error(f"Ошибка в обработчике tomorrow_command: {e}")
-        await update.message.reply_text("Произошла ошибка. Пожалуйста, попробуйте еще раз позже.")
+        await reply_message(update.message, "Произошла ошибка. Пожалуйста, попробуйте еще раз позже.")
 
+@profiling.traced("week1_command")
 async def week1_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /week1."""
     try:
         user_id = update.effective_user.id
-        group = db.get_user_group(user_id)
+        groups = _get_user_groups(user_id)
+        group = groups[0] if groups else None
+        subgroup = _get_user_subgroup(user_id, groups)
         
         if not group:
-            keyboard = [
-                [
-                    InlineKeyboardButton("ИБ-41", callback_data="group_ИБ-41"),
-                    InlineKeyboardButton("ИБ-42", callback_data="group_ИБ-42"),
-                    InlineKeyboardButton("ИБ-43", callback_data="group_ИБ-43"),
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = keyboards.GROUP_KEYBOARD
             
-            await update.message.reply_text(
+            await reply_message(
+                update.message,
                 "⚠️ Сначала нужно выбрать группу:",
                 reply_markup=reply_markup
             )
             return
         
-        schedule_text = parser.get_week_schedule(group, 1)
+        pages = _schedule_pages(groups, "week_1", subgroup)
+        schedule_text = pages[0]
         
-        # Добавляем кнопки навигации
-        keyboard = [
-            [
-                InlineKeyboardButton("На сегодня", callback_data="schedule_today"),
-                InlineKeyboardButton("На завтра", callback_data="schedule_tomorrow"),
-            ],
-            [
-                InlineKeyboardButton("Неделя 2", callback_data="schedule_week_2"),
-                InlineKeyboardButton("Изменить группу", callback_data="change_group"),
-            ],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        # Добавляем кнопки навигации; совмещенное расписание может не влезть в одно сообщение - тогда листание
+        if len(pages) > 1:
+            reply_markup = keyboards.merged_page_keyboard(1, 0, len(pages))
+        else:
+            reply_markup = keyboards.COMMAND_KEYBOARDS["week_1"]
         
-        await update.message.reply_text(schedule_text, parse_mode="Markdown", reply_markup=reply_markup)
+        await reply_message(update.message, schedule_text, parse_mode="Markdown", reply_markup=reply_markup)
     except Exception as e:
         logger.error(f"Ошибка в обработчике week1_command: {e}")
-        await update.message.reply_text("Произошла ошибка. Пожалуйста, попробуйте еще раз позже.")
+        await reply_message(update.message, "Произошла ошибка. Пожалуйста, попробуйте еще раз позже.")
 
+@profiling.traced("week2_command")
 async def week2_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /week2."""
     try:
         user_id = update.effective_user.id
-        group = db.get_user_group(user_id)
+        groups = _get_user_groups(user_id)
+        group = groups[0] if groups else None
+        subgroup = _get_user_subgroup(user_id, groups)
         
         if not group:
-            keyboard = [
-                [
-                    InlineKeyboardButton("ИБ-41", callback_data="group_ИБ-41"),
-                    InlineKeyboardButton("ИБ-42", callback_data="group_ИБ-42"),
-                    InlineKeyboardButton("ИБ-43", callback_data="group_ИБ-43"),
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = keyboards.GROUP_KEYBOARD
             
-            await update.message.reply_text(
+            await reply_message(
+                update.message,
                 "⚠️ Сначала нужно выбрать группу:",
                 reply_markup=reply_markup
             )
             return
         
-        schedule_text = parser.get_week_schedule(group, 2)
+        pages = _schedule_pages(groups, "week_2", subgroup)
+        schedule_text = pages[0]
         
-        # Добавляем кнопки навигации
-        keyboard = [
-            [
-                InlineKeyboardButton("На сегодня", callback_data="schedule_today"),
-                InlineKeyboardButton("На завтра", callback_data="schedule_tomorrow"),
-            ],
-            [
-                InlineKeyboardButton("Неделя 1", callback_data="schedule_week_1"),
-                InlineKeyboardButton("Изменить группу", callback_data="change_group"),
-            ],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        # Добавляем кнопки навигации; совмещенное расписание может не влезть в одно сообщение - тогда листание
+        if len(pages) > 1:
+            reply_markup = keyboards.merged_page_keyboard(2, 0, len(pages))
+        else:
+            reply_markup = keyboards.COMMAND_KEYBOARDS["week_2"]
         
-        await update.message.reply_text(schedule_text, parse_mode="Markdown", reply_markup=reply_markup)
+        await reply_message(update.message, schedule_text, parse_mode="Markdown", reply_markup=reply_markup)
     except Exception as e:
         logger.error(f"Ошибка в обработчике week2_command: {e}")
-        await update.message.reply_text("Произошла ошибка. Пожалуйста, попробуйте еще раз позже.")
+        await reply_message(update.message, "Произошла ошибка. Пожалуйста, попробуйте еще раз позже.")
+
+# Сколько секунд серверы Телеграма могут отдавать закешированный ответ на inline-запрос, не спрашивая бота
+INLINE_CACHE_TIME = 300
+
+# Слова в inline-запросе -> вид расписания
+INLINE_VIEW_WORDS = {
+    "сегодня": "today",
+    "завтра": "tomorrow",
+    "неделя1": "week_1",
+    "неделя2": "week_2",
+    "1": "week_1",
+    "2": "week_2",
+}
+
+def _normalize_group(token: str) -> str:
+    return token.upper().replace(" ", "").replace("-", "")
+
+# "иб42", "ИБ-42" -> "ИБ-42"
+INLINE_GROUPS = {_normalize_group(group): group for group in parser.GROUP_URLS}
+
+def parse_inline_query(text: str):
+    """Разбирает "ИБ-42 завтра" в (группа или None, список видов расписания)"""
+    group = None
+    views = []
+    # "неделя 1" пишут через пробел, склеиваем
+    tokens = text.lower().replace("неделя ", "неделя").split()
+    for token in tokens:
+        if _normalize_group(token) in INLINE_GROUPS:
+            group = INLINE_GROUPS[_normalize_group(token)]
+        elif token in INLINE_VIEW_WORDS and INLINE_VIEW_WORDS[token] not in views:
+            views.append(INLINE_VIEW_WORDS[token])
+    return group, views or list(render.VIEW_TITLES)
+
+async def build_inline_results(text: str, user_id: int):
+    """Собирает результаты inline-запроса из кеша текстов. Возвращает (результаты, зависят ли они от пользователя)."""
+    group, views = parse_inline_query(text)
+
+    # Группа не указана - берем сохраненную группу пользователя, ответ тогда персональный
+    is_personal = group is None
+    if group is None:
+        with profiling.span("get_user_group"):
+            group = db.get_user_group(user_id)
+        if group is None:
+            return [], True
+
+    results = []
+    for view in views:
+        schedule_text = render.cached_text(group, view)
+        if schedule_text is None:
+            # Холодный кеш: один раз загружаем расписание в отдельном потоке, чтобы не блокировать остальных
+            schedule_text = await asyncio.to_thread(render.get_text, group, view)
+        results.append(InlineQueryResultArticle(
+            id=view,
+            title=f"{group}: {render.VIEW_TITLES[view]}",
+            # В описании - начало расписания без заголовка
+            description=" ".join(schedule_text.replace("*", "").splitlines()[1:]).strip()[:100],
+            input_message_content=InputTextMessageContent(schedule_text, parse_mode="Markdown"),
+        ))
+    return results, is_personal
+
+@profiling.traced("inline_query")
+async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик inline-запросов вида "@bot ИБ-42 завтра"."""
+    try:
+        inline_query = update.inline_query
+        results, is_personal = await build_inline_results(inline_query.query, update.effective_user.id)
+
+        button = None
+        if not results:
+            button = InlineQueryResultsButton(text="Выбрать группу в боте", start_parameter="start")
+
+        with profiling.span("answer_inline_query"):
+            await inline_query.answer(
+                results,
+                cache_time=INLINE_CACHE_TIME,
+                is_personal=is_personal,
+                button=button,
+            )
+    except Exception as e:
+        logger.error(f"Ошибка в обработчике inline_query_handler: {e}")
+
+async def trace_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Админская команда /trace [N] - последние N трейсов и сводка по стадиям."""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    try:
+        limit = int(context.args[0]) if context.args else 5
+        text = (
+            f"{profiling.format_traces(limit)}\n\nСводка:\n{profiling.format_summary()}"
+            f"\n\nСайт:\n{circuit.format_status()}"
+            f"\n\n{ratelimit.limiter.status()}"
+            f"\n\nСвежесть расписаний:\n{freshness.format_status()}"
+            f"\n\n{reminders.status()}"
+        )
+        # Телеграм не примет сообщение длиннее 4096 символов
+        await update.message.reply_text(text[-4000:])
+    except Exception as e:
+        logger.error(f"Ошибка в обработчике trace_command: {e}")
+        await update.message.reply_text("Не удалось получить трейсы.")
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Админская команда /profile [секунды] [cprofile|sample] - снимает профиль и присылает файл."""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    try:
+        seconds = float(context.args[0]) if context.args else 30
+        mode = context.args[1] if len(context.args) > 1 else "cprofile"
+        await update.message.reply_text(f"Снимаю профиль ({mode}) {seconds:g} сек...")
+
+        path = await profiling.capture_profile(seconds, mode)
+        if not path:
+            await update.message.reply_text("Профилирование уже запущено.")
+            return
+
+        summary = profiling.summarize_profile(path)
+        with open(path, "rb") as f:
+            await update.message.reply_document(f, caption=f"Профиль сохранен: {path}")
+        await update.message.reply_text(summary[:4000])
+    except Exception as e:
+        logger.error(f"Ошибка в обработчике profile_command: {e}")
+        await update.message.reply_text("Не удалось снять профиль.")
+
+# Фоновая задача просыпается, когда истекает ближайший TTL группы, но не чаще, чем раз в столько секунд
+REFRESH_MIN_SLEEP = 30
+# Пауза между сообщениями при рассылке, чтобы не упереться в лимиты Телеграма (~30 сообщений в секунду)
+NOTIFY_DELAY = 0.05
+
+async def notify_group(bot, group: str, text: str) -> None:
+    """Рассылает уведомление об изменениях пользователям, выбравшим группу."""
+    user_ids = await asyncio.to_thread(db.get_users_by_group, group)
+    logger.info(f"Рассылка изменений группы {group}: {len(user_ids)} пользователей")
+    await notify_users(bot, user_ids, text)
+
+async def notify_users(bot, user_ids, text: str) -> None:
+    """Отправляет один текст пачке пользователей с паузой между сообщениями."""
+    for user_id in user_ids:
+        try:
+            await bot.send_message(user_id, text[:4000], parse_mode="Markdown")
+        except TelegramError as e:
+            # Пользователь мог заблокировать бота - остальным все равно отправляем
+            logger.warning(f"Не удалось отправить уведомление пользователю {user_id}: {e}")
+        await asyncio.sleep(NOTIFY_DELAY)
+
+async def refresh_schedules() -> None:
+    """
+    Фоновое обновление расписаний, чтобы изменения находились без запросов пользователей.
+    Группа перекачивается, когда истек ее TTL (см. freshness.py). Парсинг идет в отдельном потоке, чтобы не блокировать бота.
+    """
+    while True:
+        for group in parser.GROUP_URLS:
+            if parser.seconds_until_stale(group) > 0:
+                continue
+            try:
+                await asyncio.to_thread(parser.parse_schedule, group, False)
+            except Exception as e:
+                logger.error(f"Ошибка при фоновом обновлении расписания группы {group}: {e}")
+        wait = min(parser.seconds_until_stale(group) for group in parser.GROUP_URLS)
+        await asyncio.sleep(min(freshness.MAX_TTL, max(REFRESH_MIN_SLEEP, wait)))
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик ошибок телеграма."""
@@ -603,130 +1068,68 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
         logger.error("Ошибка сети. Повторная попытка через 5 секунд...")
         await asyncio.sleep(5)
 
+async def rate_limit_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Срабатывает раньше всех обработчиков: слишком частые апдейты от одного пользователя дальше не идут."""
+    user = update.effective_user
+    if user is None or user.id in ADMIN_IDS or ratelimit.limiter.allow(user.id):
+        return
+    
+    if update.callback_query:
+        # Только снимаем "часики" с кнопки, без базы, парсера и редактирования сообщения
+        try:
+            await update.callback_query.answer("Слишком часто, подождите пару секунд")
+        except TelegramError:
+            pass
+    raise ApplicationHandlerStop
+
+# Действие из callback_data -> обработчик, см. callbacks.py
+CALLBACK_ROUTES = {
+    callbacks.GROUP: group_selected,
+    callbacks.VIEW: schedule_selected,
+    callbacks.WEEK: schedule_selected,
+    callbacks.DAY: show_day_schedule,
+    callbacks.PAGE: show_week_page,
+    callbacks.MENU: back_to_menu,
+    callbacks.CHANGE_GROUP: change_group,
+    callbacks.TOGGLE_GROUP: toggle_group,
+    callbacks.SUBGROUP: subgroup_selected,
+}
+
+@profiling.traced("button_handler")
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Глобальный обработчик для всех кнопок, которые не попадают в ConversationHandler."""
+    """Глобальный обработчик для всех кнопок: разбирает callback_data и отдает обработчику из CALLBACK_ROUTES."""
     try:
         query = update.callback_query
-        await query.answer()
+        logger.info(f"Получен callback от кнопки: {query.data}")
         
-        # Проверяем тип callback_data
-        data = query.data
-        logger.info(f"Получен callback от кнопки: {data}")
+        callback = callbacks.decode(query.data)
+        handler = CALLBACK_ROUTES.get(callback.action) if callback else None
+        if handler is None:
+            # Неизвестная или испорченная кнопка - просто снимаем "часики"
+            await _answer_query(query)
+            return
         
-        if data.startswith("group_"):
-            # Получаем выбранную группу
-            group = data.split("_")[1]
-            
-            # Сохраняем выбор пользователя в базу данных
-            user_id = update.effective_user.id
-            db.save_user_group(user_id, group)
-            
-            keyboard = [
-                [
-                    InlineKeyboardButton("На сегодня", callback_data="schedule_today"),
-                    InlineKeyboardButton("На завтра", callback_data="schedule_tomorrow"),
-                ],
-                [
-                    InlineKeyboardButton("Неделя 1", callback_data="schedule_week_1"),
-                    InlineKeyboardButton("Неделя 2", callback_data="schedule_week_2"),
-                ],
-                [
-                    InlineKeyboardButton("Изменить группу", callback_data="change_group"),
-                ],
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(
-                f"Выбрана группа: *{group}*\n\n"
-                "Выберите период расписания:",
-                reply_markup=reply_markup,
-                parse_mode="Markdown"
-            )
-            
-        elif data.startswith("schedule_"):
-            # Передаем управление функции schedule_selected
-            await schedule_selected(update, context)
-            
-        elif data.startswith("day_"):
-            # Передаем управление функции show_day_schedule
-            await show_day_schedule(update, context)
-            
-        elif data == "back_to_menu":
-            user_id = update.effective_user.id
-            group = db.get_user_group(user_id)
-            
-            if not group:
-                # Если группа не выбрана, предлагаем выбрать
-                keyboard = [
-                    [
-                        InlineKeyboardButton("ИБ-41", callback_data="group_ИБ-41"),
-                        InlineKeyboardButton("ИБ-42", callback_data="group_ИБ-42"),
-                        InlineKeyboardButton("ИБ-43", callback_data="group_ИБ-43"),
-                    ]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await query.edit_message_text(
-                    "Выберите группу:",
-                    reply_markup=reply_markup
-                )
-                return
-            
-            keyboard = [
-                [
-                    InlineKeyboardButton("На сегодня", callback_data="schedule_today"),
-                    InlineKeyboardButton("На завтра", callback_data="schedule_tomorrow"),
-                ],
-                [
-                    InlineKeyboardButton("Неделя 1", callback_data="schedule_week_1"),
-                    InlineKeyboardButton("Неделя 2", callback_data="schedule_week_2"),
-                ],
-                [
-                    InlineKeyboardButton("Изменить группу", callback_data="change_group"),
-                ],
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(
-                f"Выбрана группа: *{group}*\n\n"
-                "Выберите период расписания:",
-                reply_markup=reply_markup,
-                parse_mode="Markdown"
-            )
-            
-        elif data == "change_group":
-            keyboard = [
-                [
-                    InlineKeyboardButton("ИБ-41", callback_data="group_ИБ-41"),
-                    InlineKeyboardButton("ИБ-42", callback_data="group_ИБ-42"),
-                    InlineKeyboardButton("ИБ-43", callback_data="group_ИБ-43"),
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(
-                "Выберите вашу группу:",
-                reply_markup=reply_markup
-            )
-            
+        await handler(update, context, callback)
     except Exception as e:
         logger.error(f"Ошибка в обработчике button_handler: {e}")
         try:
-            await query.edit_message_text("Произошла ошибка. Пожалуйста, попробуйте еще раз.")
+            await edit_message(query, "Произошла ошибка. Пожалуйста, попробуйте еще раз.")
         except:
             pass
 
-async def main() -> None:
-    """Запускает бота."""
-    # Инициализируем базу данных при запуске
-    db.init_db()
-    
-    # Получаем токен из переменной окружения
-    token = os.getenv("BOT_TOKEN")
-    if not token:
-        logger.error("Токен бота не найден. Проверьте файл .env")
-        return
-    
+# Роль процесса:
+#   standalone - всё в одном процессе, как раньше;
+#   refresher - только ходит на сайт, публикует расписания в общий кеш и рассылает изменения;
+#   worker - только принимает апдейты (через webhook) и берет расписания из общего кеша, таких можно запустить несколько
+BOT_ROLE = os.getenv("BOT_ROLE", "standalone")
+# Webhook вместо polling: обязателен для нескольких воркеров (getUpdates может читать только один процесс)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+
+def build_application(token: str) -> Application:
+    """Создает приложение и регистрирует обработчики."""
     # Настройка параметров запроса с увеличенными тайм-аутами
     request = HTTPXRequest(
         connection_pool_size=8,
@@ -736,13 +1139,21 @@ async def main() -> None:
     )
     
 
-    application = Application.builder().token(token).request(request).build()
+    builder = Application.builder().token(token).request(request)
+    # Можно направить бота на свой Bot API сервер или на фейковый из loadtest.py
+    if os.getenv("BOT_API_BASE_URL"):
+        builder = builder.base_url(os.getenv("BOT_API_BASE_URL"))
+    application = builder.build()
     
    
     application.add_error_handler(error_handler)
     
+    # Группа -1 обрабатывается раньше остальных
+    application.add_handler(TypeHandler(Update, rate_limit_handler), group=-1)
+    
     
     application.add_handler(CallbackQueryHandler(button_handler))
+    application.add_handler(InlineQueryHandler(inline_query_handler))
     
     # Создаем conversation handler, но не добавляем его в бота
     # Вместо этого переходим на глобальный обработчик кнопок
@@ -765,17 +1176,128 @@ async def main() -> None:
     # Добавляем только обработчики команд
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("next", next_command))
+    application.add_handler(CommandHandler("ics", ics_command))
     application.add_handler(CommandHandler("today", today_command))
     application.add_handler(CommandHandler("tomorrow", tomorrow_command))
     application.add_handler(CommandHandler("week1", week1_command))
     application.add_handler(CommandHandler("week2", week2_command))
+    application.add_handler(CommandHandler("groups", groups_command))
+    application.add_handler(CommandHandler("subgroup", subgroup_command))
+    application.add_handler(CommandHandler("exams", exams_command))
+    application.add_handler(CommandHandler("find", find_command))
+    application.add_handler(CommandHandler("remind", remind_command))
+    application.add_handler(CommandHandler("trace", trace_command))
+    application.add_handler(CommandHandler("profile", profile_command))
+    
+    return application
+
+async def _startup_phase(name: str, coro):
+    with profiling.startup_phase(name):
+        return await coro
+
+def _prepare_storage() -> None:
+    """База пользователей и последние расписания с диска - всё, что нужно до первого апдейта, без сети"""
+    with profiling.startup_phase("init_db+warm_cache"):
+        db.init_db()
+        shared_cache.init_store()
+        if BOT_ROLE != "refresher":
+            usage.init_store()
+        loaded = parser.warm_cache()
+    logger.info(f"Из общего кеша загружено расписаний: {loaded}")
+
+async def first_update_served(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Последняя группа обработчиков: отмечает, когда обслужен первый апдейт (только с --profile-startup)."""
+    if profiling.mark_first_update():
+        logger.info(f"Отчет о запуске:\n{profiling.format_startup_report(STARTED_AT)}")
+
+async def main(profile_startup: bool = False) -> None:
+    """Запускает бота."""
+    if BOT_ROLE not in ("standalone", "refresher", "worker"):
+        logger.error(f"Неизвестная роль BOT_ROLE={BOT_ROLE}, ожидается standalone, refresher или worker")
+        return
     
-    # Инициализируем бота и запускаем приложение
-    await application.initialize()
-    await application.start()
-    await application.updater.start_polling(poll_interval=0.5, timeout=30, drop_pending_updates=True)
+    # Получаем токен из переменной окружения
+    token = os.getenv("BOT_TOKEN")
+    if not token:
+        logger.error("Токен бота не найден. Проверьте файл .env")
+        return
+    
+    if BOT_ROLE == "worker":
+        # Воркер на сайт не ходит вообще
+        parser.FETCH_ENABLED = False
+    if BOT_ROLE == "refresher":
+        # Пользователи приходят в воркеры, так что популярность групп здесь не видна - TTL только по изменениям
+        freshness.USE_POPULARITY = False
+    
+    # База, расписания с диска и подготовка клиента Телеграма друг от друга не зависят - делаем всё одновременно.
+    # База и диск идут в потоке, пока основной поток собирает приложение (httpx долго создает SSL-контексты).
+    # run_in_executor отдает задачу в поток сразу, а не при первом await, как asyncio.to_thread
+    storage = asyncio.get_running_loop().run_in_executor(None, _prepare_storage)
+    with profiling.startup_phase("build_application"):
+        application = build_application(token)
+    if profile_startup:
+        application.add_handler(TypeHandler(Update, first_update_served), group=100)
+    
+    await asyncio.gather(storage, _startup_phase("application.initialize", application.initialize()))
+    
+    if BOT_ROLE != "worker":
+        # Каждое скачанное расписание сохраняется в общий кеш: воркерам и для быстрого перезапуска.
+        # Подписываемся после прогрева, чтобы не переписывать только что прочитанное.
+        parser.add_refresh_listener(shared_cache.publish)
+        # requests/bs4/lxml грузим в фоне, чтобы первый поход на сайт за них не платил
+        asyncio.create_task(_startup_phase("preload_fetch_stack", asyncio.to_thread(parser.preload_fetch_stack)))
+    
+    with profiling.startup_phase("application.start"):
+        await application.start()
     
-    logger.info("Бот запущен. Нажмите Ctrl+C для остановки.")
+    loop = asyncio.get_running_loop()
+    refresh_task = None
+    reminder_task = None
+    
+    if BOT_ROLE != "worker":
+        # Изменения в расписании находятся в потоке парсера, а рассылка идет в event loop
+        def on_schedule_changes(group, changes):
+            text = diff.format_changes(group, changes)
+            loop.call_soon_threadsafe(lambda: application.create_task(notify_group(application.bot, group, text)))
+        
+        diff.add_change_listener(on_schedule_changes)
+        refresh_task = asyncio.create_task(refresh_schedules())
+        # Напоминания рассылает тот же процесс, что обновляет расписания: таймеры пересобираются по его обновлениям
+        reminder_task = asyncio.create_task(
+            reminders.run(lambda user_ids, text: notify_users(application.bot, user_ids, text))
+        )
+    
+    usage_task = None
+    if BOT_ROLE != "refresher":
+        # Журнал использования: события копятся в памяти, в базу уходят пачками из фоновой задачи
+        profiling.add_trace_listener(usage.record)
+        usage_task = asyncio.create_task(usage.run())
+        ics.start_http_server()
+        with profiling.startup_phase("updater.start"):
+            if WEBHOOK_URL:
+                await application.updater.start_webhook(
+                    listen=WEBHOOK_LISTEN,
+                    port=WEBHOOK_PORT,
+                    url_path=token,
+                    webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{token}",
+                    secret_token=WEBHOOK_SECRET,
+                )
+            else:
+                # poll_interval=0: при long polling пауза между getUpdates только добавляет задержку к каждому апдейту
+                await application.updater.start_polling(poll_interval=0, timeout=30, drop_pending_updates=True)
+    
+    # SIGUSR1 - дамп трейсов в лог, SIGUSR2 - профиль cProfile на 30 секунд (только на Unix)
+    if hasattr(signal, "SIGUSR1"):
+        loop.add_signal_handler(signal.SIGUSR1, profiling.dump_traces_to_log)
+        loop.add_signal_handler(signal.SIGUSR2, lambda: application.create_task(profiling.capture_profile(30)))
+    
+    profiling.record_startup_phase("ready", STARTED_AT)
+    logger.info(f"Бот запущен (роль: {BOT_ROLE}). Нажмите Ctrl+C для остановки.")
+    if profile_startup:
+        logger.info(f"Отчет о запуске:\n{profiling.format_startup_report(STARTED_AT)}")
+        report = await asyncio.to_thread(profiling.importtime_report, "bot")
+        logger.info(f"Импорты:\n{report}")
     
     # Держим приложение запущенным до сигнала остановки
     try:
@@ -784,8 +1306,26 @@ async def main() -> None:
         logger.info("Остановка бота...")
     finally:
         # Корректно останавливаем бота
+        if refresh_task:
+            refresh_task.cancel()
+        if reminder_task:
+            reminder_task.cancel()
+        if usage_task:
+            usage_task.cancel()
+            await usage.flush()
+        if application.updater.running:
+            await application.updater.stop()
         await application.stop()
         await application.shutdown()
 
+def parse_args(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Бот расписания АлтГТУ")
+    arg_parser.add_argument(
+        "--profile-startup", action="store_true",
+        help="вывести в лог время фаз запуска, время до первого обслуженного апдейта и самые дорогие импорты"
+    )
+    return arg_parser.parse_args(argv)
+
 if __name__ == "__main__":
-    asyncio.run(main()) 
+    args = parse_args()
+    asyncio.run(main(profile_startup=args.profile_startup))
@@ -0,0 +1,180 @@
+import logging
+import re
+import zlib
+from typing import Dict, Optional
+import parser
+
+# Компактный формат callback_data кнопок: один символ действия + числовые поля в base36 через точку.
+# Например "g2vk8qgb" - выбор группы, "d1.3" - день 3 недели 1, "p2.1" - страница 1 недели 2.
+# Группа кодируется числовым id (id группы на сайте), поэтому длина не зависит от названия
+# и укладывается в лимит Телеграма в 64 байта при любом количестве групп.
+logger = logging.getLogger(__name__)
+
+# Действия - первый символ callback_data, по нему бот выбирает обработчик
+GROUP = "g"
+VIEW = "v"
+WEEK = "w"
+PAGE = "p"
+DAY = "d"
+MENU = "b"
+CHANGE_GROUP = "c"
+# Добавить/убрать дополнительную группу
+TOGGLE_GROUP = "a"
+# Выбор подгруппы: "sА" - подгруппа А, просто "s" - вся группа
+SUBGROUP = "s"
+
+# Лимит Телеграма на callback_data
+MAX_CALLBACK_BYTES = 64
+
+# Виды расписания, которые не зависят от номера недели
+VIEW_CODES = {"now": "n", "today": "t", "tomorrow": "m"}
+_VIEWS_BY_CODE = {code: view for view, code in VIEW_CODES.items()}
+
+_SITE_ID_RE = re.compile(r"/(\d+)/?$")
+
+
+class Callback:
+    """Разобранная callback_data. Поля, которые для действия не нужны, остаются None."""
+    __slots__ = ("action", "group", "view", "week", "index", "date", "subgroup")
+
+    def __init__(self, action: str, group: Optional[str] = None, view: Optional[str] = None,
+                 week: Optional[int] = None, index: Optional[int] = None, date: Optional[str] = None,
+                 subgroup: Optional[str] = None):
+        self.action = action
+        self.group = group
+        self.view = view
+        self.week = week
+        self.index = index
+        # Только для старых кнопок дня вида day_1_14.10.25
+        self.date = date
+        self.subgroup = subgroup
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__ if getattr(self, name) is not None)
+        return f"Callback({fields})"
+
+
+def _to_base36(number: int) -> str:
+    if number < 0:
+        raise ValueError(f"Отрицательное число в callback_data: {number}")
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    result = ""
+    while True:
+        number, remainder = divmod(number, 36)
+        result = digits[remainder] + result
+        if number == 0:
+            return result
+
+
+def group_id(group: str) -> int:
+    """Стабильный id группы: id страницы на сайте, а если его нет в ссылке - crc32 названия"""
+    match = _SITE_ID_RE.search(parser.GROUP_URLS.get(group, ""))
+    if match:
+        return int(match.group(1))
+    return zlib.crc32(group.encode("utf-8"))
+
+
+def _build_groups_by_id() -> Dict[int, str]:
+    groups_by_id: Dict[int, str] = {}
+    for group in parser.GROUP_URLS:
+        number = group_id(group)
+        # Совпавший id (одна ссылка на сайт или коллизия crc32) - кнопка одной группы выбирала бы другую
+        if number in groups_by_id:
+            raise ValueError(f"У групп {groups_by_id[number]} и {group} одинаковый id в callback_data: {number}")
+        groups_by_id[number] = group
+    return groups_by_id
+
+
+_groups_by_id: Dict[int, str] = _build_groups_by_id()
+
+
+def encode_group(group: str) -> str:
+    return GROUP + _to_base36(group_id(group))
+
+
+def encode_toggle_group(group: str) -> str:
+    return TOGGLE_GROUP + _to_base36(group_id(group))
+
+
+def encode_subgroup(subgroup: Optional[str]) -> str:
+    return SUBGROUP + (subgroup or "")
+
+
+def encode_view(view: str) -> str:
+    """now/today/tomorrow/week_N"""
+    if view.startswith("week_"):
+        return encode_week(int(view.split("_")[1]))
+    return VIEW + VIEW_CODES[view]
+
+
+def encode_week(week: int) -> str:
+    return WEEK + _to_base36(week)
+
+
+def encode_page(week: int, page: int) -> str:
+    return f"{PAGE}{_to_base36(week)}.{_to_base36(page)}"
+
+
+def encode_day(week: int, index: int) -> str:
+    return f"{DAY}{_to_base36(week)}.{_to_base36(index)}"
+
+
+def _decode_legacy(data: str) -> Optional[Callback]:
+    # Кнопки, отправленные до перехода на компактный формат, еще висят в чатах
+    if data == "back_to_menu":
+        return Callback(MENU)
+    if data == "change_group":
+        return Callback(CHANGE_GROUP)
+    if data.startswith("group_"):
+        group = data[len("group_"):]
+        return Callback(GROUP, group=group if group in parser.GROUP_URLS else None)
+    if data.startswith("schedule_week_"):
+        return Callback(WEEK, week=int(data[len("schedule_week_"):]))
+    if data.startswith("schedule_"):
+        view = data[len("schedule_"):]
+        return Callback(VIEW, view=view) if view in VIEW_CODES else None
+    if data.startswith("day_"):
+        week, day_key = data[len("day_"):].split("_", 1)
+        if "." in day_key:
+            return Callback(DAY, week=int(week), date=day_key)
+        return Callback(DAY, week=int(week), index=int(day_key))
+    if data.startswith("page_"):
+        week, page = data[len("page_"):].split("_", 1)
+        return Callback(PAGE, week=int(week), index=int(page))
+    return None
+
+
+def decode(data: str) -> Optional[Callback]:
+    """Разбирает callback_data. None - если формат неизвестен или поврежден."""
+    if not data:
+        return None
+    try:
+        # В компактном формате "_" не бывает
+        if "_" in data:
+            callback = _decode_legacy(data)
+            if callback is not None:
+                return callback
+            raise ValueError(data)
+
+        action, payload = data[0], data[1:]
+        if action in (MENU, CHANGE_GROUP):
+            return Callback(action)
+        if action in (GROUP, TOGGLE_GROUP):
+            # Неизвестный id (группу убрали из списка) - group=None, обработчик предложит выбрать заново
+            return Callback(action, group=_groups_by_id.get(int(payload, 36)))
+        if action == SUBGROUP:
+            if len(payload) > 1 or (payload and not payload.isupper()):
+                raise ValueError(payload)
+            return Callback(SUBGROUP, subgroup=payload or None)
+        if action == VIEW:
+            view = _VIEWS_BY_CODE.get(payload)
+            return Callback(VIEW, view=view) if view else None
+        if action == WEEK:
+            return Callback(WEEK, week=int(payload, 36))
+        if action in (PAGE, DAY):
+            week, index = payload.split(".", 1)
+            return Callback(action, week=int(week, 36), index=int(index, 36))
+    except ValueError:
+        pass
+    logger.warning(f"Не удалось разобрать callback_data: {data!r}")
+    return None
@@ -0,0 +1,111 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, Tuple
+from urllib.parse import urlparse
+
+# Circuit breaker для сайта с расписанием: если сайт лежит, не ждем тайм-аутов на каждом запросе,
+# а сразу отдаем кеш. Плюс тайм-ауты подстраиваются под реально наблюдаемое время ответа сайта.
+logger = logging.getLogger(__name__)
+
+# Сколько подряд неудачных запросов открывают цепь
+FAILURE_THRESHOLD = 3
+# Через сколько секунд после открытия пробуем сайт одним запросом (half-open)
+RECOVERY_TIMEOUT = 60
+# Тайм-ауты по умолчанию, пока замеров мало, и их границы, секунды
+DEFAULT_TIMEOUTS = (10.0, 30.0)
+MIN_TIMEOUT = 2.0
+# Сколько последних замеров держим и сколько нужно, чтобы им доверять
+LATENCY_WINDOW = 50
+MIN_SAMPLES = 10
+# Тайм-аут = p95 времени ответа * множитель
+TIMEOUT_MULTIPLIER = 3
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+
+class CircuitBreaker:
+    """Состояние одного хоста: closed - ходим как обычно, open - сразу отказ, half-open - пропускаем одну пробу"""
+    def __init__(self, host: str):
+        self.host = host
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.latencies: deque = deque(maxlen=LATENCY_WINDOW)
+        self.lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """Можно ли сейчас идти на сайт"""
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= RECOVERY_TIMEOUT:
+                logger.info(f"Цепь для {self.host} переходит в half-open, пробуем один запрос")
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            return False
+
+    def is_open(self) -> bool:
+        return self.state != CLOSED
+
+    def record_success(self, latency: float) -> None:
+        with self.lock:
+            self.latencies.append(latency)
+            if self.state != CLOSED:
+                logger.info(f"Сайт {self.host} снова отвечает, цепь закрыта")
+            self.state = CLOSED
+            self.failures = 0
+            self.probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            self.probe_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= FAILURE_THRESHOLD:
+                if self.state != OPEN:
+                    logger.warning(f"Сайт {self.host} недоступен ({self.failures} ошибок подряд), цепь открыта на {RECOVERY_TIMEOUT} сек")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def timeouts(self) -> Tuple[float, float]:
+        """(connect, read) тайм-ауты по p95 последних замеров, в пределах от MIN_TIMEOUT до значений по умолчанию"""
+        with self.lock:
+            if len(self.latencies) < MIN_SAMPLES:
+                return DEFAULT_TIMEOUTS
+            ordered = sorted(self.latencies)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        adaptive = p95 * TIMEOUT_MULTIPLIER
+        return (
+            min(DEFAULT_TIMEOUTS[0], max(MIN_TIMEOUT, adaptive)),
+            min(DEFAULT_TIMEOUTS[1], max(MIN_TIMEOUT, adaptive)),
+        )
+
+    def status(self) -> str:
+        connect_timeout, read_timeout = self.timeouts()
+        return (
+            f"{self.host}: {self.state}, ошибок подряд: {self.failures}, "
+            f"тайм-ауты: {connect_timeout:.1f}/{read_timeout:.1f} сек, замеров: {len(self.latencies)}"
+        )
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(url: str) -> CircuitBreaker:
+    """Один breaker на хост: если сайт лежит, то для всех групп сразу"""
+    host = urlparse(url).netloc
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker(host)
+        return _breakers[host]
+
+
+def format_status() -> str:
+    if not _breakers:
+        return "Запросов к сайту еще не было"
+    return "\n".join(breaker.status() for breaker in _breakers.values())
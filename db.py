@@ -1,7 +1,11 @@
 import sqlite3
 import os
+import sys
+import csv
+import time
 import logging
-from typing import Optional
+import argparse
+from typing import Optional, List, Iterator, Tuple
 
 
 # Объективно тут БД не нужна, эт прост моя шиза, можно использовать и массивы (см bot.py) 
@@ -10,6 +14,8 @@ logger = logging.getLogger(__name__)
 
 # Путь к базе данных
 DB_PATH = "users.db"
+# Сколько строк читаем за раз и сколько строк меняем в одной транзакции в админских операциях
+BATCH_SIZE = 1000
 
 def init_db() -> None:
     
@@ -28,7 +34,37 @@ def init_db() -> None:
         CREATE TABLE IF NOT EXISTS users (
             user_id INTEGER PRIMARY KEY,
             group_name TEXT NOT NULL,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            subgroup TEXT,
+            last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        # Подгруппа (буква, NULL - вся группа) и время последнего обращения появились позже таблицы - дописываем колонки в старые базы
+        cursor.execute("PRAGMA table_info(users)")
+        columns = [row[1] for row in cursor.fetchall()]
+        if "subgroup" not in columns:
+            cursor.execute("ALTER TABLE users ADD COLUMN subgroup TEXT")
+        if "last_seen" not in columns:
+            # ALTER TABLE не умеет DEFAULT CURRENT_TIMESTAMP - до первого обращения считаем последним время выбора группы
+            cursor.execute("ALTER TABLE users ADD COLUMN last_seen TIMESTAMP")
+            cursor.execute("UPDATE users SET last_seen = updated_at")
+        # Индексы для рассылки по группе и для чистки неактивных пользователей
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_group_name ON users (group_name)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_last_seen ON users (last_seen)")
+        # Дополнительные группы пользователя (майнор, факультатив) сверх основной из users
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_groups (
+            user_id INTEGER NOT NULL,
+            group_name TEXT NOT NULL,
+            PRIMARY KEY (user_id, group_name)
+        )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_groups_group_name ON user_groups (group_name)")
+        # Напоминания перед занятиями основной группы: за сколько минут
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reminders (
+            user_id INTEGER PRIMARY KEY,
+            offset_minutes INTEGER NOT NULL
         )
         ''')
         
@@ -52,17 +88,18 @@ def save_user_group(user_id: int, group_name: str) -> bool:
         result = cursor.fetchone()
         
         if result:
-            # Обновляем существующую запись
+            # Обновляем существующую запись. Подгруппы у другой группы свои - при смене группы подгруппу сбрасываем
             cursor.execute("""
             UPDATE users 
-            SET group_name = ?, updated_at = CURRENT_TIMESTAMP 
+            SET group_name = ?, subgroup = CASE WHEN group_name = ? THEN subgroup END,
+                updated_at = CURRENT_TIMESTAMP, last_seen = CURRENT_TIMESTAMP 
             WHERE user_id = ?
-            """, (group_name, user_id))
+            """, (group_name, group_name, user_id))
         else:
             # Создаем новую запись
             cursor.execute("""
-            INSERT INTO users (user_id, group_name) 
-            VALUES (?, ?)
+            INSERT INTO users (user_id, group_name, last_seen) 
+            VALUES (?, ?, CURRENT_TIMESTAMP)
             """, (user_id, group_name))
         
         conn.commit()
@@ -98,6 +135,167 @@ def get_user_group(user_id: int) -> Optional[str]:
         if conn:
             conn.close()
 
+def get_user_groups(user_id: int) -> List[str]:
+    """Основная группа пользователя первой, за ней дополнительные в порядке добавления. [] - группа не выбрана."""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT group_name FROM users WHERE user_id = ?", (user_id,))
+        result = cursor.fetchone()
+        if not result:
+            return []
+        
+        groups = [result[0]]
+        cursor.execute("SELECT group_name FROM user_groups WHERE user_id = ? ORDER BY rowid", (user_id,))
+        groups.extend(row[0] for row in cursor.fetchall() if row[0] != result[0])
+        return groups
+    except Exception as e:
+        logger.error(f"Ошибка при получении групп пользователя: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+def get_user_subgroup(user_id: int) -> Optional[str]:
+    """Подгруппа пользователя в основной группе, None - вся группа"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT subgroup FROM users WHERE user_id = ?", (user_id,))
+        result = cursor.fetchone()
+        return result[0] if result else None
+    except Exception as e:
+        logger.error(f"Ошибка при получении подгруппы пользователя: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+def save_user_subgroup(user_id: int, subgroup: Optional[str]) -> bool:
+    """Сохраняет подгруппу пользователя, None - показывать занятия всех подгрупп"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
+        
+        cursor.execute(
+            "UPDATE users SET subgroup = ?, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?",
+            (subgroup, user_id)
+        )
+        
+        conn.commit()
+        logger.info(f"Подгруппа {subgroup} сохранена для пользователя {user_id}")
+        return cursor.rowcount > 0
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении подгруппы пользователя: {e}")
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+def get_reminder(user_id: int) -> Optional[int]:
+    """За сколько минут до занятия напоминать пользователю, None - напоминания выключены"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT offset_minutes FROM reminders WHERE user_id = ?", (user_id,))
+        result = cursor.fetchone()
+        return result[0] if result else None
+    except Exception as e:
+        logger.error(f"Ошибка при получении напоминания пользователя: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+def save_reminder(user_id: int, offset_minutes: Optional[int]) -> bool:
+    """Включает напоминания за offset_minutes минут до занятия, None - выключает"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
+        
+        if offset_minutes is None:
+            cursor.execute("DELETE FROM reminders WHERE user_id = ?", (user_id,))
+        else:
+            cursor.execute(
+                "INSERT OR REPLACE INTO reminders (user_id, offset_minutes) VALUES (?, ?)",
+                (user_id, offset_minutes)
+            )
+        
+        conn.commit()
+        logger.info(f"Напоминание за {offset_minutes} мин сохранено для пользователя {user_id}")
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении напоминания пользователя: {e}")
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+def get_reminder_subscribers() -> List[Tuple[int, str, Optional[str], int]]:
+    """Все, кто включил напоминания: (user_id, основная группа, подгруппа, за сколько минут)"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
+        
+        cursor.execute(
+            "SELECT r.user_id, u.group_name, u.subgroup, r.offset_minutes "
+            "FROM reminders r JOIN users u ON u.user_id = r.user_id"
+        )
+        return cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Ошибка при получении подписчиков на напоминания: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+def add_user_group(user_id: int, group_name: str) -> bool:
+    """Добавляет пользователю дополнительную группу"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
+        
+        cursor.execute("INSERT OR IGNORE INTO user_groups (user_id, group_name) VALUES (?, ?)", (user_id, group_name))
+        
+        conn.commit()
+        logger.info(f"Дополнительная группа {group_name} добавлена пользователю {user_id}")
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при добавлении группы пользователю: {e}")
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+def remove_user_group(user_id: int, group_name: str) -> bool:
+    """Убирает у пользователя дополнительную группу"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
+        
+        cursor.execute("DELETE FROM user_groups WHERE user_id = ? AND group_name = ?", (user_id, group_name))
+        
+        conn.commit()
+        logger.info(f"Дополнительная группа {group_name} убрана у пользователя {user_id}")
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при удалении группы пользователя: {e}")
+        return False
+    finally:
+        if conn:
+            conn.close()
+
 def delete_user_data(user_id: int) -> bool:
     
     conn = None
@@ -106,6 +304,8 @@ def delete_user_data(user_id: int) -> bool:
         cursor = conn.cursor()
         
         cursor.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+        cursor.execute("DELETE FROM user_groups WHERE user_id = ?", (user_id,))
+        cursor.execute("DELETE FROM reminders WHERE user_id = ?", (user_id,))
         
         conn.commit()
         logger.info(f"Данные пользователя {user_id} удалены")
@@ -134,4 +334,246 @@ def get_all_users() -> list:
         return []
     finally:
         if conn:
-            conn.close() 
+            conn.close()
+
+def get_users_by_group(group_name: str) -> List[int]:
+    """Все, у кого группа основная или дополнительная - для рассылки изменений"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
+        
+        cursor.execute(
+            "SELECT user_id FROM users WHERE group_name = ? "
+            "UNION SELECT user_id FROM user_groups WHERE group_name = ?",
+            (group_name, group_name)
+        )
+        user_ids = [row[0] for row in cursor.fetchall()]
+        
+        logger.info(f"Получено {len(user_ids)} пользователей группы {group_name}")
+        return user_ids
+    except Exception as e:
+        logger.error(f"Ошибка при получении пользователей группы: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+
+def iter_users(group_name: Optional[str] = None, batch_size: int = BATCH_SIZE) -> Iterator[Tuple[int, str, str]]:
+    """Пользователи (user_id, group_name, updated_at) порциями, не загружая всю таблицу в память"""
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        cursor = conn.cursor()
+        if group_name is None:
+            cursor.execute("SELECT user_id, group_name, updated_at FROM users")
+        else:
+            cursor.execute("SELECT user_id, group_name, updated_at FROM users WHERE group_name = ?", (group_name,))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+def count_users_by_group() -> List[Tuple[str, int]]:
+    
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
+        
+        # Идет по индексу idx_users_group_name, таблицу не читает
+        cursor.execute("SELECT group_name, COUNT(*) FROM users GROUP BY group_name ORDER BY group_name")
+        return cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Ошибка при подсчете пользователей по группам: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+def _batched_change(sql: str, params: tuple, batch_size: int) -> int:
+    """
+    Выполняет UPDATE/DELETE порциями по batch_size строк, каждая порция - своя транзакция,
+    чтобы бот не ждал блокировку базы всё время операции. sql должен менять строки из подзапроса с LIMIT ?.
+    """
+    conn = None
+    total = 0
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
+        while True:
+            cursor.execute(sql, params + (batch_size,))
+            conn.commit()
+            total += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                break
+        return total
+    finally:
+        if conn:
+            conn.close()
+
+def touch_users(user_ids) -> None:
+    """Отмечает, что пользователи обращались к боту сейчас (last_seen). Вызывается пачкой из журнала использования."""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        conn.executemany(
+            "UPDATE users SET last_seen = CURRENT_TIMESTAMP WHERE user_id = ?",
+            [(user_id,) for user_id in user_ids]
+        )
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении времени последнего обращения: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+def count_inactive_users(days: int) -> int:
+    
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM users WHERE last_seen < datetime('now', ?)", (f"-{days} days",))
+        return cursor.fetchone()[0]
+    finally:
+        if conn:
+            conn.close()
+
+def delete_inactive_users(days: int, batch_size: int = BATCH_SIZE) -> int:
+    """Удаляет пользователей, которые не обращались к боту больше days дней. Возвращает, сколько удалено."""
+    deleted = _batched_change(
+        "DELETE FROM users WHERE rowid IN ("
+        "SELECT rowid FROM users WHERE last_seen < datetime('now', ?) LIMIT ?)",
+        (f"-{days} days",),
+        batch_size,
+    )
+    # Дополнительные группы и напоминания удаленных пользователей
+    _batched_change(
+        "DELETE FROM user_groups WHERE rowid IN ("
+        "SELECT rowid FROM user_groups WHERE user_id NOT IN (SELECT user_id FROM users) LIMIT ?)",
+        (),
+        batch_size,
+    )
+    _batched_change(
+        "DELETE FROM reminders WHERE rowid IN ("
+        "SELECT rowid FROM reminders WHERE user_id NOT IN (SELECT user_id FROM users) LIMIT ?)",
+        (),
+        batch_size,
+    )
+    logger.info(f"Удалено неактивных пользователей (больше {days} дней): {deleted}")
+    return deleted
+
+def migrate_group(old_group: str, new_group: str, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Переносит всех пользователей группы old_group в new_group (например, после переименования группы).
+    ValueError - если группы совпадают или new_group нет в списке групп бота.
+    """
+    import parser
+    if old_group == new_group:
+        raise ValueError(f"Группа {old_group} переносится сама в себя")
+    if new_group not in parser.GROUP_URLS:
+        raise ValueError(f"Группы {new_group} нет в списке групп бота: {', '.join(parser.GROUP_URLS)}")
+    # updated_at и last_seen не трогаем: перенос делает админ, а не пользователь
+    moved = _batched_change(
+        "UPDATE users SET group_name = ? WHERE rowid IN ("
+        "SELECT rowid FROM users WHERE group_name = ? LIMIT ?)",
+        (new_group, old_group),
+        batch_size,
+    )
+    # Дополнительные группы: у кого new_group уже есть, старая запись просто удаляется
+    _batched_change(
+        "UPDATE user_groups SET group_name = ? WHERE rowid IN ("
+        "SELECT rowid FROM user_groups WHERE group_name = ? "
+        "AND user_id NOT IN (SELECT user_id FROM user_groups WHERE group_name = ?) LIMIT ?)",
+        (new_group, old_group, new_group),
+        batch_size,
+    )
+    # Остались только записи тех, у кого new_group уже была - они дублируют ее
+    _batched_change(
+        "DELETE FROM user_groups WHERE rowid IN ("
+        "SELECT rowid FROM user_groups WHERE group_name = ? "
+        "AND user_id IN (SELECT user_id FROM user_groups WHERE group_name = ?) LIMIT ?)",
+        (old_group, new_group),
+        batch_size,
+    )
+    logger.info(f"Пользователей перенесено из группы {old_group} в {new_group}: {moved}")
+    return moved
+
+
+def _cmd_counts(args) -> None:
+    rows = count_users_by_group()
+    for group_name, count in rows:
+        print(f"{group_name}\t{count}")
+    print(f"Всего: {sum(count for _, count in rows)}")
+
+def _cmd_export(args) -> None:
+    output = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+    try:
+        writer = csv.writer(output)
+        writer.writerow(["user_id", "group_name", "updated_at"])
+        exported = 0
+        for row in iter_users(args.group, args.batch_size):
+            writer.writerow(row)
+            exported += 1
+    finally:
+        if args.output:
+            output.close()
+    print(f"Выгружено пользователей: {exported}", file=sys.stderr)
+
+def _cmd_cleanup(args) -> None:
+    if args.dry_run:
+        print(f"Будет удалено пользователей: {count_inactive_users(args.days)}")
+        return
+    print(f"Удалено пользователей: {delete_inactive_users(args.days, args.batch_size)}")
+
+def _cmd_migrate(args) -> None:
+    try:
+        moved = migrate_group(args.old_group, args.new_group, args.batch_size)
+    except ValueError as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        sys.exit(2)
+    print(f"Перенесено пользователей: {moved}")
+
+def main(argv=None) -> None:
+    global DB_PATH
+
+    arg_parser = argparse.ArgumentParser(prog="python -m db", description="Админские операции с базой пользователей")
+    arg_parser.add_argument("--db", default=DB_PATH, help=f"путь к базе (по умолчанию {DB_PATH})")
+    arg_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="строк на порцию/транзакцию")
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+
+    counts = subparsers.add_parser("counts", help="количество пользователей по группам")
+    counts.set_defaults(func=_cmd_counts)
+
+    export = subparsers.add_parser("export", help="выгрузка пользователей в CSV")
+    export.add_argument("--group", help="только эта группа")
+    export.add_argument("--output", "-o", help="файл (по умолчанию stdout)")
+    export.set_defaults(func=_cmd_export)
+
+    cleanup = subparsers.add_parser("cleanup", help="удалить пользователей, не обращавшихся к боту N дней")
+    cleanup.add_argument("--days", type=int, required=True)
+    cleanup.add_argument("--dry-run", action="store_true", help="только посчитать")
+    cleanup.set_defaults(func=_cmd_cleanup)
+
+    migrate = subparsers.add_parser("migrate", help="перенести пользователей из одной группы в другую")
+    migrate.add_argument("old_group")
+    migrate.add_argument("new_group")
+    migrate.set_defaults(func=_cmd_migrate)
+
+    args = arg_parser.parse_args(argv)
+    DB_PATH = args.db
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.WARNING)
+
+    # Создает индексы на базе, которая была заведена до их появления
+    init_db()
+    started = time.perf_counter()
+    args.func(args)
+    print(f"Готово за {time.perf_counter() - started:.3f} с", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
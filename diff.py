@@ -0,0 +1,119 @@
+import logging
+from typing import Dict, List, Callable
+import parser
+import profiling
+
+# Поиск изменений между старым и новым расписанием группы на уровне занятий.
+# Дни сравниваются по хешу содержимого (Day.fingerprint), поэтому неизменившиеся дни пропускаются сразу.
+logger = logging.getLogger(__name__)
+
+# Подписчики на изменения, вызываются как callback(group, changes)
+change_listeners: List[Callable] = []
+
+# Последнее расписание группы, с которым сравнивали
+_last_seen: Dict[str, object] = {}
+
+
+class Change:
+    """Одно изменение в расписании: added / removed / changed (аудитория или время)"""
+    def __init__(self, kind: str, date: str, weekday: str, old=None, new=None):
+        self.kind = kind
+        self.date = date
+        self.weekday = weekday
+        self.old = old
+        self.new = new
+
+    def __str__(self) -> str:
+        if self.kind == "added":
+            return f"➕ {self.new}"
+        if self.kind == "removed":
+            return f"➖ {self.old}"
+        return f"✏️ {self.old}\n      → {self.new}"
+
+
+def _diff_day(old_day, new_day) -> List[Change]:
+    changes = []
+
+    # Занятия, которые в уведомлении выглядят одинаково, сразу выкидываем. Сравниваем по тексту, а не по key():
+    # смена преподавателя или позиции на странице в сообщении не видна, и получилось бы "✏️ X → X"
+    new_left = list(new_day.subjects)
+    old_left = []
+    for subject in old_day.subjects:
+        shown = str(subject)
+        match = next((i for i, other in enumerate(new_left) if str(other) == shown), None)
+        if match is None:
+            old_left.append(subject)
+        else:
+            del new_left[match]
+
+    # То же занятие (название и тип), но другое время или аудитория - это перенос, а не удаление + добавление
+    for subject in old_left:
+        match = next(
+            (i for i, other in enumerate(new_left) if (other.name, other.type) == (subject.name, subject.type)),
+            None
+        )
+        if match is None:
+            changes.append(Change("removed", new_day.date, new_day.weekday, old=subject))
+        else:
+            changes.append(Change("changed", new_day.date, new_day.weekday, old=subject, new=new_left.pop(match)))
+
+    for subject in new_left:
+        changes.append(Change("added", new_day.date, new_day.weekday, new=subject))
+
+    return changes
+
+
+def diff_schedules(old, new) -> List[Change]:
+    """
+    Список изменений между двумя расписаниями.
+    Сравниваются только даты, которые есть в обоих: дни, ушедшие из окна сайта или появившиеся в нем, изменениями не считаются.
+    """
+    old_days = {day.date: day for week in old.weeks for day in week.days}
+    changes = []
+    for week in new.weeks:
+        for day in week.days:
+            old_day = old_days.get(day.date)
+            # Тот же объект - парсер переиспользовал неизменившийся блок дня
+            if old_day is None or old_day is day or old_day.fingerprint() == day.fingerprint():
+                continue
+            changes.extend(_diff_day(old_day, day))
+    return changes
+
+
+def format_changes(group: str, changes: List[Change]) -> str:
+    """Текст уведомления об изменениях для пользователей группы"""
+    result = f"🔔 *Изменения в расписании группы {group}*\n"
+    current_date = None
+    for change in changes:
+        if change.date != current_date:
+            current_date = change.date
+            result += f"\n*{change.date} {change.weekday}*\n"
+        result += f"{change}\n"
+    return result
+
+
+def add_change_listener(callback: Callable) -> None:
+    """Регистрирует обработчик, который вызывается, когда в новом расписании группы есть изменения"""
+    change_listeners.append(callback)
+
+
+def _on_refresh(group: str, schedule) -> None:
+    previous = _last_seen.get(group)
+    _last_seen[group] = schedule
+    if previous is None or previous is schedule:
+        return
+
+    with profiling.span("diff_schedules"):
+        changes = diff_schedules(previous, schedule)
+    if not changes:
+        return
+
+    logger.info(f"В расписании группы {group} найдено изменений: {len(changes)}")
+    for callback in change_listeners:
+        try:
+            callback(group, changes)
+        except Exception as e:
+            logger.error(f"Ошибка в обработчике изменений расписания для группы {group}: {e}")
+
+
+parser.add_refresh_listener(_on_refresh)
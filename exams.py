@@ -0,0 +1,251 @@
+import bisect
+import heapq
+import logging
+import time
+from datetime import date as date_type
+from typing import Dict, List, Optional, Tuple
+import parser
+import profiling
+import render
+import timeslots
+
+# Индекс экзаменов и разовых занятий группы по дате. Строится при обновлении расписания, а не на каждый /exams,
+# и сравнивается с индексом прошлой загрузки: перенесенные, новые и отмененные события помечаются в списке.
+logger = logging.getLogger(__name__)
+
+# Сколько дней показывать отметки о переносе, новых и отмененных событиях
+CHANGE_MARK_DAYS = 7
+# Больше событий в одном сообщении не показываем
+MAX_EVENTS = 40
+
+# Событие без распознанного времени - в конец дня
+_NO_TIME = 24 * 60
+
+
+class ExamEvent:
+    """Экзамен или разовое занятие группы в конкретный день"""
+    def __init__(self, group: str, day_date: date_type, day, subject):
+        self.group = group
+        self.date = day_date
+        self.day_title = f"{day.date} {day.weekday}"
+        self.subject = subject
+        slot = timeslots.parse_slot(subject.time)
+        self.start = slot[0] if slot else _NO_TIME
+        # Отметки по сравнению с прошлыми загрузками: откуда перенесено, появилось ли впервые и когда
+        self.moved_from: Optional[str] = None
+        self.is_new = False
+        self.changed_at: Optional[float] = None
+
+    def identity(self) -> tuple:
+        """Что считается тем же событием после переноса: предмет, тип, экзамен или нет, подгруппа"""
+        return (self.subject.name, self.subject.type, self.subject.is_exam, self.subject.subgroup)
+
+    def key(self) -> tuple:
+        return (self.date, self.subject.key())
+
+    def sort_key(self) -> tuple:
+        return (self.date, self.start)
+
+    def where(self) -> str:
+        return f"{self.day_title} {self.subject.time}".strip()
+
+
+class ExamIndex:
+    """События группы по дате для одной версии расписания и события, отмененные за последние CHANGE_MARK_DAYS"""
+    def __init__(self, version: int, events: List[ExamEvent], cancelled: List[ExamEvent],
+                 loaded_range: Optional[Tuple[date_type, date_type]]):
+        self.version = version
+        self.events = events
+        self.dates = [event.date for event in events]
+        self.cancelled = cancelled
+        self.loaded_range = loaded_range
+
+    def upcoming(self, today: date_type) -> List[ExamEvent]:
+        return self.events[bisect.bisect_left(self.dates, today):]
+
+
+# Группа -> индекс последней версии расписания
+_indexes: Dict[str, ExamIndex] = {}
+# (группы, подгруппа, дата) -> (версии расписаний групп, текст /exams)
+_texts: Dict[Tuple[Tuple[str, ...], Optional[str], str], Tuple[Tuple[int, ...], str]] = {}
+
+
+def _collect(group: str, schedule) -> List[ExamEvent]:
+    # Только дни со страницы сайта: в достроенных по циклу днях разовых занятий не бывает
+    events = {}
+    for week in schedule.weeks:
+        for day in week.days:
+            day_date = parser.parse_day_date(day.date)
+            if day_date is None:
+                continue
+            for subject in day.subjects:
+                if subject.is_exam or subject.is_once:
+                    event = ExamEvent(group, day_date, day, subject)
+                    events.setdefault(event.key(), event)
+    return sorted(events.values(), key=ExamEvent.sort_key)
+
+
+def _in_range(day_date: date_type, loaded_range: Optional[Tuple[date_type, date_type]]) -> bool:
+    return loaded_range is not None and loaded_range[0] <= day_date <= loaded_range[1]
+
+
+def _diff(group: str, previous: ExamIndex, events: List[ExamEvent], loaded_range, now: float) -> List[ExamEvent]:
+    """Помечает в events перенесенные и новые события, возвращает отмененные"""
+    fresh_after = now - CHANGE_MARK_DAYS * 24 * 3600
+    old_by_key = {event.key(): event for event in previous.events}
+
+    unmatched = []
+    for event in events:
+        old = old_by_key.pop(event.key(), None)
+        if old is None:
+            unmatched.append(event)
+        elif old.changed_at is not None and old.changed_at >= fresh_after:
+            # Событие не менялось с прошлой загрузки - отметка о недавнем изменении остается
+            event.moved_from, event.is_new, event.changed_at = old.moved_from, old.is_new, old.changed_at
+
+    # То же событие в другой день или в другое время - перенос. Пары подбираем по порядку дат
+    old_left = sorted(old_by_key.values(), key=ExamEvent.sort_key)
+    for event in unmatched:
+        match = next((i for i, old in enumerate(old_left) if old.identity() == event.identity()), None)
+        if match is not None:
+            event.moved_from = old_left.pop(match).where()
+            event.changed_at = now
+        elif _in_range(event.date, previous.loaded_range):
+            # Дата была в прошлой загрузке, а события не было. Дни, просто вошедшие в окно сайта, новыми не считаем
+            event.is_new = True
+            event.changed_at = now
+
+    # Пропавшие события - отмена, если их дата все еще в окне сайта (иначе день просто ушел в прошлое)
+    cancelled = []
+    for old in old_left:
+        if _in_range(old.date, loaded_range):
+            old.changed_at = now
+            cancelled.append(old)
+    changed = sum(1 for event in unmatched if event.changed_at == now)
+    if changed or cancelled:
+        logger.info(f"Экзамены группы {group}: перенесено или добавлено {changed}, отменено {len(cancelled)}")
+    current = {event.key() for event in events}
+    cancelled.extend(
+        old for old in previous.cancelled
+        if old.changed_at >= fresh_after and old.key() not in current
+    )
+    cancelled.sort(key=ExamEvent.sort_key)
+    return cancelled
+
+
+def _build_index(group: str, schedule) -> ExamIndex:
+    with profiling.span("build_exam_index"):
+        events = _collect(group, schedule)
+        loaded_range = schedule.loaded_range()
+        previous = _indexes.get(group)
+        cancelled = []
+        if previous is not None and previous.version != schedule.version:
+            cancelled = _diff(group, previous, events, loaded_range, time.time())
+    return ExamIndex(schedule.version, events, cancelled, loaded_range)
+
+
+def exam_index(group: str, schedule) -> ExamIndex:
+    """Индекс событий группы для снимка schedule"""
+    index = _indexes.get(group)
+    if index is None or index.version != schedule.version:
+        # Расписание попало в кеш раньше, чем нас подписали на обновления - строим лениво
+        index = _build_index(group, schedule)
+        if parser.schedule_cache.get(group) is schedule:
+            _indexes[group] = index
+    return index
+
+
+def merged_events(indexes: List[ExamIndex], today: date_type, subgroup: Optional[str] = None) -> List[Tuple[ExamEvent, List[str]]]:
+    """
+    Ближайшие события нескольких групп одним списком по дате и времени (k-way слияние готовых индексов).
+    Общий экзамен нескольких групп - одна запись со списком групп.
+    """
+    result = []
+    positions = {}
+    for event in heapq.merge(*(index.upcoming(today) for index in indexes), key=ExamEvent.sort_key):
+        if subgroup and event.subject.subgroup not in ("", subgroup):
+            continue
+        key = event.key()
+        if key in positions:
+            result[positions[key]][1].append(event.group)
+            continue
+        positions[key] = len(result)
+        result.append((event, [event.group]))
+    return result
+
+
+def _format(groups: Tuple[str, ...], indexes: List[ExamIndex], subgroup: Optional[str], today: date_type) -> str:
+    if len(groups) == 1:
+        title = f"группы {render.subgroup_title(groups[0], subgroup)}"
+    else:
+        title = f"групп {', '.join(groups)}"
+    result = f"*Экзамены и разовые занятия {title}*\n"
+
+    events = merged_events(indexes, today, subgroup)
+    current_day = None
+    for event, event_groups in events[:MAX_EVENTS]:
+        if event.day_title != current_day:
+            current_day = event.day_title
+            result += f"\n----- *{event.day_title}* -----\n"
+        # Группы подписываем, только если событие не общее для всех
+        suffix = f" [{', '.join(event_groups)}]" if len(event_groups) < len(groups) else ""
+        result += f"{event.subject}{suffix}\n"
+        if event.moved_from:
+            result += f"    ✏️ перенесено с {event.moved_from}\n"
+        elif event.is_new:
+            result += "    🆕 новое\n"
+    if len(events) > MAX_EVENTS:
+        result += f"\n…и еще {len(events) - MAX_EVENTS}\n"
+    if not events:
+        result += "\nБлижайших экзаменов и разовых занятий нет\n"
+
+    cancelled = [
+        event for index in indexes for event in index.cancelled
+        if event.date >= today and not (subgroup and event.subject.subgroup not in ("", subgroup))
+    ]
+    if cancelled:
+        result += "\n*Отменены:*\n"
+        for event in sorted(cancelled, key=ExamEvent.sort_key):
+            suffix = f" [{event.group}]" if len(groups) > 1 else ""
+            result += f"➖ {event.day_title}: {event.subject}{suffix}\n"
+    return result
+
+
+def _text(groups: Tuple[str, ...], indexes: List[ExamIndex], subgroup: Optional[str] = None) -> str:
+    today = parser.schedule_now().date()
+    key = (groups, subgroup, today.isoformat())
+    versions = tuple(index.version for index in indexes)
+    cached = _texts.get(key)
+    if cached and cached[0] == versions:
+        return cached[1]
+    with profiling.span("render_exams"):
+        text = _format(groups, indexes, subgroup, today)
+    _texts[key] = (versions, text)
+    return text
+
+
+def get_text(groups: List[str], subgroup: Optional[str] = None) -> str:
+    """Текст /exams для одной или нескольких групп. subgroup учитывается, только если группа одна."""
+    key_groups = tuple(sorted(set(groups)))
+    indexes = []
+    for group in key_groups:
+        with profiling.span("parse_schedule"):
+            schedule = parser.parse_schedule(group)
+        if schedule:
+            indexes.append(exam_index(group, schedule))
+    if not indexes:
+        return f"Не удалось получить расписание для групп {', '.join(key_groups)}"
+    return _text(key_groups, indexes, subgroup if len(key_groups) == 1 else None)
+
+
+def _rebuild(group: str, schedule) -> None:
+    """Пересобирает индекс группы и заранее готовит тексты /exams для группы и ее подгрупп"""
+    index = _build_index(group, schedule)
+    _indexes[group] = index
+    for key in [key for key in list(_texts) if group in key[0]]:
+        _texts.pop(key, None)
+    for subgroup in [None] + schedule.subgroups():
+        _text((group,), [index], subgroup)
+
+
+parser.add_refresh_listener(_rebuild)
@@ -0,0 +1,139 @@
+import logging
+import math
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+# Сколько держать расписание группы в кеше. Вместо одного часа на всех TTL считается по группе:
+# чем чаще расписание на сайте реально меняется, тем чаще его перекачиваем, а группы, которые никто
+# не открывает, перекачиваем редко. Изменение - смена Schedule.fingerprint() между двумя загрузками.
+logger = logging.getLogger(__name__)
+
+# Границы TTL, секунды
+MIN_TTL = float(os.getenv("FRESHNESS_MIN_TTL", "900"))
+MAX_TTL = float(os.getenv("FRESHNESS_MAX_TTL", "21600"))
+# TTL, пока по группе нет ни одной загрузки для оценки
+DEFAULT_TTL = 3600
+# Сколько раз хотим проверить сайт за среднее время между изменениями расписания
+CHECKS_PER_CHANGE = 4
+# Вес нового интервала между изменениями в скользящем среднем
+CHANGE_ALPHA = 0.3
+# Период полураспада счетчика обращений: давние обращения почти не считаются
+ACCESS_HALF_LIFE = 24 * 3600
+# Обращений в час, начиная с которых группа считается популярной и TTL не растягивается
+HOT_ACCESSES_PER_HOUR = float(os.getenv("FRESHNESS_HOT_RATE", "6"))
+# False - обращения пользователей в этот процесс не приходят (роль refresher), TTL считается только по изменениям
+USE_POPULARITY = True
+
+
+class GroupFreshness:
+    """Статистика одной группы: затухающий счетчик обращений и история изменений расписания"""
+    def __init__(self):
+        self.accesses = 0.0
+        self.accessed_at = 0.0
+        self.fingerprint: Optional[int] = None
+        self.first_fetch_at = 0.0
+        self.changed_at = 0.0
+        self.fetches = 0
+        self.changes = 0
+        # Скользящее среднее времени между изменениями, None - изменений еще не видели
+        self.change_interval: Optional[float] = None
+
+    def _decayed_accesses(self, now: float) -> float:
+        return self.accesses * 0.5 ** ((now - self.accessed_at) / ACCESS_HALF_LIFE)
+
+    def accesses_per_hour(self, now: float) -> float:
+        # Затухающий счетчик в установившемся режиме равен скорости * (период полураспада / ln2).
+        # Сразу после запуска процесса столько времени еще не прошло - делим на то, что есть, но не меньше часа
+        window = ACCESS_HALF_LIFE / math.log(2)
+        if _tracking_since is not None:
+            window = min(window, max(3600.0, now - _tracking_since))
+        return self._decayed_accesses(now) / window * 3600
+
+    def ttl(self, now: float) -> float:
+        if self.fetches == 0:
+            ttl = DEFAULT_TTL
+        elif self.change_interval is not None:
+            ttl = self.change_interval / CHECKS_PER_CHANGE
+        else:
+            # Изменений пока не было: расписание стабильно как минимум всё время наблюдения
+            ttl = max(DEFAULT_TTL, (now - self.first_fetch_at) / CHECKS_PER_CHANGE)
+
+        if USE_POPULARITY:
+            rate = self.accesses_per_hour(now)
+            if rate <= 0:
+                ttl = MAX_TTL
+            elif rate < HOT_ACCESSES_PER_HOUR:
+                ttl *= HOT_ACCESSES_PER_HOUR / rate
+        return min(MAX_TTL, max(MIN_TTL, ttl))
+
+
+_groups: Dict[str, GroupFreshness] = {}
+_lock = threading.Lock()
+# Время первого учтенного обращения в этом процессе
+_tracking_since: Optional[float] = None
+
+
+def _get(group: str) -> GroupFreshness:
+    stats = _groups.get(group)
+    if stats is None:
+        stats = _groups.setdefault(group, GroupFreshness())
+    return stats
+
+
+def record_access(group: str, now: Optional[float] = None) -> None:
+    """Пользователь запросил расписание группы"""
+    global _tracking_since
+    now = time.time() if now is None else now
+    with _lock:
+        if _tracking_since is None:
+            _tracking_since = now
+        stats = _get(group)
+        stats.accesses = stats._decayed_accesses(now) + 1
+        stats.accessed_at = now
+
+
+def record_fetch(group: str, fingerprint: int, now: Optional[float] = None) -> bool:
+    """Расписание группы скачано с сайта. Возвращает True, если содержимое изменилось с прошлой загрузки."""
+    now = time.time() if now is None else now
+    with _lock:
+        stats = _get(group)
+        stats.fetches += 1
+        if stats.fingerprint is None:
+            stats.fingerprint = fingerprint
+            stats.first_fetch_at = stats.changed_at = now
+            return False
+        if fingerprint == stats.fingerprint:
+            return False
+
+        interval = now - stats.changed_at
+        if stats.change_interval is None:
+            stats.change_interval = interval
+        else:
+            stats.change_interval = CHANGE_ALPHA * interval + (1 - CHANGE_ALPHA) * stats.change_interval
+        stats.fingerprint = fingerprint
+        stats.changed_at = now
+        stats.changes += 1
+    logger.info(f"Расписание группы {group} изменилось, новый TTL {ttl(group):.0f} сек")
+    return True
+
+
+def ttl(group: str, now: Optional[float] = None) -> float:
+    """Сколько секунд расписание группы считается свежим"""
+    now = time.time() if now is None else now
+    with _lock:
+        return _get(group).ttl(now)
+
+
+def format_status(now: Optional[float] = None) -> str:
+    now = time.time() if now is None else now
+    lines = []
+    with _lock:
+        for group, stats in sorted(_groups.items()):
+            interval = f"{stats.change_interval / 3600:.1f} ч" if stats.change_interval is not None else "нет"
+            lines.append(
+                f"{group}: TTL {stats.ttl(now) / 60:.0f} мин, обращений {stats.accesses_per_hour(now):.1f}/ч, "
+                f"загрузок {stats.fetches}, изменений {stats.changes}, между изменениями {interval}"
+            )
+    return "\n".join(lines) or "Статистики по группам пока нет"
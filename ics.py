@@ -0,0 +1,262 @@
+import hashlib
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote, unquote
+import parser
+import profiling
+import timeslots
+
+# Экспорт расписания в iCalendar (.ics) для календаря в телефоне.
+# Файл собирается один раз на версию расписания и хранится готовыми байтами. События дня собираются заново,
+# только если поменялся сам день (по Day.fingerprint), остальные дни берутся из кеша.
+logger = logging.getLogger(__name__)
+
+# Пояс расписания (UTC+7), по нему время событий в календаре
+SCHEDULE_TZ = parser.SCHEDULE_TZ
+# Порт HTTP-подписки на календарь (0 - не запускать) и внешний адрес, который показываем пользователю
+ICS_HTTP_PORT = int(os.getenv("ICS_HTTP_PORT", "0"))
+ICS_HTTP_LISTEN = os.getenv("ICS_HTTP_LISTEN", "127.0.0.1")
+ICS_PUBLIC_URL = os.getenv("ICS_PUBLIC_URL", "")
+
+
+class CalendarFile:
+    """Готовый .ics группы: байты, ETag и время версии расписания"""
+    def __init__(self, group: str, data: bytes, created_at: float):
+        self.group = group
+        self.data = data
+        self.etag = '"' + hashlib.sha1(data).hexdigest() + '"'
+        self.created_at = created_at
+        self.last_modified = formatdate(created_at, usegmt=True)
+        self.filename = f"schedule_{group}.ics"
+
+
+# Группа -> (версия расписания, CalendarFile)
+_files: Dict[str, Tuple[int, CalendarFile]] = {}
+# (группа, дата) -> (fingerprint дня, строки VEVENT этого дня)
+_day_events: Dict[Tuple[str, str], Tuple[int, List[str]]] = {}
+# Группа -> (ETag, file_id документа в Телеграме), чтобы повторно не загружать тот же файл
+_file_ids: Dict[str, Tuple[str, str]] = {}
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def _fold(line: str) -> str:
+    # По RFC 5545 строки длиннее 75 октетов переносятся, продолжение начинается с пробела
+    data = line.encode("utf-8")
+    if len(data) <= 75:
+        return line
+    parts = []
+    while len(data) > 75:
+        cut = 75 if not parts else 74
+        # Не режем многобайтовый символ посередине
+        while cut > 0 and (data[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(data[:cut].decode("utf-8"))
+        data = data[cut:]
+    parts.append(data.decode("utf-8"))
+    return "\r\n ".join(parts)
+
+
+def _utc(date: datetime, minute: int) -> str:
+    local = date.replace(hour=minute // 60, minute=minute % 60, tzinfo=SCHEDULE_TZ)
+    return local.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def _build_day_events(group: str, day, stamp: str) -> List[str]:
+    day_date = parser.parse_day_date(day.date)
+    if day_date is None:
+        logger.warning(f"Не удалось распознать формат даты: {day.date}")
+        return []
+
+    date = datetime.combine(day_date, datetime.min.time())
+    lines = []
+    for subject in day.subjects:
+        slot = timeslots.parse_slot(subject.time)
+        if slot is None:
+            continue
+        summary = subject.name
+        if subject.type:
+            summary += f" {subject.type}"
+        if subject.is_exam:
+            summary = f"Экзамен: {summary}"
+        description = ", ".join(part for part in (subject.teacher, subject.position) if part)
+        # UID не зависит от аудитории и преподавателя, так что календарь обновит событие, а не задвоит его
+        uid = hashlib.sha1(f"{group}|{day.date}|{subject.time}|{subject.name}|{subject.type}".encode("utf-8")).hexdigest()
+
+        lines.append("BEGIN:VEVENT")
+        lines.append(f"UID:{uid}@altstu-schedule")
+        lines.append(f"DTSTAMP:{stamp}")
+        lines.append(f"DTSTART:{_utc(date, slot[0])}")
+        lines.append(f"DTEND:{_utc(date, slot[1])}")
+        lines.append(_fold(f"SUMMARY:{_escape(summary)}"))
+        if subject.room:
+            lines.append(_fold(f"LOCATION:{_escape(subject.room)}"))
+        if description:
+            lines.append(_fold(f"DESCRIPTION:{_escape(description)}"))
+        lines.append("END:VEVENT")
+    return lines
+
+
+def _build_file(group: str, schedule) -> CalendarFile:
+    stamp = datetime.fromtimestamp(schedule.created_at, timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//altstu-schedule-bot//RU",
+        "CALSCALE:GREGORIAN",
+        _fold(f"X-WR-CALNAME:{_escape(f'Расписание {group}')}"),
+        "X-WR-TIMEZONE:Asia/Barnaul",
+    ]
+    seen = set()
+    rebuilt = 0
+    for week in schedule.weeks:
+        for day in week.days:
+            # Один и тот же день может встретиться на обеих неделях страницы
+            if day.date in seen:
+                continue
+            seen.add(day.date)
+            cached = _day_events.get((group, day.date))
+            if cached is None or cached[0] != day.fingerprint():
+                cached = (day.fingerprint(), _build_day_events(group, day, stamp))
+                _day_events[(group, day.date)] = cached
+                rebuilt += 1
+            lines.extend(cached[1])
+    lines.append("END:VCALENDAR")
+
+    # Дни, которые ушли из окна сайта, из кеша событий убираем
+    for key in [key for key in list(_day_events) if key[0] == group and key[1] not in seen]:
+        _day_events.pop(key, None)
+
+    logger.info(f"Календарь группы {group} собран, пересобрано дней: {rebuilt} из {len(seen)}")
+    return CalendarFile(group, ("\r\n".join(lines) + "\r\n").encode("utf-8"), schedule.created_at)
+
+
+def _build(group: str, schedule) -> Tuple[int, CalendarFile]:
+    with profiling.span("build_ics"):
+        calendar = _build_file(group, schedule)
+    previous = _files.get(group)
+    # Расписание перекачали, но оно не изменилось - оставляем прежнюю версию (и Last-Modified, и file_id)
+    if previous and previous[1].etag == calendar.etag:
+        calendar = previous[1]
+    return schedule.version, calendar
+
+
+def _rebuild(group: str, schedule) -> None:
+    _files[group] = _build(group, schedule)
+
+
+def calendar_from_schedule(group: str, schedule) -> CalendarFile:
+    cached = _files.get(group)
+    if cached is None or cached[0] != schedule.version:
+        # Расписание попало в кеш раньше, чем нас подписали на обновления - собираем лениво
+        cached = _build(group, schedule)
+        # Снимок, который уже сменился в кеше, не сохраняем
+        if parser.schedule_cache.get(group) is schedule:
+            _files[group] = cached
+    return cached[1]
+
+
+def get_calendar(group: str) -> Optional[CalendarFile]:
+    """Готовый .ics группы. При необходимости обновляет расписание с сайта."""
+    with profiling.span("parse_schedule"):
+        schedule = parser.parse_schedule(group)
+    if not schedule:
+        return None
+    return calendar_from_schedule(group, schedule)
+
+
+def cached_file_id(calendar: CalendarFile) -> Optional[str]:
+    """file_id уже загруженного в Телеграм файла этой версии, если есть"""
+    cached = _file_ids.get(calendar.group)
+    if cached and cached[0] == calendar.etag:
+        return cached[1]
+    return None
+
+
+def remember_file_id(calendar: CalendarFile, file_id: str) -> None:
+    _file_ids[calendar.group] = (calendar.etag, file_id)
+
+
+def subscription_url(group: str) -> Optional[str]:
+    if not ICS_PUBLIC_URL:
+        return None
+    return f"{ICS_PUBLIC_URL.rstrip('/')}/ics/{quote(group)}.ics"
+
+
+class CalendarHandler(BaseHTTPRequestHandler):
+    """GET /ics/<группа>.ics с поддержкой If-None-Match и If-Modified-Since"""
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = unquote(self.path.split("?", 1)[0])
+        if not (path.startswith("/ics/") and path.endswith(".ics")):
+            return self._send_status(404)
+        group = path[len("/ics/"):-len(".ics")]
+        if group not in parser.GROUP_URLS:
+            return self._send_status(404)
+
+        try:
+            calendar = get_calendar(group)
+        except Exception as e:
+            logger.error(f"Ошибка при сборке календаря группы {group}: {e}")
+            calendar = None
+        if calendar is None:
+            return self._send_status(503)
+
+        if self._not_modified(calendar):
+            self.send_response(304)
+            self.send_header("ETag", calendar.etag)
+            self.send_header("Last-Modified", calendar.last_modified)
+            self.end_headers()
+            return
+
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/calendar; charset=utf-8")
+            self.send_header("Content-Length", str(len(calendar.data)))
+            self.send_header("ETag", calendar.etag)
+            self.send_header("Last-Modified", calendar.last_modified)
+            self.send_header("Cache-Control", "max-age=300")
+            self.end_headers()
+            self.wfile.write(calendar.data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _not_modified(self, calendar: CalendarFile) -> bool:
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match:
+            return calendar.etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                return int(calendar.created_at) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _send_status(self, status: int):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def start_http_server(port: int = ICS_HTTP_PORT) -> Optional[ThreadingHTTPServer]:
+    """Запускает HTTP-подписку на календари в фоновом потоке. Без порта ничего не делает."""
+    if not port:
+        return None
+    server = ThreadingHTTPServer((ICS_HTTP_LISTEN, port), CalendarHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"HTTP-подписка на календари слушает {ICS_HTTP_LISTEN}:{port}")
+    return server
+
+
+parser.add_refresh_listener(_rebuild)
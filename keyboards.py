@@ -0,0 +1,232 @@
+import logging
+from typing import Dict, List, Tuple, Optional
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+import parser
+import render
+import callbacks
+
+# Все клавиатуры бота собираются один раз и дальше только переиспользуются.
+# InlineKeyboardMarkup в python-telegram-bot неизменяемый, так что делить один объект между апдейтами безопасно.
+logger = logging.getLogger(__name__)
+
+# Сколько кнопок групп в одном ряду
+GROUPS_PER_ROW = 3
+# Сколько кнопок дней в одном ряду
+DAYS_PER_ROW = 2
+
+BACK_BUTTON = InlineKeyboardButton("« Назад", callback_data=callbacks.MENU)
+
+# Кнопки меню расписания, из них собираются и главное меню, и меню под командами
+MENU_BUTTONS = {
+    "now": InlineKeyboardButton("Сейчас", callback_data=callbacks.encode_view("now")),
+    "today": InlineKeyboardButton("На сегодня", callback_data=callbacks.encode_view("today")),
+    "tomorrow": InlineKeyboardButton("На завтра", callback_data=callbacks.encode_view("tomorrow")),
+    "week_1": InlineKeyboardButton("Неделя 1", callback_data=callbacks.encode_view("week_1")),
+    "week_2": InlineKeyboardButton("Неделя 2", callback_data=callbacks.encode_view("week_2")),
+    "change_group": InlineKeyboardButton("Изменить группу", callback_data=callbacks.CHANGE_GROUP),
+}
+
+class GroupKeyboards:
+    """Клавиатуры навигации группы, собранные по одной версии расписания"""
+    def __init__(self, version: int, weeks: Dict[Tuple[int, int], InlineKeyboardMarkup], days: Dict[Tuple[int, int], InlineKeyboardMarkup]):
+        self.version = version
+        # (неделя, страница) -> клавиатура со страницами и списком дней
+        self.weeks = weeks
+        # (неделя, индекс дня) -> клавиатура "« пред. день / след. день »"
+        self.days = days
+
+
+# (группа, подгруппа) -> GroupKeyboards. При обновлении расписания набор подменяется целиком.
+# У подгруппы неделя может занимать меньше страниц, поэтому клавиатуры у нее свои
+_keyboards: Dict[Tuple[str, Optional[str]], GroupKeyboards] = {}
+# Неделя -> клавиатура "« Назад" к этой неделе
+_back_to_week_keyboards: Dict[int, InlineKeyboardMarkup] = {}
+# Группы пользователя -> клавиатура выбора дополнительных групп
+_groups_keyboards: Dict[Tuple[str, ...], InlineKeyboardMarkup] = {}
+# (неделя, страница, всего страниц) -> листание совмещенного расписания нескольких групп
+_merged_page_keyboards: Dict[Tuple[int, int, int], InlineKeyboardMarkup] = {}
+# (подгруппы в расписании, выбранная) -> клавиатура выбора подгруппы
+_subgroup_keyboards: Dict[Tuple[Tuple[str, ...], Optional[str]], InlineKeyboardMarkup] = {}
+
+
+def _rows(buttons: list, per_row: int) -> list:
+    return [buttons[i:i + per_row] for i in range(0, len(buttons), per_row)]
+
+
+def _build_group_keyboard() -> InlineKeyboardMarkup:
+    # Кнопки групп генерируются из реестра групп в parser.GROUP_URLS
+    buttons = [InlineKeyboardButton(group, callback_data=callbacks.encode_group(group)) for group in parser.GROUP_URLS]
+    return InlineKeyboardMarkup(_rows(buttons, GROUPS_PER_ROW))
+
+
+def _build_command_keyboard(current: str) -> InlineKeyboardMarkup:
+    # Под ответом на команду показываем все периоды, кроме текущего, плюс смену группы
+    buttons = [button for key, button in MENU_BUTTONS.items() if key not in (current, "change_group")]
+    buttons.append(MENU_BUTTONS["change_group"])
+    return InlineKeyboardMarkup(_rows(buttons, 2))
+
+
+GROUP_KEYBOARD = _build_group_keyboard()
+
+MAIN_MENU = InlineKeyboardMarkup([
+    [MENU_BUTTONS["now"]],
+    [MENU_BUTTONS["today"], MENU_BUTTONS["tomorrow"]],
+    [MENU_BUTTONS["week_1"], MENU_BUTTONS["week_2"]],
+    [MENU_BUTTONS["change_group"]],
+])
+
+BACK_KEYBOARD = InlineKeyboardMarkup([[BACK_BUTTON]])
+
+COMMAND_KEYBOARDS = {view: _build_command_keyboard(view) for view in ("now", "today", "tomorrow", "week_1", "week_2")}
+
+
+def _build_group_keyboards(group: str, schedule, subgroup: Optional[str] = None) -> GroupKeyboards:
+    week_keyboards = {}
+    day_keyboards = {}
+
+    for week in schedule.weeks:
+        view = render.week_view(group, week.number, schedule, subgroup)
+        if view is None or not view.days:
+            continue
+
+        # Кнопки для каждого дня недели, в callback - индекс дня в отсортированном списке (см. callbacks.py)
+        day_buttons = [
+            InlineKeyboardButton(f"{day.date} ({day.weekday})", callback_data=callbacks.encode_day(week.number, index))
+            for index, day in enumerate(view.days)
+        ]
+        day_rows = _rows(day_buttons, DAYS_PER_ROW)
+
+        for page in range(len(view.pages)):
+            rows = []
+            # Листание страниц, если неделя не влезла в одно сообщение
+            if len(view.pages) > 1:
+                page_row = []
+                if page > 0:
+                    page_row.append(InlineKeyboardButton(f"« стр. {page}", callback_data=callbacks.encode_page(week.number, page - 1)))
+                if page < len(view.pages) - 1:
+                    page_row.append(InlineKeyboardButton(f"стр. {page + 2} »", callback_data=callbacks.encode_page(week.number, page + 1)))
+                rows.append(page_row)
+            rows.extend(day_rows)
+            rows.append([BACK_BUTTON])
+            week_keyboards[(week.number, page)] = InlineKeyboardMarkup(rows)
+
+        # Кнопки перехода к предыдущему и следующему дню
+        to_week_row = [InlineKeyboardButton("К неделе", callback_data=callbacks.encode_week(week.number))]
+        to_menu_row = [InlineKeyboardButton("« Назад в меню", callback_data=callbacks.MENU)]
+        for index, day in enumerate(view.days):
+            row = []
+            if index > 0:
+                prev_day = view.days[index - 1]
+                row.append(InlineKeyboardButton(f"« {prev_day.date}", callback_data=callbacks.encode_day(week.number, index - 1)))
+            if index < len(view.days) - 1:
+                next_day = view.days[index + 1]
+                row.append(InlineKeyboardButton(f"{next_day.date} »", callback_data=callbacks.encode_day(week.number, index + 1)))
+
+            keyboard = [row] if row else []
+            keyboard.append(to_week_row)
+            keyboard.append(to_menu_row)
+            day_keyboards[(week.number, index)] = InlineKeyboardMarkup(keyboard)
+
+    logger.info(f"Клавиатуры навигации для группы {render.subgroup_title(group, subgroup)} пересобраны: {len(day_keyboards)} дней")
+    return GroupKeyboards(schedule.version, week_keyboards, day_keyboards)
+
+
+def rebuild_day_keyboards(group: str, schedule) -> None:
+    """Пересобирает клавиатуры навигации по страницам и дням для группы и ее подгрупп. Вызывается при обновлении расписания."""
+    subgroups = [None] + schedule.subgroups()
+    for subgroup in subgroups:
+        _keyboards[(group, subgroup)] = _build_group_keyboards(group, schedule, subgroup)
+    for key in [key for key in list(_keyboards) if key[0] == group and key[1] not in subgroups]:
+        _keyboards.pop(key, None)
+
+
+def _group_keyboards(group: str, schedule=None, subgroup: Optional[str] = None) -> Optional[GroupKeyboards]:
+    # Расписание могло попасть в кеш до регистрации обработчика - собираем лениво
+    if schedule is None:
+        schedule = parser.schedule_cache.get(group)
+    keyboards = _keyboards.get((group, subgroup))
+    if schedule is not None and (keyboards is None or keyboards.version != schedule.version):
+        keyboards = _build_group_keyboards(group, schedule, subgroup)
+        # Обработчик мог взять снимок, который уже сменился в кеше, - такие клавиатуры не сохраняем
+        if parser.schedule_cache.get(group) is schedule:
+            _keyboards[(group, subgroup)] = keyboards
+    return keyboards
+
+
+def week_keyboard(group: str, week_number: int, page: int = 0, schedule=None, subgroup: Optional[str] = None) -> InlineKeyboardMarkup:
+    """Клавиатура страницы недели со списком дней или просто "« Назад", если дней нет"""
+    keyboards = _group_keyboards(group, schedule, subgroup)
+    if keyboards is None:
+        return BACK_KEYBOARD
+    return keyboards.weeks.get((week_number, page), BACK_KEYBOARD)
+
+
+def day_keyboard(group: str, week_number: int, day_index: int, schedule=None, subgroup: Optional[str] = None) -> Optional[InlineKeyboardMarkup]:
+    """Клавиатура навигации для конкретного дня"""
+    keyboards = _group_keyboards(group, schedule, subgroup)
+    if keyboards is None:
+        return None
+    return keyboards.days.get((week_number, day_index))
+
+
+def back_to_week_keyboard(week_number: int) -> InlineKeyboardMarkup:
+    """Клавиатура "« Назад" к неделе, когда день не найден"""
+    if week_number not in _back_to_week_keyboards:
+        _back_to_week_keyboards[week_number] = InlineKeyboardMarkup(
+            [[InlineKeyboardButton("« Назад", callback_data=callbacks.encode_week(week_number))]]
+        )
+    return _back_to_week_keyboards[week_number]
+
+
+def groups_keyboard(groups: List[str]) -> InlineKeyboardMarkup:
+    """Кнопки всех групп: основная отмечена звездочкой, дополнительные галочкой, нажатие добавляет или убирает группу"""
+    key = tuple(groups)
+    if key not in _groups_keyboards:
+        buttons = []
+        for group in parser.GROUP_URLS:
+            if groups and group == groups[0]:
+                mark = "⭐"
+            elif group in groups:
+                mark = "✅"
+            else:
+                mark = "➕"
+            buttons.append(InlineKeyboardButton(f"{mark} {group}", callback_data=callbacks.encode_toggle_group(group)))
+        rows = _rows(buttons, GROUPS_PER_ROW)
+        rows.append([BACK_BUTTON])
+        _groups_keyboards[key] = InlineKeyboardMarkup(rows)
+    return _groups_keyboards[key]
+
+
+def merged_page_keyboard(week_number: int, page: int, pages: int) -> InlineKeyboardMarkup:
+    """Листание страниц совмещенного недельного расписания (без кнопок дней - они есть только у одной группы)"""
+    key = (week_number, page, pages)
+    if key not in _merged_page_keyboards:
+        rows = []
+        page_row = []
+        if page > 0:
+            page_row.append(InlineKeyboardButton(f"« стр. {page}", callback_data=callbacks.encode_page(week_number, page - 1)))
+        if page < pages - 1:
+            page_row.append(InlineKeyboardButton(f"стр. {page + 2} »", callback_data=callbacks.encode_page(week_number, page + 1)))
+        if page_row:
+            rows.append(page_row)
+        rows.append([BACK_BUTTON])
+        _merged_page_keyboards[key] = InlineKeyboardMarkup(rows)
+    return _merged_page_keyboards[key]
+
+
+def subgroups_keyboard(subgroups: List[str], current: Optional[str] = None) -> InlineKeyboardMarkup:
+    """Выбор подгруппы: буквы из расписания группы и "Вся группа", выбранный вариант отмечен галочкой"""
+    key = (tuple(subgroups), current)
+    if key not in _subgroup_keyboards:
+        buttons = [
+            InlineKeyboardButton(f"{'✅ ' if subgroup == current else ''}Подгруппа {subgroup}", callback_data=callbacks.encode_subgroup(subgroup))
+            for subgroup in subgroups
+        ]
+        rows = _rows(buttons, GROUPS_PER_ROW)
+        rows.append([InlineKeyboardButton(f"{'✅ ' if current is None else ''}Вся группа", callback_data=callbacks.encode_subgroup(None))])
+        rows.append([BACK_BUTTON])
+        _subgroup_keyboards[key] = InlineKeyboardMarkup(rows)
+    return _subgroup_keyboards[key]
+
+
+parser.add_refresh_listener(rebuild_day_keyboards)
@@ -0,0 +1,425 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+# Офлайн-стенд для проверки производительности без altstu.ru и без Телеграма:
+#  - локальный "altstu.ru", который отдает сохраненные страницы групп с задержками, ошибками и зависаниями;
+#  - фейковый Bot API (бот ходит в него через BOT_API_BASE_URL);
+#  - генератор нагрузки: N пользователей жмут кнопки, в конце - отчет по задержкам и пропускной способности.
+#
+# Только стенд (бота запускаете сами с ALTSTU_BASE_URL и BOT_API_BASE_URL из вывода):
+#   python loadtest.py serve --latency 0.2 --error-rate 0.1
+# Всё вместе в одном процессе:
+#   python loadtest.py run --users 50 --duration 30
+# Поведение "сайта" можно менять на лету: curl "http://127.0.0.1:8080/_control?error_rate=1"
+
+FAKE_TOKEN = "123456:LOADTEST"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Расписание", "username": "loadtest_bot"}
+
+# Сценарий одного пользователя: что он нажимает по кругу (callback_data в формате callbacks.py)
+USER_SCRIPT = [
+    "vt",    # на сегодня
+    "vm",    # на завтра
+    "w1",    # неделя 1
+    "d1.0",  # первый день недели 1
+    "d1.1",
+    "b",     # назад в меню
+    "w2",
+    "p2.0",  # первая страница недели 2
+    "b",
+]
+
+SUBJECTS = [
+    ("Математический анализ", "(лекция)"),
+    ("Дискретная математика и теория чисел", "(практика)"),
+    ("Иностранный язык", "(практика)"),
+    ("Информационные процессы и системы", "(лабораторная работа) подгруппа А"),
+    ("История России", "(лекция)"),
+]
+TIMES = ["08:15-09:45", "09:55-11:25", "11:35-13:05", "13:45-15:15", "15:25-16:55"]
+WEEKDAYS = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб"]
+
+
+def synthetic_page(seed: int) -> str:
+    """Страница в разметке altstu.ru на две недели, начиная с понедельника текущей недели"""
+    rnd = random.Random(seed)
+    monday = date.today() - timedelta(days=date.today().weekday())
+    out = ["<html><body>"]
+    for week in (1, 2):
+        out.append(f"<h4>Неделя {week}</h4>")
+        for i, weekday in enumerate(WEEKDAYS):
+            day = monday + timedelta(days=(week - 1) * 7 + i)
+            out.append(f'<div class="block-index"><h2>{day.strftime("%d.%m.%y")} {weekday}</h2><div class="list-group">')
+            for time_ in rnd.sample(TIMES, rnd.randint(2, 4)):
+                name, type_ = rnd.choice(SUBJECTS)
+                css = "list-group-item" + (" once once-exam" if rnd.random() < 0.03 else "")
+                out.append(
+                    f'<div class="{css}">{time_} <strong>{name}</strong> {type_} '
+                    f'{rnd.randint(100, 450)} ПК Иванов И. И. - доцент</div>'
+                )
+            out.append("</div></div>")
+    out.append("</body></html>")
+    return "\n".join(out)
+
+
+class SiteState:
+    """Настройки и счетчики локального altstu.ru"""
+    def __init__(self, pages: Dict[str, str], latency: float, error_rate: float, timeout_rate: float, hang: float):
+        self.pages = pages
+        self.latency = latency
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.hang = hang
+        self.hits: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+
+def make_site_handler(state: SiteState):
+    class SiteHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/_control":
+                # Меняем поведение сайта на лету, например чтобы устроить "падение"
+                for key, values in parse_qs(url.query).items():
+                    if hasattr(state, key) and key not in ("pages", "hits", "lock"):
+                        setattr(state, key, float(values[0]))
+                return self._send(200, "application/json", json.dumps({
+                    "latency": state.latency, "error_rate": state.error_rate,
+                    "timeout_rate": state.timeout_rate, "hits": state.hits,
+                }, ensure_ascii=False))
+
+            match = re.match(r"^/m/s/(\d+)/?$", url.path)
+            if not match or match.group(1) not in state.pages:
+                return self._send(404, "text/plain", "not found")
+
+            with state.lock:
+                state.hits[match.group(1)] = state.hits.get(match.group(1), 0) + 1
+
+            roll = random.random()
+            if roll < state.timeout_rate:
+                # Зависаем дольше read timeout'а клиента
+                time.sleep(state.hang)
+                return self._send(504, "text/plain", "gateway timeout")
+            time.sleep(state.latency)
+            if roll < state.timeout_rate + state.error_rate:
+                return self._send(503, "text/plain", "service unavailable")
+            self._send(200, "text/html; charset=utf-8", state.pages[match.group(1)])
+
+        def _send(self, status: int, content_type: str, body: str):
+            data = body.encode("utf-8")
+            try:
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    return SiteHandler
+
+
+class FakeBotAPI:
+    """Минимальный Bot API: отдает апдейты из очереди и запоминает, когда бот ответил на каждый callback"""
+    def __init__(self):
+        self.updates: List[dict] = []
+        self.condition = threading.Condition()
+        self.next_update_id = 1
+        self.next_message_id = 1000
+        self.calls: Dict[str, int] = {}
+        # callback_query_id -> threading.Event, выставляется на answerCallbackQuery
+        self.waiters: Dict[str, threading.Event] = {}
+
+    def push_callback(self, user_id: int, message_id: int, data: str) -> threading.Event:
+        with self.condition:
+            query_id = f"cq{self.next_update_id}"
+            event = threading.Event()
+            self.waiters[query_id] = event
+            user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+            self.updates.append({
+                "update_id": self.next_update_id,
+                "callback_query": {
+                    "id": query_id,
+                    "from": user,
+                    "chat_instance": str(user_id),
+                    "data": data,
+                    "message": {
+                        "message_id": message_id,
+                        "date": int(time.time()),
+                        "chat": {"id": user_id, "type": "private"},
+                        "from": BOT_USER,
+                        "text": "...",
+                    },
+                },
+            })
+            self.next_update_id += 1
+            self.condition.notify_all()
+        return event
+
+    def get_updates(self, offset: int, timeout: float) -> List[dict]:
+        with self.condition:
+            # Подтвержденные ботом апдейты выкидываем
+            self.updates = [update for update in self.updates if update["update_id"] >= offset]
+            if not self.updates:
+                # Держим long polling не дольше секунды, чтобы бот быстро останавливался
+                self.condition.wait(min(timeout, 1.0))
+            return list(self.updates)
+
+    def message(self, params: dict) -> dict:
+        self.next_message_id += 1
+        chat_id = int(params.get("chat_id") or 0)
+        return {
+            "message_id": int(params.get("message_id") or self.next_message_id),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+
+    def call(self, method: str, params: dict):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return self.get_updates(int(params.get("offset") or 0), float(params.get("timeout") or 0))
+        if method == "answerCallbackQuery":
+            event = self.waiters.pop(params.get("callback_query_id"), None)
+            if event:
+                event.set()
+            return True
+        if method in ("sendMessage", "editMessageText", "sendDocument"):
+            return self.message(params)
+        return True
+
+
+def make_api_handler(api: FakeBotAPI):
+    class APIHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            match = re.match(r"^/bot[^/]+/(\w+)$", urlparse(self.path).path)
+            if not match:
+                return self._send(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            params = {}
+            content_type = self.headers.get("Content-Type", "")
+            if content_type.startswith("application/json"):
+                params = json.loads(body or b"{}")
+            elif content_type.startswith("application/x-www-form-urlencoded"):
+                params = {key: values[0] for key, values in parse_qs(body.decode("utf-8")).items()}
+
+            self._send(200, {"ok": True, "result": api.call(match.group(1), params)})
+
+        do_GET = do_POST
+
+        def _send(self, status: int, payload: dict):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            try:
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    return APIHandler
+
+
+def _start_server(handler, port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _load_pages(pages_dir: Optional[str]) -> Dict[str, str]:
+    """Страницы групп по id из URL: сохраненные debug_<группа>.html, если есть, иначе синтетические"""
+    import parser
+
+    pages = {}
+    for index, (group, url) in enumerate(parser.GROUP_URLS.items()):
+        group_id = url.rstrip("/").rsplit("/", 1)[-1]
+        path = os.path.join(pages_dir or ".", f"debug_{group}.html")
+        if pages_dir and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                pages[group_id] = f.read()
+        else:
+            pages[group_id] = synthetic_page(index)
+    return pages
+
+
+def start_stand(args):
+    site_url = f"http://127.0.0.1:{args.site_port}"
+    api_url = f"http://127.0.0.1:{args.api_port}/bot"
+    # Адреса надо выставить до импорта парсера и бота: они читают их при загрузке
+    os.environ["ALTSTU_BASE_URL"] = site_url
+    os.environ["BOT_API_BASE_URL"] = api_url
+    os.environ["BOT_TOKEN"] = FAKE_TOKEN
+    # Генератор жмет кнопки без пауз, лимит на пользователя исказил бы замеры
+    os.environ.setdefault("RATE_LIMIT_RATE", "0")
+
+    state = SiteState(_load_pages(args.pages_dir), args.latency, args.error_rate, args.timeout_rate, args.hang)
+    _start_server(make_site_handler(state), args.site_port)
+    api = FakeBotAPI()
+    _start_server(make_api_handler(api), args.api_port)
+    return state, api, site_url, api_url
+
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def run_users(api: FakeBotAPI, users: int, duration: float, think_time: float, answer_timeout: float) -> dict:
+    """Гоняет users виртуальных пользователей duration секунд. Каждый ждет ответа на свое нажатие."""
+    import parser
+    import callbacks
+
+    groups = list(parser.GROUP_URLS)
+    latencies: List[float] = []
+    timeouts = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def user_loop(user_id: int):
+        # Сначала выбираем группу, дальше ходим по сценарию по кругу
+        data = callbacks.encode_group(groups[user_id % len(groups)])
+        step = 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            answered = api.push_callback(user_id, message_id=user_id, data=data).wait(answer_timeout)
+            with lock:
+                if answered:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    timeouts[0] += 1
+            data = USER_SCRIPT[step % len(USER_SCRIPT)]
+            step += 1
+            if think_time:
+                time.sleep(random.uniform(0, think_time * 2))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=user_loop, args=(1000 + i,), daemon=True) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(latencies),
+        "timeouts": timeouts[0],
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": _percentile(latencies, 0.50),
+        "p95": _percentile(latencies, 0.95),
+        "p99": _percentile(latencies, 0.99),
+        "max": max(latencies, default=0.0),
+    }
+
+
+def print_report(report: dict, state: SiteState, api: FakeBotAPI) -> None:
+    print("\n===== Отчет нагрузочного теста =====")
+    print(f"Ответов: {report['requests']}, без ответа: {report['timeouts']}, {report['throughput']:.1f} нажатий/с")
+    print(
+        f"Задержка ответа на нажатие: p50={report['p50'] * 1000:.1f} мс, p95={report['p95'] * 1000:.1f} мс, "
+        f"p99={report['p99'] * 1000:.1f} мс, max={report['max'] * 1000:.1f} мс"
+    )
+    print(f"Запросов к сайту по группам: {state.hits}")
+    print(f"Вызовы Bot API: {dict(sorted(api.calls.items()))}")
+
+
+def cmd_serve(args) -> None:
+    state, api, site_url, api_url = start_stand(args)
+    print(f"ALTSTU_BASE_URL={site_url}")
+    print(f"BOT_API_BASE_URL={api_url}")
+    print(f"BOT_TOKEN={FAKE_TOKEN}")
+    print("Стенд запущен, Ctrl+C для остановки")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+def cmd_run(args) -> None:
+    state, api, site_url, api_url = start_stand(args)
+
+    workdir = tempfile.mkdtemp(prefix="loadtest_")
+    os.chdir(workdir)
+
+    import bot
+    import db
+    db.DB_PATH = os.path.join(workdir, "users.db")
+    logging.disable(logging.INFO if not args.verbose else logging.NOTSET)
+
+    async def run():
+        bot_task = asyncio.create_task(bot.main())
+        # Даем боту подняться и начать polling
+        while api.calls.get("getUpdates", 0) == 0:
+            if bot_task.done():
+                bot_task.result()
+                return None
+            await asyncio.sleep(0.05)
+
+        report = await asyncio.to_thread(run_users, api, args.users, args.duration, args.think_time, args.answer_timeout)
+        bot_task.cancel()
+        try:
+            await bot_task
+        except asyncio.CancelledError:
+            pass
+        return report
+
+    report = asyncio.run(run())
+    if report:
+        print_report(report, state, api)
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description="Офлайн-стенд altstu.ru + Bot API и нагрузочный тест")
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+
+    for name, func, help_text in (
+        ("serve", cmd_serve, "только поднять стенд"),
+        ("run", cmd_run, "стенд + бот + генератор нагрузки в одном процессе"),
+    ):
+        sub = subparsers.add_parser(name, help=help_text)
+        sub.add_argument("--site-port", type=int, default=8080)
+        sub.add_argument("--api-port", type=int, default=8081)
+        sub.add_argument("--pages-dir", help="папка с сохраненными debug_<группа>.html")
+        sub.add_argument("--latency", type=float, default=0.0, help="задержка ответа сайта, сек")
+        sub.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 503")
+        sub.add_argument("--timeout-rate", type=float, default=0.0, help="доля зависших запросов")
+        sub.add_argument("--hang", type=float, default=35.0, help="сколько висит зависший запрос, сек")
+        sub.set_defaults(func=func)
+
+        if name == "run":
+            sub.add_argument("--users", type=int, default=20)
+            sub.add_argument("--duration", type=float, default=20.0)
+            sub.add_argument("--think-time", type=float, default=0.0, help="средняя пауза пользователя между нажатиями, сек")
+            sub.add_argument("--answer-timeout", type=float, default=60.0)
+            sub.add_argument("--verbose", action="store_true", help="не глушить логи бота")
+
+    args = arg_parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,67 @@
-import requests
-from bs4 import BeautifulSoup
 import re
-from datetime import datetime, timedelta
-from typing import Dict, List, Tuple, Union, Optional
+import hashlib
+import itertools
+from datetime import datetime, timedelta, timezone, date as date_type
+from typing import Dict, List, Tuple, Union, Optional, Callable
 import logging
+import os
 import time
+import profiling
+import circuit
+import freshness
+import shared_cache
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
+# Адрес сайта можно подменить на локальный стенд (см. loadtest.py)
+ALTSTU_BASE_URL = os.getenv("ALTSTU_BASE_URL", "https://www.altstu.ru").rstrip("/")
+
+# АлтГТУ в Барнауле, UTC+7 без перехода на летнее время. Даты и время занятий на сайте - по этим часам
+SCHEDULE_TZ = timezone(timedelta(hours=7))
+
+def schedule_now() -> datetime:
+    """Текущее время в поясе расписания: "сегодня" и "сейчас" не зависят от пояса сервера"""
+    return datetime.now(SCHEDULE_TZ)
+
 # Тут ссылки на группы которые хотим получать расписание
 GROUP_URLS = {
-    "ИБ-41": "https://www.altstu.ru/m/s/7000020491/",
-    "ИБ-42": "https://www.altstu.ru/m/s/7000020492/",
-    "ИБ-43": "https://www.altstu.ru/m/s/7000020493/"
+    "ИБ-41": f"{ALTSTU_BASE_URL}/m/s/7000020491/",
+    "ИБ-42": f"{ALTSTU_BASE_URL}/m/s/7000020492/",
+    "ИБ-43": f"{ALTSTU_BASE_URL}/m/s/7000020493/"
 }
 
-# Кеш для хранения расписаний, чтобы не парсить на каждый запрос
+# Кеш для хранения расписаний, чтобы не парсить на каждый запрос.
+# Лежат только замороженные снимки (Schedule.freeze), новый снимок подменяет старый одним присваиванием,
+# поэтому обработчики читают кеш без блокировок и никогда не видят недостроенное расписание.
 schedule_cache = {}
-cache_timeout = 3600  # 1 час в секундах
+# Сколько расписание считается свежим, считается по каждой группе отдельно (см. freshness.py)
+
+# False в режиме воркера: на сайт не ходим, берем расписания, которые скачал процесс-обновлятор (см. shared_cache.py)
+FETCH_ENABLED = True
+# Когда воркер последний раз проверял общий кеш для группы
+_shared_checked_at: Dict[str, float] = {}
+
+# Подписчики на обновление расписания группы, вызываются как callback(group, schedule)
+# Нужны, чтобы заранее пересобрать всё, что зависит от расписания (клавиатуры и т.п.)
+refresh_listeners: List[Callable] = []
+
+def add_refresh_listener(callback: Callable) -> None:
+    """Регистрирует обработчик, который вызывается после каждого обновления расписания в кеше"""
+    refresh_listeners.append(callback)
+
+def store_schedule(group: str, schedule) -> None:
+    """Замораживает расписание, подменяет им снимок группы в кеше и оповещает подписчиков"""
+    schedule.freeze()
+    schedule_cache[group] = schedule
+    _notify_refresh(group, schedule)
+
+def _notify_refresh(group: str, schedule) -> None:
+    for callback in refresh_listeners:
+        try:
+            callback(group, schedule)
+        except Exception as e:
+            logger.error(f"Ошибка в обработчике обновления расписания для группы {group}: {e}")
 
 # Словарь сокращений названий предметов, чтобы на мобилке красиво все было. Меняйте не свои предметы и аббревиатуры
 SUBJECT_ABBREVIATIONS = {
@@ -36,16 +79,39 @@ def get_short_subject_name(name: str) -> str:
     """Возвращает сокращенное название предмета, если оно есть в словаре сокращений"""
     return SUBJECT_ABBREVIATIONS.get(name, name)
 
+# "подгруппа А" в тексте занятия на сайте
+SUBGROUP_PATTERN = re.compile(r'подгруппа\s*([А-Я])')
+
 class Subject:
-    def __init__(self, time: str, name: str, type_: str, room: str, teacher: str, position: str, is_exam: bool = False, is_once: bool = False):
-        self.time = time
-        self.name = name
-        self.type = type_
-        self.room = room
-        self.teacher = teacher
-        self.position = position
-        self.is_exam = is_exam
-        self.is_once = is_once
+    # Неизменяемое значение: один и тот же Subject лежит в снимках, которые читают из разных потоков
+    __slots__ = ("time", "name", "type", "room", "teacher", "position", "is_exam", "is_once", "subgroup")
+    
+    def __init__(self, time: str, name: str, type_: str, room: str, teacher: str, position: str, is_exam: bool = False, is_once: bool = False, subgroup: str = ""):
+        # subgroup - буква подгруппы, "" - занятие у всей группы
+        for field, value in zip(self.__slots__, (time, name, type_, room, teacher, position, is_exam, is_once, subgroup)):
+            object.__setattr__(self, field, value)
+    
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Subject неизменяемый, поле {name} не меняется")
+    
+    def __delattr__(self, name):
+        raise AttributeError(f"Subject неизменяемый, поле {name} не удаляется")
+    
+    def __getstate__(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+    
+    def __setstate__(self, state):
+        # В общем кеше могут лежать занятия, сохраненные до появления subgroup: (None, {...}) от __slots__ или просто {...}
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **(state[1] or {})}
+        state.setdefault("subgroup", "")
+        for field in self.__slots__:
+            object.__setattr__(self, field, state[field])
+    
+    def key(self) -> tuple:
+        """Все поля занятия одним кортежем - для сравнения и хеширования"""
+        # subgroup не входит: он выделен из текста занятия, который и так здесь есть
+        return (self.time, self.name, self.type, self.room, self.teacher, self.position, self.is_exam, self.is_once)
     
     def __str__(self) -> str:
         # Используем сокращенное название предмета
@@ -76,14 +142,46 @@ class Subject:
             
         return result
 
+def _stable_hash(value) -> int:
+    # hash() для строк в каждом процессе свой, а отпечатки сравниваются и со снимками из общего кеша
+    return int.from_bytes(hashlib.blake2b(repr(value).encode("utf-8"), digest_size=8).digest(), "big")
+
 class Day:
+    # После freeze() занятия лежат в кортеже и день больше не меняется
+    frozen = False
+    
     def __init__(self, date: str, weekday: str):
         self.date = date
         self.weekday = weekday
-        self.subjects: List[Subject] = []
+        self.subjects: Union[List[Subject], Tuple[Subject, ...]] = []
+        self._fingerprint: Optional[int] = None
+        # True - дня нет на странице сайта, он достроен по двухнедельному циклу (Schedule.day_on)
+        self.projected = False
     
     def add_subject(self, subject: Subject) -> None:
+        if self.frozen:
+            raise RuntimeError(f"День {self.date} уже опубликован в расписании и не меняется")
         self.subjects.append(subject)
+        self._fingerprint = None
+    
+    def freeze(self) -> "Day":
+        if not self.frozen:
+            self.subjects = tuple(self.subjects)
+            self.fingerprint()
+            self.frozen = True
+        return self
+    
+    def fingerprint(self) -> int:
+        """Хеш содержимого дня. Одинаковый хеш - день не менялся, сравнивать занятия не нужно."""
+        if self._fingerprint is None:
+            self._fingerprint = _stable_hash(tuple(subject.key() for subject in self.subjects))
+        return self._fingerprint
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # В общем кеше могут лежать дни с отпечатком от hash() другого процесса - считаем заново
+        self._fingerprint = None
+        self.fingerprint()
     
     def __str__(self) -> str:
         if not self.subjects:
@@ -95,28 +193,212 @@ class Day:
         return result
 
 class Week:
+    frozen = False
+    
     def __init__(self, number: int):
         self.number = number
-        self.days: List[Day] = []
+        self.days: Union[List[Day], Tuple[Day, ...]] = []
     
     def add_day(self, day: Day) -> None:
+        if self.frozen:
+            raise RuntimeError(f"Неделя {self.number} уже опубликована в расписании и не меняется")
         self.days.append(day)
     
+    def freeze(self) -> "Week":
+        if not self.frozen:
+            for day in self.days:
+                day.freeze()
+            self.days = tuple(self.days)
+            self.frozen = True
+        return self
+    
     def __str__(self) -> str:
         result = f"*Неделя {self.number}*\n\n"
         for day in self.days:
             result += f"{day}\n"
         return result
 
+def parse_day_date(text: str) -> Optional[date_type]:
+    """Дата из заголовка дня на сайте (14.10.25 или 14.10.2025), None - если формат не распознан"""
+    for fmt in ("%d.%m.%y", "%d.%m.%Y"):
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+# Версии снимков расписания в этом процессе. По версии кеши текстов, клавиатур и индексов
+# понимают, что собраны по старому расписанию, не держа ссылку на сам объект.
+_versions = itertools.count(1)
+
 class Schedule:
+    """
+    Расписание группы. Парсер собирает его через add_week, а store_schedule перед публикацией в кеш
+    замораживает (freeze): недели, дни и занятия лежат в кортежах, индекс по датам построен заранее.
+    Дальше снимок только читают, новое расписание - это новый снимок со своей версией.
+    """
+    frozen = False
+    
     def __init__(self, group: str):
         self.group = group
-        self.weeks: List[Week] = []
+        self.weeks: Union[List[Week], Tuple[Week, ...]] = []
         # Добавляем время создания расписания
         self.created_at = time.time()
+        self.version = next(_versions)
+        # Индекс дата -> (номер недели, день), строится при первом запросе по дате
+        self._by_date: Optional[Dict[date_type, Tuple[int, Day]]] = None
+        # Достроенные по циклу дни. Единственное, что дописывается в снимок после публикации: запись ключа
+        # в dict атомарна, а два потока, посчитавшие один день одновременно, получат одинаковый результат
+        self._projected: Dict[date_type, Optional[Day]] = {}
+        # Подгруппа -> снимок только с ее занятиями, дописывается так же, как _projected
+        self._subgroups: Dict[str, "Schedule"] = {}
     
     def add_week(self, week: Week) -> None:
+        if self.frozen:
+            raise RuntimeError(f"Расписание группы {self.group} уже опубликовано и не меняется")
         self.weeks.append(week)
+        self._by_date = None
+        self._projected = {}
+        self._subgroups = {}
+    
+    def freeze(self) -> "Schedule":
+        if not self.frozen:
+            for week in self.weeks:
+                week.freeze()
+            self.weeks = tuple(self.weeks)
+            self._by_date = None
+            self._date_index()
+            self.frozen = True
+        return self
+    
+    def _date_index(self) -> Dict[date_type, Tuple[int, Day]]:
+        # getattr - для расписаний, сохраненных в общий кеш до появления индекса
+        if getattr(self, "_by_date", None) is None:
+            index = {}
+            for week in self.weeks:
+                for day in week.days:
+                    day_date = parse_day_date(day.date)
+                    if day_date is not None and day_date not in index:
+                        index[day_date] = (week.number, day)
+            self._by_date = index
+            self._projected = {}
+        return self._by_date
+    
+    def fingerprint(self) -> int:
+        """Хеш содержимого всего расписания: номера недель и содержимое дней"""
+        return _stable_hash(tuple((week.number, tuple((day.date, day.fingerprint()) for day in week.days)) for week in self.weeks))
+    
+    def subgroups(self) -> List[str]:
+        """Буквы подгрупп, у которых есть отдельные занятия, по алфавиту"""
+        return sorted({subject.subgroup for week in self.weeks for day in week.days for subject in day.subjects if subject.subgroup})
+    
+    def for_subgroup(self, subgroup: str) -> "Schedule":
+        """
+        Снимок для одной подгруппы: занятия всей группы и этой подгруппы, без чужих.
+        Собирается один раз на снимок; дни, где фильтровать нечего, переиспользуются как есть.
+        """
+        subgroups = getattr(self, "_subgroups", None)
+        if subgroups is None:
+            subgroups = self._subgroups = {}
+        filtered = subgroups.get(subgroup)
+        if filtered is None:
+            filtered = Schedule(self.group)
+            filtered.created_at = self.created_at
+            for week in self.weeks:
+                filtered_week = Week(week.number)
+                for day in week.days:
+                    subjects = [subject for subject in day.subjects if subject.subgroup in ("", subgroup)]
+                    if len(subjects) == len(day.subjects):
+                        filtered_week.add_day(day)
+                        continue
+                    filtered_day = Day(day.date, day.weekday)
+                    for subject in subjects:
+                        filtered_day.add_subject(subject)
+                    filtered_week.add_day(filtered_day)
+                filtered.add_week(filtered_week)
+            filtered.freeze()
+            subgroups[subgroup] = filtered
+        return filtered
+    
+    def cycle_length(self) -> int:
+        """Сколько недель в цикле чередования (на сайте их две)"""
+        # Не меньше двух: если на странице осталась только "Неделя 1", цикл от этого короче не становится
+        return max(2, max((week.number for week in self.weeks), default=2))
+    
+    def week_number_on(self, day_date: date_type) -> Optional[int]:
+        """
+        Номер недели (1 или 2) для любой даты. Считается от любой известной даты с сайта:
+        каждая следующая календарная неделя - следующий номер в цикле.
+        """
+        index = self._date_index()
+        if not index:
+            return None
+        anchor_date = min(index)
+        anchor_number = index[anchor_date][0]
+        anchor_monday = anchor_date - timedelta(days=anchor_date.weekday())
+        target_monday = day_date - timedelta(days=day_date.weekday())
+        weeks_between = (target_monday - anchor_monday).days // 7
+        return (anchor_number - 1 + weeks_between) % self.cycle_length() + 1
+    
+    def current_week_number(self) -> Optional[int]:
+        return self.week_number_on(schedule_now().date())
+    
+    def day_on(self, day_date: date_type, project: bool = True) -> Optional[Day]:
+        """
+        День расписания на дату. Если даты нет в загруженном окне сайта и project=True, день собирается
+        по двухнедельному циклу из того же дня недели с тем же номером недели (без разовых занятий и экзаменов).
+        """
+        index = self._date_index()
+        if day_date in index:
+            return index[day_date][1]
+        if not project:
+            return None
+        if day_date not in self._projected:
+            self._projected[day_date] = self._project_day(day_date)
+        return self._projected[day_date]
+    
+    def _project_day(self, day_date: date_type) -> Optional[Day]:
+        week_number = self.week_number_on(day_date)
+        if week_number is None:
+            return None
+        # Ближайший по дате известный день с тем же днем недели и номером недели
+        templates = [
+            (abs((known_date - day_date).days), day)
+            for known_date, (number, day) in self._date_index().items()
+            if number == week_number and known_date.weekday() == day_date.weekday()
+        ]
+        if not templates:
+            return None
+        template = min(templates, key=lambda item: item[0])[1]
+        day = Day(day_date.strftime("%d.%m.%y"), template.weekday)
+        day.projected = True
+        for subject in template.subjects:
+            if not (subject.is_once or subject.is_exam):
+                day.add_subject(subject)
+        return day.freeze()
+    
+    def loaded_range(self) -> Optional[Tuple[date_type, date_type]]:
+        """Первая и последняя даты, которые реально есть на странице сайта"""
+        index = self._date_index()
+        if not index:
+            return None
+        return min(index), max(index)
+    
+    def __getstate__(self):
+        # Индексы в общий кеш не кладем, они дешево строятся заново
+        state = self.__dict__.copy()
+        state["_by_date"] = None
+        state["_projected"] = {}
+        state["_subgroups"] = {}
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Копия из общего кеша - новый снимок со своей версией в этом процессе.
+        # Заново замораживаем и старые копии, сохраненные еще со списками
+        self.version = next(_versions)
+        self.frozen = False
+        self.freeze()
     
     def __str__(self) -> str:
         result = f"*Расписание группы {self.group}*\n\n"
@@ -124,10 +406,268 @@ class Schedule:
             result += f"{week}\n"
         return result
 
-def parse_schedule(group: str) -> Optional[Schedule]:
+def _parse_day_block(day_block) -> Optional[Day]:
+    """Разбирает один блок дня (div.block-index). None - если у блока нет нормального заголовка."""
+    # Находим заголовок дня
+    day_header = day_block.find('h2')
+    if not day_header:
+        logger.warning(f"Не найден заголовок дня в блоке")
+        return None
+
+    day_info = day_header.text.strip().split()
+    if len(day_info) < 2:
+        logger.warning(f"Неверный формат заголовка дня: '{day_header.text}'")
+        return None
+
+    date = day_info[0]
+    weekday = day_info[1]
+
+    logger.info(f"Обработка дня {date} {weekday}")
+
+    day = Day(date, weekday)
+
+    # Получаем список предметов для текущего дня
+    subjects_block = day_block.find('div', class_='list-group')
+    if not subjects_block:
+        logger.warning(f"Не найден блок предметов для дня {date}")
+        return day
+
+    subject_items = subjects_block.find_all('div', class_='list-group-item')
+
+    logger.info(f"Найдено {len(subject_items)} предметов для дня {date}")
+
+    for subject_item in subject_items:
+        # Проверяем является ли это разовым занятием или экзаменом
+        is_once = 'once' in subject_item.get('class', [])
+        is_exam = 'once-exam' in subject_item.get('class', [])
+
+        # Очищаем текст от лишних пробелов и переносов
+        subject_text = re.sub(r'\s+', ' ', subject_item.get_text(strip=True).replace('\n', ' '))
+        subgroup_match = SUBGROUP_PATTERN.search(subject_text)
+
+        # Извлекаем данные с помощью регулярных выражений
+        time_val = ""
+        name = ""
+        type_ = ""
+        room = ""
+        teacher = ""
+        position = ""
+
+        # Парсим время (обычно в формате XX:XX-XX:XX)
+        time_match = re.match(r'(\d{2}:\d{2}-\d{2}:\d{2})', subject_text)
+        if time_match:
+            time_val = time_match.group(1)
+            subject_text = subject_text[len(time_val):].strip()
+
+        # Парсим название предмета
+        name_elem = subject_item.find('strong')
+        if name_elem:
+            name = name_elem.text.strip()
+            # Удаляем название из оставшегося текста
+            subject_text = subject_text.replace(name, '', 1).strip()
+
+        # Парсим тип занятия (в скобках)
+        type_match = re.search(r'\(([^)]+)\)', subject_text)
+        if type_match:
+            type_ = type_match.group(0)  # Включая скобки
+            subject_text = subject_text.replace(type_, '', 1).strip()
+
+        # Парсим аудиторию
+        room_match = re.search(r'\d+\s*[А-Я]+', subject_text)
+        if room_match:
+            room = room_match.group(0)
+            subject_text = subject_text.replace(room, '', 1).strip()
+
+        # Парсим преподавателя
+        teacher_match = re.search(r'[А-Яа-я]+\s+[А-Я]\.\s*[А-Я]\.', subject_text)
+        if teacher_match:
+            teacher = teacher_match.group(0).strip()
+            subject_text = subject_text.replace(teacher, '', 1).strip()
+
+        # Оставшийся текст считаем должностью
+        position = subject_text.strip('-').strip()
+
+        # Создаем объект Subject
+        subject = Subject(
+            time=time_val,
+            name=name,
+            type_=type_,
+            room=room,
+            teacher=teacher,
+            position=position,
+            is_exam=is_exam,
+            is_once=is_once,
+            subgroup=subgroup_match.group(1) if subgroup_match else ""
+        )
+
+        logger.info(f"Добавлен предмет: {subject}")
+        day.add_subject(subject)
+
+    return day
+
+def _parse_html_full(group: str, html: str) -> Optional[Schedule]:
+    """Разбор всей страницы через BeautifulSoup - запасной путь, если страницу не удалось порезать на блоки дней"""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'lxml')
+
+    schedule = Schedule(group)
+
+    # Находим все заголовки недель
+    week_headers = soup.find_all('h4', string=re.compile(r'Неделя\s+\d+'))
+
+    if not week_headers:
+        logger.warning(f"Не найдены заголовки недель для группы {group}")
+        return None
+
+    logger.info(f"Найдено {len(week_headers)} недель")
+
+    # Разбиваем все блоки дней на разные недели
+    weeks_content = []
+    for i in range(len(week_headers)):
+        current_header = week_headers[i]
+        # Определяем, где заканчивается контент текущей недели
+        next_header = None
+        if i < len(week_headers) - 1:
+            next_header = week_headers[i + 1]
+
+        # Извлекаем номер недели
+        week_match = re.search(r'Неделя\s+(\d+)', current_header.text)
+        if not week_match:
+            logger.warning(f"Не удалось извлечь номер недели из '{current_header.text}'")
+            continue
+
+        week_number = int(week_match.group(1))
+
+        # Находим все блоки дней для этой недели
+        day_blocks = []
+        current_elem = current_header.next_sibling
+
+        while current_elem:
+            # Если достигли следующего заголовка недели, останавливаемся
+            if next_header and current_elem == next_header:
+                break
+
+            # Если это блок дня, добавляем его
+            if hasattr(current_elem, 'name') and current_elem.name == 'div' and 'block-index' in current_elem.get('class', []):
+                day_blocks.append(current_elem)
+
+            # Переходим к следующему элементу
+            if hasattr(current_elem, 'next_sibling'):
+                current_elem = current_elem.next_sibling
+            else:
+                break
+
+        weeks_content.append({
+            'week_number': week_number,
+            'day_blocks': day_blocks
+        })
+
+    # Обрабатываем каждую неделю отдельно
+    for week_data in weeks_content:
+        week_number = week_data['week_number']
+        day_blocks = week_data['day_blocks']
+
+        logger.info(f"Обработка недели {week_number}, найдено {len(day_blocks)} дней")
+
+        # Создаем объект недели
+        week = Week(week_number)
+
+        # Обрабатываем каждый день
+        for day_block in day_blocks:
+            day = _parse_day_block(day_block)
+            if day is not None:
+                week.add_day(day)
+
+        # Добавляем неделю в расписание
+        schedule.add_week(week)
+    
+    return schedule.freeze()
+
+# Заголовок недели и начало блока дня в сыром HTML страницы
+_WEEK_HEADER_RE = re.compile(r'<h4[^>]*>\s*Неделя\s+(\d+)\s*</h4>')
+_DAY_BLOCK_RE = re.compile(r'<div[^>]*class="[^"]*\bblock-index\b[^"]*"[^>]*>')
+_DIV_TAG_RE = re.compile(r'<(/?)div\b[^>]*>', re.IGNORECASE)
+
+def _block_end(html: str, start: int, limit: int) -> int:
+    """Конец блока дня: закрывающий </div> парный открывающему в start. Не нашелся до limit - limit."""
+    depth = 0
+    for match in _DIV_TAG_RE.finditer(html, start, limit):
+        depth += -1 if match.group(1) else 1
+        if depth == 0:
+            return match.end()
+    return limit
+
+# Группа -> {хеш сырого HTML блока дня: разобранный Day}. Неизменившиеся блоки заново не разбираются,
+# а раз Day тот же объект, то и всё, что по нему отрендерено, переиспользуется.
+_day_blocks: Dict[str, Dict[int, Day]] = {}
+
+def _split_day_blocks(html: str) -> Optional[List[Tuple[int, List[str]]]]:
+    """
+    Режет страницу на куски сырого HTML: [(номер недели, [HTML блока дня, ...]), ...].
+    Блок дня - от его открывающего div до парного закрывающего (но не дальше следующего блока или заголовка недели),
+    чтобы подвал страницы и прочее между блоками не попадали в хеш дня.
+    None - если на странице не нашлось заголовков недель или блоков дней.
+    """
+    marks = [(m.start(), int(m.group(1))) for m in _WEEK_HEADER_RE.finditer(html)]
+    marks += [(m.start(), None) for m in _DAY_BLOCK_RE.finditer(html)]
+    if not any(week is None for _, week in marks) or not any(week is not None for _, week in marks):
+        return None
+    marks.sort()
+
+    weeks = []
+    for i, (start, week_number) in enumerate(marks):
+        if week_number is not None:
+            weeks.append((week_number, []))
+            continue
+        # Блоки до первого заголовка недели ни к какой неделе не относятся
+        if weeks:
+            limit = marks[i + 1][0] if i + 1 < len(marks) else len(html)
+            weeks[-1][1].append(html[start:_block_end(html, start, limit)])
+    return weeks
+
+def parse_html(group: str, html: str) -> Optional[Schedule]:
+    """
+    Разбирает HTML-страницу расписания группы в объект Schedule.
+    Сеть и кеш не трогает, поэтому годится и для сохраненных страниц (debug_*.html).
+    Разбираются только блоки дней, которых не было в прошлой версии страницы группы, остальные Day берутся готовыми.
+    """
+    weeks = _split_day_blocks(html)
+    if weeks is None:
+        logger.warning(f"Не удалось порезать страницу группы {group} на блоки дней, разбираем целиком")
+        _day_blocks.pop(group, None)
+        return _parse_html_full(group, html)
+
+    from bs4 import BeautifulSoup
+
+    schedule = Schedule(group)
+    previous = _day_blocks.get(group, {})
+    current: Dict[int, Day] = {}
+    reparsed = 0
+
+    for week_number, blocks in weeks:
+        week = Week(week_number)
+        for raw in blocks:
+            key = hash(raw)
+            day = current.get(key) or previous.get(key)
+            if day is None:
+                day_block = BeautifulSoup(raw, 'lxml').find('div', class_='block-index')
+                day = _parse_day_block(day_block) if day_block else None
+                reparsed += 1
+                if day is None:
+                    continue
+            current[key] = day
+            week.add_day(day)
+        schedule.add_week(week)
+
+    _day_blocks[group] = current
+    logger.info(f"Расписание группы {group}: разобрано блоков дней {reparsed} из {len(current)}")
+    return schedule.freeze()
+
+def parse_schedule(group: str, count_access: bool = True) -> Optional[Schedule]:
     """
     Парсит расписание для указанной группы.
     Использует кеширование для уменьшения количества запросов к серверу.
+    count_access=False - запрос не от пользователя (фоновое обновление), в популярность группы не идет.
     """
     global schedule_cache
     
@@ -135,407 +675,187 @@ def parse_schedule(group: str) -> Optional[Schedule]:
         logger.error(f"Группа {group} не найдена в списке URL")
         return None
     
+    if count_access:
+        freshness.record_access(group)
+        profiling.annotate(group=group)
+    
+    if not FETCH_ENABLED:
+        # Воркер на сайт не ходит, для журнала использования это всегда попадание в кеш
+        profiling.annotate(cache_hit=True)
+        return _schedule_from_shared_store(group)
+    
     # Проверяем кеш
     if group in schedule_cache:
         cached_schedule = schedule_cache[group]
         # Проверяем время создания расписания
-        if hasattr(cached_schedule, 'created_at') and time.time() - cached_schedule.created_at < cache_timeout:
+        if hasattr(cached_schedule, 'created_at') and time.time() - cached_schedule.created_at < freshness.ttl(group):
             logger.info(f"Используем кешированное расписание для группы {group}")
+            profiling.annotate(cache_hit=True)
             return cached_schedule
     
+    profiling.annotate(cache_hit=False)
     url = GROUP_URLS[group]
     
+    # Если сайт недавно лежал, не ждем тайм-аутов, а сразу отдаем то, что есть в кеше
+    breaker = circuit.get_breaker(url)
+    if not breaker.allow_request():
+        logger.warning(f"Сайт {breaker.host} недоступен, не ходим за расписанием группы {group}")
+        return _stale_or_none(group)
+    
+    import requests
+    
     # Количество попыток запроса
     max_retries = 3
-    retry_delay = 2  # секунды
+    retry_delay = 1  # секунды
     
     for attempt in range(max_retries):
         try:
             logger.info(f"Получение расписания для группы {group}, попытка {attempt+1}")
             
+            # Тайм-ауты подстраиваются под то, как сайт отвечал последнее время
+            connect_timeout, read_timeout = breaker.timeouts()
+            
             # Настройка сессии с параметрами тайм-аута
             session = requests.Session()
-            response = session.get(
-                url, 
-                timeout=(10, 30),  # (connect timeout, read timeout)
-                headers={
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-                }
-            )
-            response.raise_for_status()
+            with profiling.span("fetch"):
+                started = time.perf_counter()
+                response = session.get(
+                    url, 
+                    timeout=(connect_timeout, read_timeout),
+                    headers={
+                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+                    }
+                )
+                response.raise_for_status()
+            breaker.record_success(time.perf_counter() - started)
             
             # Сохраним ответ сервера в отладочный файл для анализа
             with open(f"debug_{group}.html", "w", encoding="utf-8") as f:
                 f.write(response.text)
             
-            soup = BeautifulSoup(response.text, 'lxml')
-            
-            schedule = Schedule(group)
-            
-            # Находим все заголовки недель
-            week_headers = soup.find_all('h4', string=re.compile(r'Неделя\s+\d+'))
-            
-            if not week_headers:
-                logger.warning(f"Не найдены заголовки недель для группы {group}")
+            with profiling.span("parse_html"):
+                schedule = parse_html(group, response.text)
+            if schedule is None:
                 return None
-                
-            logger.info(f"Найдено {len(week_headers)} недель")
-            
-            # Разбиваем все блоки дней на разные недели
-            weeks_content = []
-            for i in range(len(week_headers)):
-                current_header = week_headers[i]
-                # Определяем, где заканчивается контент текущей недели
-                next_header = None
-                if i < len(week_headers) - 1:
-                    next_header = week_headers[i + 1]
-                
-                # Извлекаем номер недели
-                week_match = re.search(r'Неделя\s+(\d+)', current_header.text)
-                if not week_match:
-                    logger.warning(f"Не удалось извлечь номер недели из '{current_header.text}'")
-                    continue
-                
-                week_number = int(week_match.group(1))
-                
-                # Находим все блоки дней для этой недели
-                day_blocks = []
-                current_elem = current_header.next_sibling
-                
-                while current_elem:
-                    # Если достигли следующего заголовка недели, останавливаемся
-                    if next_header and current_elem == next_header:
-                        break
-                    
-                    # Если это блок дня, добавляем его
-                    if hasattr(current_elem, 'name') and current_elem.name == 'div' and 'block-index' in current_elem.get('class', []):
-                        day_blocks.append(current_elem)
-                    
-                    # Переходим к следующему элементу
-                    if hasattr(current_elem, 'next_sibling'):
-                        current_elem = current_elem.next_sibling
-                    else:
-                        break
-                
-                weeks_content.append({
-                    'week_number': week_number,
-                    'day_blocks': day_blocks
-                })
-            
-            # Обрабатываем каждую неделю отдельно
-            for week_data in weeks_content:
-                week_number = week_data['week_number']
-                day_blocks = week_data['day_blocks']
-                
-                logger.info(f"Обработка недели {week_number}, найдено {len(day_blocks)} дней")
-                
-                # Создаем объект недели
-                week = Week(week_number)
-                
-                # Обрабатываем каждый день
-                for day_block in day_blocks:
-                    # Находим заголовок дня
-                    day_header = day_block.find('h2')
-                    if not day_header:
-                        logger.warning(f"Не найден заголовок дня в блоке")
-                        continue
-                    
-                    day_info = day_header.text.strip().split()
-                    if len(day_info) < 2:
-                        logger.warning(f"Неверный формат заголовка дня: '{day_header.text}'")
-                        continue
-                    
-                    date = day_info[0]
-                    weekday = day_info[1]
-                    
-                    logger.info(f"Обработка дня {date} {weekday}")
-                    
-                    day = Day(date, weekday)
-                    
-                    # Получаем список предметов для текущего дня
-                    subjects_block = day_block.find('div', class_='list-group')
-                    if not subjects_block:
-                        logger.warning(f"Не найден блок предметов для дня {date}")
-                        week.add_day(day)
-                        continue
-                    
-                    subject_items = subjects_block.find_all('div', class_='list-group-item')
-                    
-                    logger.info(f"Найдено {len(subject_items)} предметов для дня {date}")
-                    
-                    for subject_item in subject_items:
-                        # Проверяем является ли это разовым занятием или экзаменом
-                        is_once = 'once' in subject_item.get('class', [])
-                        is_exam = 'once-exam' in subject_item.get('class', [])
-                        
-                        # Очищаем текст от лишних пробелов и переносов
-                        subject_text = re.sub(r'\s+', ' ', subject_item.get_text(strip=True).replace('\n', ' '))
-                        
-                        # Извлекаем данные с помощью регулярных выражений
-                        time_val = ""
-                        name = ""
-                        type_ = ""
-                        room = ""
-                        teacher = ""
-                        position = ""
-                        
-                        # Парсим время (обычно в формате XX:XX-XX:XX)
-                        time_match = re.match(r'(\d{2}:\d{2}-\d{2}:\d{2})', subject_text)
-                        if time_match:
-                            time_val = time_match.group(1)
-                            subject_text = subject_text[len(time_val):].strip()
-                        
-                        # Парсим название предмета
-                        name_elem = subject_item.find('strong')
-                        if name_elem:
-                            name = name_elem.text.strip()
-                            # Удаляем название из оставшегося текста
-                            subject_text = subject_text.replace(name, '', 1).strip()
-                        
-                        # Парсим тип занятия (в скобках)
-                        type_match = re.search(r'\(([^)]+)\)', subject_text)
-                        if type_match:
-                            type_ = type_match.group(0)  # Включая скобки
-                            subject_text = subject_text.replace(type_, '', 1).strip()
-                        
-                        # Парсим аудиторию
-                        room_match = re.search(r'\d+\s*[А-Я]+', subject_text)
-                        if room_match:
-                            room = room_match.group(0)
-                            subject_text = subject_text.replace(room, '', 1).strip()
-                        
-                        # Парсим преподавателя
-                        teacher_match = re.search(r'[А-Яа-я]+\s+[А-Я]\.\s*[А-Я]\.', subject_text)
-                        if teacher_match:
-                            teacher = teacher_match.group(0).strip()
-                            subject_text = subject_text.replace(teacher, '', 1).strip()
-                        
-                        # Оставшийся текст считаем должностью
-                        position = subject_text.strip('-').strip()
-                        
-                        # Создаем объект Subject
-                        subject = Subject(
-                            time=time_val,
-                            name=name,
-                            type_=type_,
-                            room=room,
-                            teacher=teacher,
-                            position=position,
-                            is_exam=is_exam,
-                            is_once=is_once
-                        )
-                        
-                        logger.info(f"Добавлен предмет: {subject}")
-                        day.add_subject(subject)
-                    
-                    week.add_day(day)
-                
-                # Добавляем неделю в расписание
-                schedule.add_week(week)
             
+            freshness.record_fetch(group, schedule.fingerprint())
             # Сохраняем в кеш
-            schedule_cache[group] = schedule
+            store_schedule(group, schedule)
             
             return schedule
         
-        except requests.Timeout as e:
-            logger.error(f"Тайм-аут при запросе расписания для группы {group}: {e}")
-            if attempt < max_retries - 1:
-                logger.info(f"Повторная попытка через {retry_delay} сек...")
-                # Используем time.sleep() вместо sleep
-                time.sleep(retry_delay)
-                retry_delay *= 2  # Увеличиваем задержку для следующей попытки
-            else:
-                logger.error(f"Превышено количество попыток запроса расписания для группы {group}")
-                # Проверяем, есть ли устаревшие данные в кеше
-                if group in schedule_cache:
-                    logger.info(f"Используем устаревшие данные из кеша для группы {group}")
-                    return schedule_cache[group]
-                return None
-                
         except requests.RequestException as e:
-            logger.error(f"Ошибка при запросе расписания для группы {group}: {e}")
-            if attempt < max_retries - 1:
-                logger.info(f"Повторная попытка через {retry_delay} сек...")
-                time.sleep(retry_delay)
-                retry_delay *= 2
+            if isinstance(e, requests.Timeout):
+                logger.error(f"Тайм-аут при запросе расписания для группы {group}: {e}")
             else:
-                logger.error(f"Превышено количество попыток запроса расписания для группы {group}")
-                # Проверяем, есть ли устаревшие данные в кеше
-                if group in schedule_cache:
-                    logger.info(f"Используем устаревшие данные из кеша для группы {group}")
-                    return schedule_cache[group]
-                return None
+                logger.error(f"Ошибка при запросе расписания для группы {group}: {e}")
+            breaker.record_failure()
+            
+            # Цепь открылась - сайт лежит, дальше ретраить бессмысленно
+            if breaker.is_open():
+                return _stale_or_none(group)
                 
         except Exception as e:
             logger.error(f"Непредвиденная ошибка при парсинге расписания для группы {group}: {e}")
-            if attempt < max_retries - 1:
-                logger.info(f"Повторная попытка через {retry_delay} сек...")
-                time.sleep(retry_delay)
-                retry_delay *= 2
-            else:
-                logger.error(f"Превышено количество попыток запроса расписания для группы {group}")
-                # Проверяем, есть ли устаревшие данные в кеше
-                if group in schedule_cache:
-                    logger.info(f"Используем устаревшие данные из кеша для группы {group}")
-                    return schedule_cache[group]
-                return None
+        
+        if attempt < max_retries - 1:
+            logger.info(f"Повторная попытка через {retry_delay} сек...")
+            time.sleep(retry_delay)
+            retry_delay *= 2  # Увеличиваем задержку для следующей попытки
+    
+    logger.error(f"Превышено количество попыток запроса расписания для группы {group}")
+    return _stale_or_none(group)
+
+def _schedule_from_shared_store(group: str) -> Optional[Schedule]:
+    """Режим воркера: локальная копия, которая раз в shared_cache.POLL_INTERVAL сверяется с общим кешем"""
+    cached_schedule = schedule_cache.get(group)
+    now = time.time()
+    if cached_schedule is not None and now - _shared_checked_at.get(group, 0) < shared_cache.POLL_INTERVAL:
+        return cached_schedule
     
+    _shared_checked_at[group] = now
+    schedule = shared_cache.load(group, newer_than=cached_schedule.created_at if cached_schedule else None)
+    if schedule is not None:
+        store_schedule(group, schedule)
+        return schedule
+    
+    if cached_schedule is None:
+        logger.warning(f"Расписания группы {group} еще нет в общем кеше")
+    return cached_schedule
+
+def seconds_until_stale(group: str) -> float:
+    """Через сколько секунд расписание группы в кеше устареет (0 - уже устарело или его нет)"""
+    cached_schedule = schedule_cache.get(group)
+    if cached_schedule is None:
+        return 0.0
+    return max(0.0, cached_schedule.created_at + freshness.ttl(group) - time.time())
+
+def _stale_or_none(group: str) -> Optional[Schedule]:
+    # Проверяем, есть ли устаревшие данные в кеше
+    if group in schedule_cache:
+        logger.info(f"Используем устаревшие данные из кеша для группы {group}")
+        return schedule_cache[group]
     return None
 
-def get_today_schedule(group: str) -> str:
+def preload_fetch_stack() -> None:
+    """
+    Импортирует requests, BeautifulSoup и lxml. На уровне модуля их нет, чтобы import parser был дешевым
+    (db-скрипты, бенчмарки, быстрый старт бота), а бот при старте грузит их в фоне до первого похода на сайт.
+    """
+    import requests
+    import bs4
+    import lxml.etree
+
+def warm_cache() -> int:
+    """Кладет в кеш последние сохраненные расписания из общего кеша на диске, без сети. Возвращает, сколько групп загружено."""
+    loaded = 0
+    for group in GROUP_URLS:
+        if group in schedule_cache:
+            continue
+        schedule = shared_cache.load(group)
+        if schedule is not None:
+            store_schedule(group, schedule)
+            loaded += 1
+    return loaded
+
+def _day_schedule_text(group: str, schedule: Optional[Schedule], day_date: date_type, label: str) -> str:
+    if not schedule:
+        return f"Не удалось получить расписание для группы {group}"
+    
+    logger.info(f"Поиск расписания на {label} ({day_date.strftime('%d.%m.%y')}) для группы {group}")
+    # Даты за окном сайта достраиваются по двухнедельному циклу (Schedule.day_on)
+    day = schedule.day_on(day_date)
+    if day is None:
+        logger.warning(f"Расписание на {label} для группы {group} не найдено")
+        return f"Расписание на {label} для группы {group} не найдено"
+    
+    result = f"*Расписание группы {group} на {label}*\n\n----- *{day.date} {day.weekday}* -----\n\n"
+    if not day.subjects:
+        result += "Занятий нет"
+    for subject in day.subjects:
+        result += f"{subject}\n"
+    if day.projected:
+        result += "\n_Дня еще нет на сайте, расписание по чередованию недель_"
+    return result
+
+def get_today_schedule(group: str, schedule: Optional[Schedule] = None) -> str:
     try:
-        schedule = parse_schedule(group)
-        if not schedule:
-            return f"Не удалось получить расписание для группы {group}"
-        
-        today = datetime.now()
-        today_date = today.strftime("%d.%m.%y")
-        
-        logger.info(f"Поиск расписания на сегодня ({today_date}) для группы {group}")
-        
-        for week in schedule.weeks:
-            for day in week.days:
-                day_date = day.date
-                logger.info(f"Проверка дня {day_date}")
-                
-                try:
-                    # Иногда формат даты может быть другим, поэтому пробуем несколько вариантов
-                    day_date_obj = None
-                    
-                    date_formats = ["%d.%m.%y", "%d.%m.%Y"]
-                    for fmt in date_formats:
-                        try:
-                            day_date_obj = datetime.strptime(day_date, fmt)
-                            break
-                        except ValueError:
-                            continue
-                    
-                    if not day_date_obj:
-                        logger.warning(f"Не удалось распознать формат даты: {day_date}")
-                        continue
-                    
-                    logger.info(f"Сравнение дат: {day_date_obj.date()} и {today.date()}")
-                    
-                    if day_date_obj.date() == today.date():
-                        logger.info(f"Найдено расписание на сегодня для группы {group}")
-                        
-                        if not day.subjects:
-                            return f"*Расписание группы {group} на сегодня*\n\n----- *{day.date} {day.weekday}* -----\n\nЗанятий нет"
-                        
-                        result = f"*Расписание группы {group} на сегодня*\n\n----- *{day.date} {day.weekday}* -----\n\n"
-                        for subject in day.subjects:
-                            result += f"{subject}\n"
-                        
-                        return result
-                except Exception as e:
-                    logger.error(f"Ошибка при обработке даты {day_date}: {e}")
-                    continue
-        
-        logger.warning(f"Расписание на сегодня для группы {group} не найдено")
-        return f"Расписание на сегодня для группы {group} не найдено"
+        # Уже полученное расписание можно передать явно, тогда в сеть не ходим
+        if schedule is None:
+            with profiling.span("parse_schedule"):
+                schedule = parse_schedule(group)
+        return _day_schedule_text(group, schedule, schedule_now().date(), "сегодня")
     except Exception as e:
         logger.error(f"Ошибка при получении расписания на сегодня для группы {group}: {e}")
         return f"Произошла ошибка при получении расписания. Пожалуйста, попробуйте позже."
 
-def get_tomorrow_schedule(group: str) -> str:
+def get_tomorrow_schedule(group: str, schedule: Optional[Schedule] = None) -> str:
     try:
-        schedule = parse_schedule(group)
-        if not schedule:
-            return f"Не удалось получить расписание для группы {group}"
-        
-        today = datetime.now()
-        tomorrow = today + timedelta(days=1)
-        tomorrow_date = tomorrow.strftime("%d.%m.%y")
-        
-        logger.info(f"Поиск расписания на завтра ({tomorrow_date}) для группы {group}")
-        
-        for week in schedule.weeks:
-            for day in week.days:
-                day_date = day.date
-                logger.info(f"Проверка дня {day_date}")
-                
-                try:
-                    # Иногда формат даты может быть другим, поэтому пробуем несколько вариантов
-                    day_date_obj = None
-                    
-                    date_formats = ["%d.%m.%y", "%d.%m.%Y"]
-                    for fmt in date_formats:
-                        try:
-                            day_date_obj = datetime.strptime(day_date, fmt)
-                            break
-                        except ValueError:
-                            continue
-                    
-                    if not day_date_obj:
-                        logger.warning(f"Не удалось распознать формат даты: {day_date}")
-                        continue
-                    
-                    logger.info(f"Сравнение дат: {day_date_obj.date()} и {tomorrow.date()}")
-                    
-                    if day_date_obj.date() == tomorrow.date():
-                        logger.info(f"Найдено расписание на завтра для группы {group}")
-                        
-                        if not day.subjects:
-                            return f"*Расписание группы {group} на завтра*\n\n----- *{day.date} {day.weekday}* -----\n\nЗанятий нет"
-                        
-                        result = f"*Расписание группы {group} на завтра*\n\n----- *{day.date} {day.weekday}* -----\n\n"
-                        for subject in day.subjects:
-                            result += f"{subject}\n"
-                        
-                        return result
-                except Exception as e:
-                    logger.error(f"Ошибка при обработке даты {day_date}: {e}")
-                    continue
-        
-        logger.warning(f"Расписание на завтра для группы {group} не найдено")
-        return f"Расписание на завтра для группы {group} не найдено"
+        # Уже полученное расписание можно передать явно, тогда в сеть не ходим
+        if schedule is None:
+            with profiling.span("parse_schedule"):
+                schedule = parse_schedule(group)
+        return _day_schedule_text(group, schedule, schedule_now().date() + timedelta(days=1), "завтра")
     except Exception as e:
         logger.error(f"Ошибка при получении расписания на завтра для группы {group}: {e}")
         return f"Произошла ошибка при получении расписания. Пожалуйста, попробуйте позже."
-
-def get_week_schedule(group: str, week_number: int = None) -> str:
-    try:
-        schedule = parse_schedule(group)
-        if not schedule:
-            return f"Не удалось получить расписание для группы {group}"
-        
-        if week_number is None:
-            # Определяем текущую неделю (для простоты - неделя 1)
-            week_number = 1
-        
-        logger.info(f"Поиск расписания на неделю {week_number} для группы {group}")
-        
-        for week in schedule.weeks:
-            if week.number == week_number:
-                logger.info(f"Найдена неделя {week_number}, дней: {len(week.days)}")
-                
-                if not week.days:
-                    return f"*Расписание группы {group} на неделю {week_number}*\n\nНет данных о занятиях"
-                
-                # Сортируем дни по дате
-                sorted_days = sorted(week.days, key=lambda d: datetime.strptime(d.date, "%d.%m.%y") if "." in d.date else datetime.now())
-                
-                # Берем только первые дни, чтобы сообщение не было слишком длинным
-                days_to_show = sorted_days[:3]
-                
-                # Формируем текст расписания
-                result = f"*Расписание группы {group} на неделю {week_number}*\n\n"
-                
-                for day in days_to_show:
-                    # Добавляем сокращенный разделитель для каждого дня
-                    result += f"----- *{day.date} {day.weekday}* -----\n"
-                    if day.subjects:
-                        for subject in day.subjects:
-                            result += f"{subject}\n"
-                    else:
-                        result += "Занятий нет\n"
-                    result += "\n"
-                    
-                return result
-        
-        logger.warning(f"Расписание на неделю {week_number} для группы {group} не найдено")
-        return f"Расписание на неделю {week_number} для группы {group} не найдено"
-    except Exception as e:
-        logger.error(f"Ошибка при получении расписания на неделю {week_number} для группы {group}: {e}")
-        return f"Произошла ошибка при получении расписания. Пожалуйста, попробуйте позже." 
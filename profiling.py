@@ -0,0 +1,294 @@
+import os
+import sys
+import time
+import logging
+import asyncio
+import cProfile
+import pstats
+import io
+import threading
+import itertools
+import contextvars
+import functools
+import subprocess
+from collections import deque, Counter
+from contextlib import contextmanager
+from typing import Optional, List, Tuple, Callable
+
+# Лёгкий трейсинг обработчиков и профилирование "на лету", без перезапуска бота
+logger = logging.getLogger(__name__)
+
+# Сколько последних спанов держим в памяти (кольцевой буфер)
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "2000"))
+# Куда складываем файлы профилей
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Интервал сэмплирования для sampling-профайлера, в секундах
+SAMPLE_INTERVAL = 0.005
+
+# Каждая запись: (trace_id, глубина, имя стадии, время начала, длительность в мс)
+_spans: deque = deque(maxlen=TRACE_BUFFER_SIZE)
+_trace_ids = itertools.count(1)
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+_current_depth: contextvars.ContextVar = contextvars.ContextVar("current_depth", default=0)
+# Атрибуты текущего апдейта (группа, вид, попадание в кеш), см. annotate.
+# Словарь общий для всего трейса, так что атрибуты видны и из asyncio.to_thread (контекст копируется, словарь тот же)
+_current_attrs: contextvars.ContextVar = contextvars.ContextVar("current_attrs", default=None)
+
+# Подписчики на завершение обработки апдейта, вызываются как callback(name, args, duration_ms, attrs)
+trace_listeners: List[Callable] = []
+
+# Чтобы два профиля не запускались одновременно
+_profile_lock = threading.Lock()
+
+# Фазы старта бота: (имя, perf_counter начала, длительность в мс) и момент, когда обслужен первый апдейт
+_startup_phases: List[Tuple[str, float, float]] = []
+_first_update_at: Optional[float] = None
+
+
+@contextmanager
+def span(name: str):
+    """Замеряет стадию обработки апдейта и кладет результат в кольцевой буфер"""
+    trace_id = _current_trace.get()
+    depth = _current_depth.get()
+    token = _current_depth.set(depth + 1)
+    started_at = time.time()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        _current_depth.reset(token)
+        _spans.append((trace_id, depth, name, started_at, duration_ms))
+
+
+def add_trace_listener(callback: Callable) -> None:
+    """Регистрирует обработчик, который вызывается после каждого апдейта, обработанного через traced"""
+    trace_listeners.append(callback)
+
+
+def annotate(**attrs) -> None:
+    """Добавляет атрибуты к текущему апдейту. Вне обработчика ничего не делает."""
+    current = _current_attrs.get()
+    if current is not None:
+        current.update(attrs)
+
+
+def _notify_trace(name: str, args: tuple, duration_ms: float, attrs: dict) -> None:
+    for callback in trace_listeners:
+        try:
+            callback(name, args, duration_ms, attrs)
+        except Exception as e:
+            logger.error(f"Ошибка в обработчике завершения апдейта {name}: {e}")
+
+
+def traced(name: str):
+    """Декоратор для обработчиков: заводит новый trace_id на каждый апдейт"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            # Если нас вызвали из другого обработчика (button_handler), продолжаем его трейс
+            if _current_trace.get() is not None:
+                # Для журнала использования важен конкретный обработчик, а не общий button_handler
+                annotate(handler=name)
+                with span(name):
+                    return await func(*args, **kwargs)
+
+            trace_token = _current_trace.set(next(_trace_ids))
+            depth_token = _current_depth.set(0)
+            attrs = {}
+            attrs_token = _current_attrs.set(attrs)
+            start = time.perf_counter()
+            try:
+                with span(name):
+                    return await func(*args, **kwargs)
+            finally:
+                _current_attrs.reset(attrs_token)
+                _current_depth.reset(depth_token)
+                _current_trace.reset(trace_token)
+                if trace_listeners:
+                    _notify_trace(name, args, (time.perf_counter() - start) * 1000, attrs)
+        return wrapper
+    return decorator
+
+
+def get_traces(limit: int = 10) -> List[List[Tuple]]:
+    """Возвращает последние limit трейсов, каждый - список спанов в порядке начала"""
+    traces = {}
+    for record in _spans:
+        traces.setdefault(record[0], []).append(record)
+
+    result = []
+    for trace_id in sorted((t for t in traces if t is not None), reverse=True)[:limit]:
+        result.append(sorted(traces[trace_id], key=lambda r: (r[3], r[1])))
+    return result
+
+
+def format_traces(limit: int = 10) -> str:
+    """Текстовый дамп последних трейсов для админ-команды и сигнала"""
+    traces = get_traces(limit)
+    if not traces:
+        return "Трейсов пока нет"
+
+    lines = []
+    for records in traces:
+        lines.append(f"trace #{records[0][0]} ({time.strftime('%H:%M:%S', time.localtime(records[0][3]))})")
+        for _, depth, name, _, duration_ms in records:
+            lines.append(f"{'  ' * (depth + 1)}{name}: {duration_ms:.1f} мс")
+    return "\n".join(lines)
+
+
+def format_summary() -> str:
+    """Сводка по стадиям: количество, среднее и максимум по всему буферу"""
+    stats = {}
+    for _, _, name, _, duration_ms in _spans:
+        count, total, worst = stats.get(name, (0, 0.0, 0.0))
+        stats[name] = (count + 1, total + duration_ms, max(worst, duration_ms))
+
+    if not stats:
+        return "Трейсов пока нет"
+
+    lines = []
+    for name, (count, total, worst) in sorted(stats.items(), key=lambda item: -item[1][1]):
+        lines.append(f"{name}: n={count}, avg={total / count:.1f} мс, max={worst:.1f} мс")
+    return "\n".join(lines)
+
+
+def dump_traces_to_log(limit: int = 20) -> None:
+    logger.info(f"Дамп трейсов:\n{format_traces(limit)}\n\nСводка:\n{format_summary()}")
+
+
+def _profile_path(kind: str, ext: str) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    return os.path.join(PROFILE_DIR, f"{kind}_{time.strftime('%Y%m%d_%H%M%S')}.{ext}")
+
+
+def _sample_stacks(thread_id: int, seconds: float) -> Counter:
+    """Сэмплирует стек указанного потока и считает свернутые стеки (формат flamegraph.pl)"""
+    stacks = Counter()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        if names:
+            stacks[";".join(reversed(names))] += 1
+        time.sleep(SAMPLE_INTERVAL)
+    return stacks
+
+
+async def capture_profile(seconds: float = 30, mode: str = "cprofile") -> Optional[str]:
+    """
+    Профилирует работающий бот seconds секунд и пишет файл в PROFILE_DIR.
+    mode="cprofile" - .pstats (смотреть через snakeviz / pstats),
+    mode="sample" - свернутые стеки .folded (flamegraph.pl, speedscope).
+    Возвращает путь к файлу или None, если профиль уже снимается.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        logger.warning("Профилирование уже запущено")
+        return None
+
+    try:
+        if mode == "sample":
+            # Сэмплируем поток event loop'а из отдельного потока, чтобы не мешать обработке
+            loop_thread_id = threading.get_ident()
+            stacks = await asyncio.to_thread(_sample_stacks, loop_thread_id, seconds)
+            path = _profile_path("sample", "folded")
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profiler.disable()
+            path = _profile_path("cprofile", "pstats")
+            profiler.dump_stats(path)
+
+        logger.info(f"Профиль ({mode}, {seconds} сек) сохранен в {path}")
+        return path
+    finally:
+        _profile_lock.release()
+
+
+def summarize_profile(path: str, limit: int = 15) -> str:
+    """Короткая текстовая выжимка по файлу профиля"""
+    if path.endswith(".folded"):
+        with open(path, encoding="utf-8") as f:
+            lines = [line.rsplit(" ", 1) for line in f.read().splitlines() if line]
+        total = sum(int(count) for _, count in lines) or 1
+        leaves = Counter()
+        for stack, count in lines:
+            leaves[stack.split(";")[-1]] += int(count)
+        return "\n".join(f"{count * 100 / total:.1f}% {name}" for name, count in leaves.most_common(limit))
+
+    out = io.StringIO()
+    pstats.Stats(path, stream=out).sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
+
+
+@contextmanager
+def startup_phase(name: str):
+    """Замеряет фазу запуска бота для отчета --profile-startup"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _startup_phases.append((name, start, (time.perf_counter() - start) * 1000))
+
+
+def record_startup_phase(name: str, start: float, end: Optional[float] = None) -> None:
+    end = time.perf_counter() if end is None else end
+    _startup_phases.append((name, start, (end - start) * 1000))
+
+
+def mark_first_update() -> bool:
+    """Запоминает момент обслуживания первого апдейта. True - если это он и был."""
+    global _first_update_at
+    if _first_update_at is not None:
+        return False
+    _first_update_at = time.perf_counter()
+    return True
+
+
+def format_startup_report(origin: float) -> str:
+    """Фазы запуска со смещением от origin (perf_counter в самом начале процесса). Параллельные фазы пересекаются."""
+    lines = []
+    for name, start, duration_ms in sorted(_startup_phases, key=lambda phase: phase[1]):
+        lines.append(f"+{(start - origin) * 1000:7.1f} мс  {name}: {duration_ms:.1f} мс")
+    if _first_update_at is not None:
+        lines.append(f"Первый апдейт обслужен через {(_first_update_at - origin) * 1000:.1f} мс после старта")
+    return "\n".join(lines) if lines else "Фаз запуска не записано"
+
+
+def importtime_report(module: str, limit: int = 15) -> str:
+    """Самые дорогие импорты модуля по -X importtime (в отдельном процессе, чтобы кеш модулей был холодным)"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        try:
+            self_us, cumulative_us = int(parts[0]), int(parts[1])
+        except ValueError:
+            continue  # строка заголовка
+        rows.append((cumulative_us, self_us, parts[2].rstrip()))
+
+    if not rows:
+        return f"Не удалось получить importtime для {module}: {result.stderr.strip()[-300:]}"
+
+    # Модули верхнего уровня - с наименьшим отступом после "|"
+    top_indent = min(len(name) - len(name.lstrip()) for _, _, name in rows)
+    total = sum(cumulative for cumulative, _, name in rows if len(name) - len(name.lstrip()) == top_indent)
+    lines = [f"import {module}: {total / 1000:.1f} мс всего, самые дорогие (cumulative / self):"]
+    for cumulative, self_us, name in sorted(rows, reverse=True)[:limit]:
+        lines.append(f"{cumulative / 1000:7.1f} / {self_us / 1000:6.1f} мс  {name.strip()}")
+    return "\n".join(lines)
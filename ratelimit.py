@@ -0,0 +1,77 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+# Ограничение частоты запросов от одного пользователя (token bucket).
+# Проверка стоит в самой ранней группе обработчиков, до базы и парсера, и держит состояние только в памяти.
+logger = logging.getLogger(__name__)
+
+# Сколько запросов подряд можно сделать сразу
+BURST = int(os.getenv("RATE_LIMIT_BURST", "5"))
+# С какой скоростью восстанавливаются запросы, штук в секунду (0 - ограничение выключено)
+RATE = float(os.getenv("RATE_LIMIT_RATE", "1"))
+# Через сколько секунд без запросов пользователь забывается
+IDLE_TTL = 600
+# Больше пользователей в памяти не держим, самые давние вытесняются
+MAX_TRACKED_USERS = 100000
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated_at", "throttled")
+
+    def __init__(self, now: float, burst: int):
+        self.tokens = float(burst)
+        self.updated_at = now
+        # Уже ограничен - чтобы писать в лог один раз на серию, а не на каждый апдейт
+        self.throttled = False
+
+
+class RateLimiter:
+    """Token bucket на пользователя. Записи упорядочены по последнему обращению, так что старые чистятся с начала."""
+    def __init__(self, burst: int = BURST, rate: float = RATE, idle_ttl: float = IDLE_TTL):
+        self.burst = burst
+        self.rate = rate
+        self.idle_ttl = idle_ttl
+        self.buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self.dropped = 0
+
+    def allow(self, user_id: int, now: Optional[float] = None) -> bool:
+        if self.rate <= 0:
+            return True
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(now, self.burst)
+            self.buckets[user_id] = bucket
+        else:
+            self.buckets.move_to_end(user_id)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated_at) * self.rate)
+            bucket.updated_at = now
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            bucket.throttled = False
+            return True
+
+        self.dropped += 1
+        if not bucket.throttled:
+            bucket.throttled = True
+            logger.warning(f"Пользователь {user_id} превысил лимит запросов, лишние апдейты отбрасываются")
+        return False
+
+    def _expire(self, now: float) -> None:
+        while self.buckets:
+            user_id, bucket = next(iter(self.buckets.items()))
+            if now - bucket.updated_at < self.idle_ttl and len(self.buckets) <= MAX_TRACKED_USERS:
+                break
+            del self.buckets[user_id]
+
+    def status(self) -> str:
+        return f"Лимит запросов: {self.burst} сразу, {self.rate:g}/сек; пользователей в памяти: {len(self.buckets)}, отброшено апдейтов: {self.dropped}"
+
+
+limiter = RateLimiter()
@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+import db
+import parser
+import profiling
+import timeslots
+
+# Напоминания перед занятиями. Вместо задачи на каждого пользователя и каждое занятие - колесо таймеров
+# по минутам: в слот кладется один таймер на (группа, за сколько минут, время начала занятия), а пользователи
+# лежат в корзинах (группа, за сколько минут). Таймеры раскладываются только на сегодня и завтра, так что
+# память и работа зависят от числа занятий в день, а не от того, сколько занятий впереди.
+logger = logging.getLogger(__name__)
+
+# За сколько минут до занятия можно попросить напоминание
+REMINDER_OFFSETS = (5, 10, 15, 30, 60)
+# Слотов в колесе: минуты двух суток, сегодня и завтра раскладываются без коллизий по кругам
+WHEEL_SLOTS = 2 * 24 * 60
+# Напоминания, опоздавшие больше чем на столько минут (бот стоял), уже не отправляем
+MAX_LATE_MINUTES = 2
+# Как часто перечитывать подписчиков из базы, секунды. Подписываются в любом процессе, а рассылает один
+SUBSCRIBERS_RELOAD = 60
+# False - колесо не ведется (роль worker: напоминания рассылает другой процесс)
+ENABLED = False
+
+
+class Timer:
+    """Напоминание группе в минуту minute (абсолютную) про занятия, которые начнутся через offset минут"""
+    __slots__ = ("minute", "group", "offset", "subjects", "cancelled")
+
+    def __init__(self, minute: int, group: str, offset: int, subjects: tuple):
+        self.minute = minute
+        self.group = group
+        self.offset = offset
+        self.subjects = subjects
+        # Снятый таймер физически остается в слоте до его прохода, удаление из середины списка не нужно
+        self.cancelled = False
+
+
+# Слот = абсолютная минута % WHEEL_SLOTS -> таймеры
+_wheel: List[List[Timer]] = [[] for _ in range(WHEEL_SLOTS)]
+# Группа -> ее таймеры в колесе, чтобы при обновлении расписания снять только их
+_group_timers: Dict[str, List[Timer]] = {}
+# Группа -> (дата, отпечаток дня) для дней, по которым разложены таймеры
+_group_days: Dict[str, tuple] = {}
+# (группа, за сколько минут) -> {подгруппа или None: {user_id}}. Подменяется целиком при перечитывании
+_buckets: Dict[Tuple[str, int], Dict[Optional[str], Set[int]]] = {}
+_lock = threading.Lock()
+
+
+def _epoch_minute(moment: datetime) -> int:
+    return int(moment.timestamp() // 60)
+
+
+def schedule_group(group: str, schedule, now: Optional[datetime] = None) -> int:
+    """
+    Раскладывает таймеры группы на сегодня и завтра. Если эти дни не изменились с прошлой раскладки - ничего не делает.
+    Возвращает, сколько таймеров положено. now - с часовым поясом (по умолчанию parser.SCHEDULE_TZ).
+    """
+    now = (now or parser.schedule_now()).astimezone(parser.SCHEDULE_TZ)
+    days = [day for day in (schedule.day_on(now.date() + timedelta(days=i)) for i in range(2)) if day is not None]
+    fingerprint = tuple((day.date, day.fingerprint()) for day in days)
+    if _group_days.get(group) == fingerprint:
+        return 0
+
+    current = _epoch_minute(now)
+    timers = []
+    with profiling.span("schedule_reminders"):
+        for day in days:
+            day_date = parser.parse_day_date(day.date)
+            if day_date is None:
+                continue
+            midnight = datetime.combine(day_date, datetime.min.time(), tzinfo=parser.SCHEDULE_TZ)
+            # Занятия подгрупп в одно время - одно напоминание
+            starts: Dict[int, list] = {}
+            for subject in day.subjects:
+                slot = timeslots.parse_slot(subject.time)
+                if slot:
+                    starts.setdefault(slot[0], []).append(subject)
+            for start, subjects in starts.items():
+                start_minute = _epoch_minute(midnight + timedelta(minutes=start))
+                for offset in REMINDER_OFFSETS:
+                    if start_minute - offset > current:
+                        timers.append(Timer(start_minute - offset, group, offset, tuple(subjects)))
+
+    with _lock:
+        for timer in _group_timers.get(group, ()):
+            timer.cancelled = True
+        for timer in timers:
+            _wheel[timer.minute % WHEEL_SLOTS].append(timer)
+        _group_timers[group] = timers
+        _group_days[group] = fingerprint
+    logger.info(f"Напоминания группы {group} разложены заново: {len(timers)} таймеров")
+    return len(timers)
+
+
+def _on_refresh(group: str, schedule) -> None:
+    # Таймеры пересобираются, только если изменились сегодня или завтра (см. отпечаток в schedule_group)
+    if ENABLED:
+        schedule_group(group, schedule)
+
+
+def reload_subscribers() -> int:
+    """Перечитывает подписчиков из базы и подменяет корзины целиком"""
+    buckets: Dict[Tuple[str, int], Dict[Optional[str], Set[int]]] = {}
+    rows = db.get_reminder_subscribers()
+    for user_id, group, subgroup, offset in rows:
+        buckets.setdefault((group, offset), {}).setdefault(subgroup, set()).add(user_id)
+    global _buckets
+    _buckets = buckets
+    return len(rows)
+
+
+def _due(minute: int) -> List[Timer]:
+    """Снимает со слота таймеры, которым пора (и просроченные), остальные - следующего круга - оставляет"""
+    with _lock:
+        slot = _wheel[minute % WHEEL_SLOTS]
+        due = [timer for timer in slot if timer.minute <= minute and not timer.cancelled]
+        slot[:] = [timer for timer in slot if timer.minute > minute and not timer.cancelled]
+    return [timer for timer in due if minute - timer.minute <= MAX_LATE_MINUTES]
+
+
+def format_reminder(timer: Timer, subjects: list) -> str:
+    result = f"⏰ *Через {timer.offset} мин* ({timer.group}):\n"
+    for subject in subjects:
+        result += f"{subject}\n"
+    return result
+
+
+def messages(timer: Timer) -> List[Tuple[str, List[int]]]:
+    """Тексты напоминания и кому их отправить: у подгрупп свой текст, без чужих занятий"""
+    bucket = _buckets.get((timer.group, timer.offset))
+    if not bucket:
+        return []
+    result = []
+    for subgroup, user_ids in bucket.items():
+        subjects = [subject for subject in timer.subjects if not subgroup or subject.subgroup in ("", subgroup)]
+        if subjects and user_ids:
+            result.append((format_reminder(timer, subjects), list(user_ids)))
+    return result
+
+
+def _reschedule_all(now: datetime) -> None:
+    for group, schedule in list(parser.schedule_cache.items()):
+        schedule_group(group, schedule, now)
+
+
+async def _send_queued(queue: asyncio.Queue, send: Callable[[List[int], str], Awaitable[None]]) -> None:
+    # Рассылки идут строго по очереди, чтобы пауза между сообщениями в send соблюдалась и для нескольких текстов за минуту
+    while True:
+        user_ids, text = await queue.get()
+        try:
+            await send(user_ids, text)
+        except Exception as e:
+            logger.error(f"Ошибка при рассылке напоминания: {e}")
+
+
+async def run(send: Callable[[List[int], str], Awaitable[None]]) -> None:
+    """
+    Фоновая задача: раз в минуту снимает со слота колеса сработавшие таймеры и ставит тексты в очередь,
+    а рассылка send(user_ids, text) идет по одной пачке за раз. В полночь раскладывает таймеры на новые сутки.
+    """
+    global ENABLED
+    ENABLED = True
+    queue: asyncio.Queue = asyncio.Queue()
+    sender = asyncio.create_task(_send_queued(queue, send))
+    try:
+        await _tick_forever(queue)
+    finally:
+        sender.cancel()
+
+
+async def _tick_forever(queue: asyncio.Queue) -> None:
+    last_minute = None
+    current_date = None
+    reloaded_at = 0.0
+    while True:
+        try:
+            if time.monotonic() - reloaded_at >= SUBSCRIBERS_RELOAD:
+                reloaded_at = time.monotonic()
+                await asyncio.to_thread(reload_subscribers)
+
+            now = parser.schedule_now()
+            if now.date() != current_date:
+                current_date = now.date()
+                await asyncio.to_thread(_reschedule_all, now)
+
+            minute = _epoch_minute(now)
+            # Проспанные минуты проходим, но не дальше MAX_LATE_MINUTES назад
+            first = minute if last_minute is None else max(last_minute + 1, minute - MAX_LATE_MINUTES)
+            for passed in range(first, minute + 1):
+                for timer in _due(passed):
+                    for text, user_ids in messages(timer):
+                        queue.put_nowait((user_ids, text))
+            last_minute = minute
+        except Exception as e:
+            logger.error(f"Ошибка в фоновой задаче напоминаний: {e}")
+        # Просыпаемся сразу после начала следующей минуты
+        await asyncio.sleep(60 - time.time() % 60 + 0.5)
+
+
+def status() -> str:
+    with _lock:
+        timers = sum(1 for slot in _wheel for timer in slot if not timer.cancelled)
+    subscribers = sum(len(user_ids) for bucket in _buckets.values() for user_ids in bucket.values())
+    return f"Напоминания: таймеров {timers}, подписчиков {subscribers}, групп {len(_group_timers)}"
+
+
+parser.add_refresh_listener(_on_refresh)
@@ -0,0 +1,370 @@
+import heapq
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Tuple, Optional, List
+import parser
+import profiling
+import timeslots
+
+# Кеш готовых текстов расписания. Текст пересобирается, только когда в кеше парсера появилось новое расписание
+# (или для "сегодня"/"завтра" - когда сменилась дата), всё остальное время отдается готовая строка.
+logger = logging.getLogger(__name__)
+
+# Виды расписания и их заголовки (для inline-режима и кнопок)
+VIEW_TITLES = {
+    "today": "На сегодня",
+    "tomorrow": "На завтра",
+    "week_1": "Неделя 1",
+    "week_2": "Неделя 2",
+}
+
+# Максимальная длина сообщения в Телеграме
+MESSAGE_LIMIT = 4096
+# Запас под " (стр. 10/10)" в заголовке страницы
+PAGE_SUFFIX_RESERVE = 20
+
+# (группа, вид, дата, подгруппа) -> (версия расписания, из которого собран текст, текст)
+_rendered: Dict[Tuple[str, str, Optional[str], Optional[str]], Tuple[int, str]] = {}
+
+
+class WeekView:
+    """Заранее отрендеренная неделя: страницы целиком и тексты отдельных дней, всё доступно по индексу"""
+    def __init__(self, group: str, week_number: int, days: list, pages: List[str], day_texts: List[str]):
+        self.group = group
+        self.week_number = week_number
+        # Дни отсортированы по дате, индексы в day_texts и в кнопках совпадают с этим порядком
+        self.days = days
+        self.pages = pages
+        self.day_texts = day_texts
+        # Дата -> индекс дня, для старых кнопок вида day_1_14.10.25
+        self.day_index = {day.date: index for index, day in enumerate(days)}
+
+
+# (группа, подгруппа) -> (версия расписания, {номер недели: WeekView}). Недели подменяются целиком одним присваиванием,
+# так что читатель видит либо все старые, либо все новые. Подгруппа None - вся группа.
+_week_views: Dict[Tuple[str, Optional[str]], Tuple[int, Dict[int, WeekView]]] = {}
+# (заголовок группы, дата) -> (Day, блок дня для недели, текст дня). Парсер переиспользует объекты неизменившихся дней,
+# так что при обновлении расписания заново рендерятся только изменившиеся дни.
+_day_renders: Dict[Tuple[str, str], Tuple[object, str, str]] = {}
+
+
+def subgroup_title(group: str, subgroup: Optional[str] = None) -> str:
+    """Название группы в заголовках: с подгруппой, если расписание отфильтровано по ней"""
+    return f"{group} (подгр. {subgroup})" if subgroup else group
+
+
+def _variant(schedule, subgroup: Optional[str]):
+    # Снимок подгруппы собирается один раз и живет в самом снимке группы
+    return schedule.for_subgroup(subgroup) if subgroup else schedule
+
+
+def _day_sort_key(day) -> datetime:
+    for fmt in ("%d.%m.%y", "%d.%m.%Y"):
+        try:
+            return datetime.strptime(day.date, fmt)
+        except ValueError:
+            continue
+    return datetime.max
+
+
+def _day_block(day) -> str:
+    # Блок дня в недельном расписании: заголовок с датой, занятия или "Занятий нет"
+    result = f"----- *{day.date} {day.weekday}* -----\n"
+    if day.subjects:
+        for subject in day.subjects:
+            result += f"{subject}\n"
+    else:
+        result += "Занятий нет\n"
+    return result + "\n"
+
+
+def _day_text(group: str, day) -> str:
+    result = f"*Расписание группы {group} на {day.date} ({day.weekday})*\n\n"
+    if day.subjects:
+        for subject in day.subjects:
+            result += f"{subject}\n"
+    else:
+        result += "Занятий нет"
+    return result
+
+
+def _split_pages(header: str, blocks: List[str]) -> List[str]:
+    """Раскладывает блоки дней по страницам не длиннее лимита Телеграма, дни не разрываются"""
+    limit = MESSAGE_LIMIT - len(header) - PAGE_SUFFIX_RESERVE
+    pages = []
+    current = ""
+    for block in blocks:
+        # Один день длиннее страницы - режем по строкам, иначе Телеграм не примет сообщение
+        while len(block) > limit:
+            cut = block.rfind("\n", 0, limit) + 1 or limit
+            if current:
+                pages.append(current)
+                current = ""
+            pages.append(block[:cut])
+            block = block[cut:]
+        if len(current) + len(block) > limit:
+            pages.append(current)
+            current = ""
+        current += block
+    if current or not pages:
+        pages.append(current)
+
+    if len(pages) == 1:
+        return [f"{header}\n\n{pages[0]}"]
+    return [f"{header} (стр. {i}/{len(pages)})\n\n{page}" for i, page in enumerate(pages, 1)]
+
+
+def _day_render(group: str, day) -> Tuple[object, str, str]:
+    cached = _day_renders.get((group, day.date))
+    if cached is None or cached[0] is not day:
+        cached = (day, _day_block(day), _day_text(group, day))
+        _day_renders[(group, day.date)] = cached
+    return cached
+
+
+def _build_week_view(group: str, week, current_week: Optional[int] = None) -> WeekView:
+    days = sorted(week.days, key=_day_sort_key)
+    renders = [_day_render(group, day) for day in days]
+    current_mark = " (текущая)" if week.number == current_week else ""
+    header = f"*Расписание группы {group} на неделю {week.number}{current_mark}*"
+    if days:
+        pages = _split_pages(header, [block for _, block, _ in renders])
+    else:
+        pages = [f"{header}\n\nНет данных о занятиях"]
+    return WeekView(group, week.number, days, pages, [text for _, _, text in renders])
+
+
+def _build_week_views(group: str, schedule) -> Dict[int, WeekView]:
+    # group - заголовок из subgroup_title, у вариантов подгрупп свои тексты дней
+    with profiling.span("render_week_views"):
+        current_week = schedule.current_week_number()
+        views = {week.number: _build_week_view(group, week, current_week) for week in schedule.weeks}
+        # Дни, которые ушли из окна сайта, больше не нужны
+        dates = {day.date for week in schedule.weeks for day in week.days}
+        for key in [key for key in list(_day_renders) if key[0] == group and key[1] not in dates]:
+            _day_renders.pop(key, None)
+    return views
+
+
+def _rebuild_week_views(group: str, schedule) -> None:
+    """
+    Рендерит все недели группы и отдельно каждой ее подгруппы, а заодно тексты всех видов.
+    Вызывается при обновлении расписания, запросы дальше только выбирают готовое по индексу.
+    """
+    subgroups = [None] + schedule.subgroups()
+    for subgroup in subgroups:
+        _week_views[(group, subgroup)] = (
+            schedule.version, _build_week_views(subgroup_title(group, subgroup), _variant(schedule, subgroup))
+        )
+    # Подгруппы, которых в новом расписании нет
+    for key in [key for key in list(_week_views) if key[0] == group and key[1] not in subgroups]:
+        _week_views.pop(key, None)
+    for subgroup in subgroups:
+        for view in VIEW_TITLES:
+            _text_from_schedule(group, view, schedule, subgroup)
+
+
+def week_view(group: str, week_number: int, schedule=None, subgroup: Optional[str] = None) -> Optional[WeekView]:
+    """
+    Готовая неделя из кеша (без похода в сеть). None - если такой недели нет.
+    schedule - снимок, по которому нужна неделя; по умолчанию текущий из кеша парсера.
+    subgroup - только занятия всей группы и этой подгруппы.
+    """
+    if schedule is None:
+        schedule = parser.schedule_cache.get(group)
+    if schedule is None:
+        return None
+    cached = _week_views.get((group, subgroup))
+    if cached is None or cached[0] != schedule.version:
+        # Расписание попало в кеш раньше, чем нас подписали на обновления - рендерим лениво
+        cached = (schedule.version, _build_week_views(subgroup_title(group, subgroup), _variant(schedule, subgroup)))
+        # Снимок, который уже сменился в кеше, не сохраняем
+        if parser.schedule_cache.get(group) is schedule:
+            _week_views[(group, subgroup)] = cached
+    return cached[1].get(week_number)
+
+
+def _render(group: str, view: str, schedule, subgroup: Optional[str] = None) -> str:
+    title = subgroup_title(group, subgroup)
+    if view == "today":
+        return parser.get_today_schedule(title, schedule=_variant(schedule, subgroup))
+    if view == "tomorrow":
+        return parser.get_tomorrow_schedule(title, schedule=_variant(schedule, subgroup))
+    if view.startswith("week_"):
+        week_number = int(view.split("_")[1])
+        view_obj = week_view(group, week_number, schedule, subgroup)
+        if view_obj is None:
+            return f"Расписание на неделю {week_number} для группы {title} не найдено"
+        return view_obj.pages[0]
+    return "Неизвестный тип расписания."
+
+
+def _cache_key(group, view: str, subgroup: Optional[str] = None) -> Tuple[object, str, Optional[str], Optional[str]]:
+    # Тексты "на сегодня" и "на завтра" зависят от текущей даты
+    date_part = parser.schedule_now().strftime("%d.%m.%y") if view in ("today", "tomorrow") else None
+    return (group, view, date_part, subgroup)
+
+
+def _text_from_schedule(group: str, view: str, schedule, subgroup: Optional[str] = None) -> str:
+    key = _cache_key(group, view, subgroup)
+    cached = _rendered.get(key)
+    if cached and cached[0] == schedule.version:
+        return cached[1]
+
+    with profiling.span("render_text"):
+        text = _render(group, view, schedule, subgroup)
+    # Тексты ошибок не кешируем, чтобы следующий запрос попробовал еще раз
+    if not text.startswith("Произошла ошибка"):
+        _rendered[key] = (schedule.version, text)
+    return text
+
+
+def get_text(group: str, view: str, subgroup: Optional[str] = None) -> str:
+    """Текст расписания группы (или ее подгруппы) для вида view. При необходимости обновляет расписание с сайта."""
+    with profiling.span("parse_schedule"):
+        schedule = parser.parse_schedule(group)
+    if not schedule:
+        return f"Не удалось получить расписание для группы {group}"
+    return _text_from_schedule(group, view, schedule, subgroup)
+
+
+def cached_text(group: str, view: str, subgroup: Optional[str] = None) -> Optional[str]:
+    """Текст только из того, что уже лежит в памяти. Никогда не ходит в сеть, None - если расписания в кеше нет."""
+    schedule = parser.schedule_cache.get(group)
+    if schedule is None:
+        return None
+    return _text_from_schedule(group, view, schedule, subgroup)
+
+
+# Совмещенное расписание нескольких групп (основная + дополнительные).
+# (группы, вид, дата, None) -> (версии расписаний групп, страницы). Версии сверяются на каждом запросе,
+# так что совмещенный вид стоит почти как вид одной группы, пока ни одно из расписаний не обновилось.
+_merged: Dict[Tuple[Tuple[str, ...], str, Optional[str], None], Tuple[Tuple[int, ...], List[str]]] = {}
+
+# Занятие без распознанного времени - в конец дня
+_NO_TIME = 24 * 60
+
+
+def _subject_stream(order: int, group: str, day):
+    # Занятия дня на сайте уже идут по времени начала
+    for subject in day.subjects:
+        slot = timeslots.parse_slot(subject.time)
+        yield (slot[0] if slot else _NO_TIME, order, subject, group)
+
+
+def merge_day_subjects(days: List[Tuple[str, object]]) -> List[Tuple[object, List[str]]]:
+    """
+    K-way слияние занятий одного дня нескольких групп: [(группа, Day), ...] -> [(занятие, [группы]), ...] по времени.
+    Общая лекция (одинаковое занятие у нескольких групп) остается одной строкой со списком групп.
+    """
+    result = []
+    positions = {}
+    streams = [_subject_stream(order, group, day) for order, (group, day) in enumerate(days)]
+    for _, _, subject, group in heapq.merge(*streams, key=lambda item: item[:2]):
+        key = subject.key()
+        if key in positions:
+            result[positions[key]][1].append(group)
+            continue
+        positions[key] = len(result)
+        result.append((subject, [group]))
+    return result
+
+
+def _merged_subject_lines(days: List[Tuple[str, object]], group_count: int) -> str:
+    result = ""
+    for subject, groups in merge_day_subjects(days):
+        # Группы подписываем, только если занятие не общее для всех
+        suffix = f" [{', '.join(groups)}]" if len(groups) < group_count else ""
+        result += f"{subject}{suffix}\n"
+    return result
+
+
+def _merged_day_block(days: List[Tuple[str, object]], group_count: int) -> str:
+    day = days[0][1]
+    lines = _merged_subject_lines(days, group_count) or "Занятий нет\n"
+    return f"----- *{day.date} {day.weekday}* -----\n{lines}\n"
+
+
+def _merged_day_pages(groups: Tuple[str, ...], schedules: List[Tuple[str, object]], view: str) -> List[str]:
+    label = "сегодня" if view == "today" else "завтра"
+    day_date = parser.schedule_now().date() + timedelta(days=0 if view == "today" else 1)
+    days = []
+    for group, schedule in schedules:
+        day = schedule.day_on(day_date)
+        if day is not None:
+            days.append((group, day))
+    if not days:
+        return [f"Расписание на {label} для групп {', '.join(groups)} не найдено"]
+    day = days[0][1]
+    header = f"*Расписание групп {', '.join(groups)} на {label}*\n\n----- *{day.date} {day.weekday}* -----\n\n"
+    return [header + (_merged_subject_lines(days, len(groups)) or "Занятий нет")]
+
+
+def _merged_week_pages(groups: Tuple[str, ...], schedules: List[Tuple[str, object]], week_number: int) -> List[str]:
+    # Дни каждой группы по дате, дальше k-way слияние по дате и слияние занятий внутри одной даты
+    streams = []
+    for order, (group, schedule) in enumerate(schedules):
+        week = next((week for week in schedule.weeks if week.number == week_number), None)
+        if week is not None:
+            streams.append([(_day_sort_key(day), order, group, day) for day in sorted(week.days, key=_day_sort_key)])
+
+    blocks = []
+    same_date: List[Tuple[str, object]] = []
+    current = None
+    for day_key, _, group, day in heapq.merge(*streams, key=lambda item: item[:2]):
+        if same_date and day_key != current:
+            blocks.append(_merged_day_block(same_date, len(groups)))
+            same_date = []
+        current = day_key
+        same_date.append((group, day))
+    if same_date:
+        blocks.append(_merged_day_block(same_date, len(groups)))
+
+    current_week = schedules[0][1].current_week_number() if schedules else None
+    current_mark = " (текущая)" if week_number == current_week else ""
+    header = f"*Расписание групп {', '.join(groups)} на неделю {week_number}{current_mark}*"
+    if not blocks:
+        return [f"{header}\n\nНет данных о занятиях"]
+    return _split_pages(header, blocks)
+
+
+def merged_pages(groups: List[str], view: str) -> List[str]:
+    """Страницы совмещенного расписания нескольких групп для today/tomorrow/week_N"""
+    key_groups = tuple(sorted(set(groups)))
+    schedules = []
+    for group in key_groups:
+        with profiling.span("parse_schedule"):
+            schedule = parser.parse_schedule(group)
+        if schedule:
+            schedules.append((group, schedule))
+    if not schedules:
+        return [f"Не удалось получить расписание для групп {', '.join(key_groups)}"]
+
+    key = _cache_key(key_groups, view)
+    versions = tuple(schedule.version for _, schedule in schedules)
+    cached = _merged.get(key)
+    if cached and cached[0] == versions:
+        return cached[1]
+
+    with profiling.span("render_merged"):
+        if view.startswith("week_"):
+            pages = _merged_week_pages(key_groups, schedules, int(view.split("_")[1]))
+        elif view in ("today", "tomorrow"):
+            pages = _merged_day_pages(key_groups, schedules, view)
+        else:
+            return ["Неизвестный тип расписания."]
+    _merged[key] = (versions, pages)
+    return pages
+
+
+def _drop_group(group: str, schedule) -> None:
+    # Новое расписание - старые тексты группы больше не нужны
+    # pop, а не del: обработчики запросов в это же время пишут в эти словари из потока цикла событий
+    for key in [key for key in list(_rendered) if key[0] == group]:
+        _rendered.pop(key, None)
+    for key in [key for key in list(_merged) if group in key[0]]:
+        _merged.pop(key, None)
+
+
+parser.add_refresh_listener(_drop_group)
+parser.add_refresh_listener(_rebuild_week_views)
@@ -0,0 +1,202 @@
+import bisect
+import heapq
+import itertools
+import logging
+import re
+from datetime import datetime, date as date_type
+from typing import Dict, Iterator, List, Optional, Tuple
+import parser
+import profiling
+import render
+import timeslots
+
+# Поиск занятий по названию для /find: "когда следующий матан". Индекс токен -> номера занятий строится
+# при обновлении расписания, занятия в нем уже отсортированы по дате и времени, так что ближайшие N -
+# это бинарный поиск по текущему моменту и первые N номеров из списков токенов запроса.
+logger = logging.getLogger(__name__)
+
+# Сколько ближайших занятий показывать
+FIND_LIMIT = 5
+# Токены короче не индексируем и не ищем: по одной букве совпадет почти всё
+MIN_TOKEN_LENGTH = 2
+
+# Занятие без распознанного времени - в конец дня
+_NO_TIME = 24 * 60
+
+_TOKEN_RE = re.compile(r'\w+')
+
+# Полное название <-> сокращение: находится и "матан", и "математический анализ", как бы предмет ни был записан на сайте
+_ALIASES: Dict[str, List[str]] = {}
+for _full, _short in parser.SUBJECT_ABBREVIATIONS.items():
+    _ALIASES.setdefault(_full.lower(), []).append(_short)
+    _ALIASES.setdefault(_short.lower(), []).append(_full)
+
+
+def tokenize(text: str) -> List[str]:
+    """Токены в нижнем регистре, ё -> е"""
+    return [token for token in _TOKEN_RE.findall((text or "").lower().replace("ё", "е")) if len(token) >= MIN_TOKEN_LENGTH]
+
+
+def _subject_tokens(subject) -> set:
+    # Название и его сокращение (или полное название), тип занятия и преподаватель
+    tokens = set(tokenize(subject.name))
+    for alias in _ALIASES.get(subject.name.lower(), ()):
+        tokens.update(tokenize(alias))
+    tokens.update(tokenize(subject.type))
+    tokens.update(tokenize(subject.teacher))
+    return tokens
+
+
+class Occurrence:
+    """Одно занятие в конкретный день"""
+    __slots__ = ("date", "start", "day_title", "subject")
+
+    def __init__(self, day_date: date_type, start: int, day_title: str, subject):
+        self.date = day_date
+        self.start = start
+        self.day_title = day_title
+        self.subject = subject
+
+
+class SearchIndex:
+    """Занятия группы по дате и времени и токены -> отсортированные номера занятий, для одной версии расписания"""
+    def __init__(self, version: int, occurrences: List[Occurrence], postings: Dict[str, List[int]]):
+        self.version = version
+        self.occurrences = occurrences
+        self.keys = [(occurrence.date, occurrence.start) for occurrence in occurrences]
+        self.postings = postings
+        self.tokens = sorted(postings)
+
+    def _matching(self, query_token: str) -> List[int]:
+        # Токен запроса - префикс: "мат" находит и "матан", и "математический"
+        lists = []
+        i = bisect.bisect_left(self.tokens, query_token)
+        while i < len(self.tokens) and self.tokens[i].startswith(query_token):
+            lists.append(self.postings[self.tokens[i]])
+            i += 1
+        if len(lists) == 1:
+            return lists[0]
+        return sorted(set().union(*lists))
+
+    def find(self, query_tokens: List[str], after: Tuple[date_type, int]) -> Iterator[Occurrence]:
+        """Занятия, подходящие под все токены запроса, начиная с момента after = (дата, минута), по порядку"""
+        if not query_tokens:
+            return
+        lists = sorted((self._matching(token) for token in set(query_tokens)), key=len)
+        if not lists[0]:
+            return
+        first = bisect.bisect_left(self.keys, after)
+        others = [set(numbers) for numbers in lists[1:]]
+        shortest = lists[0]
+        for number in itertools.islice(shortest, bisect.bisect_left(shortest, first), None):
+            if all(number in other for other in others):
+                yield self.occurrences[number]
+
+
+# Группа -> индекс последней версии расписания
+_indexes: Dict[str, SearchIndex] = {}
+
+
+def _build_index(schedule) -> SearchIndex:
+    with profiling.span("build_search_index"):
+        occurrences = []
+        seen = set()
+        for week in schedule.weeks:
+            for day in week.days:
+                day_date = parser.parse_day_date(day.date)
+                if day_date is None or day_date in seen:
+                    continue
+                seen.add(day_date)
+                for subject in day.subjects:
+                    slot = timeslots.parse_slot(subject.time)
+                    occurrences.append(Occurrence(day_date, slot[0] if slot else _NO_TIME, f"{day.date} {day.weekday}", subject))
+        occurrences.sort(key=lambda occurrence: (occurrence.date, occurrence.start))
+
+        postings: Dict[str, List[int]] = {}
+        # Одинаковые занятия повторяются каждую неделю - токены считаем один раз на занятие
+        tokens_by_key: Dict[tuple, set] = {}
+        for number, occurrence in enumerate(occurrences):
+            key = occurrence.subject.key()
+            tokens = tokens_by_key.get(key)
+            if tokens is None:
+                tokens = tokens_by_key[key] = _subject_tokens(occurrence.subject)
+            for token in tokens:
+                postings.setdefault(token, []).append(number)
+    return SearchIndex(schedule.version, occurrences, postings)
+
+
+def search_index(group: str, schedule) -> SearchIndex:
+    """Индекс группы для снимка schedule"""
+    index = _indexes.get(group)
+    if index is None or index.version != schedule.version:
+        # Расписание попало в кеш раньше, чем нас подписали на обновления - строим лениво
+        index = _build_index(schedule)
+        if parser.schedule_cache.get(group) is schedule:
+            _indexes[group] = index
+    return index
+
+
+def _stream(group: str, index: SearchIndex, tokens: List[str], after: Tuple[date_type, int], subgroup: Optional[str]):
+    for occurrence in index.find(tokens, after):
+        if not (subgroup and occurrence.subject.subgroup not in ("", subgroup)):
+            yield (occurrence.date, occurrence.start), group, occurrence
+
+
+def find(groups: List[str], query: str, subgroup: Optional[str] = None, limit: int = FIND_LIMIT,
+         now: Optional[datetime] = None) -> List[Tuple[Occurrence, List[str]]]:
+    """
+    Ближайшие limit занятий групп по запросу: [(занятие, [группы]), ...] по времени.
+    Общая лекция нескольких групп - одна запись со списком групп.
+    """
+    tokens = tokenize(query)
+    now = now or parser.schedule_now()
+    after = (now.date(), now.hour * 60 + now.minute)
+    streams = []
+    for group in groups:
+        with profiling.span("parse_schedule"):
+            schedule = parser.parse_schedule(group)
+        if schedule:
+            streams.append(_stream(group, search_index(group, schedule), tokens, after, subgroup))
+
+    result = []
+    positions = {}
+    for _, group, occurrence in heapq.merge(*streams, key=lambda item: item[0]):
+        key = (occurrence.date, occurrence.subject.key())
+        if key in positions:
+            result[positions[key]][1].append(group)
+            continue
+        # Следующее занятие после limit уже не нужно, но общие лекции на той же позиции еще могут прийти
+        if len(result) == limit:
+            if (occurrence.date, occurrence.start) > (result[-1][0].date, result[-1][0].start):
+                break
+            continue
+        positions[key] = len(result)
+        result.append((occurrence, [group]))
+    return result
+
+
+def get_text(groups: List[str], query: str, subgroup: Optional[str] = None) -> str:
+    """Текст ответа на /find. subgroup учитывается, только если группа одна."""
+    if len(groups) != 1:
+        subgroup = None
+    with profiling.span("search"):
+        found = find(groups, query, subgroup)
+    # Запрос пользователя в заголовке - только токенами, чтобы не сломать разметку Markdown
+    title = " ".join(tokenize(query))
+    groups_title = render.subgroup_title(groups[0], subgroup) if len(groups) == 1 else ", ".join(groups)
+    if not found:
+        return f"Ближайших занятий «{title}» в расписании {groups_title} не найдено"
+
+    result = f"*Ближайшие занятия «{title}» ({groups_title})*\n\n"
+    for occurrence, occurrence_groups in found:
+        # Группы подписываем, только если занятие не общее для всех
+        suffix = f" [{', '.join(occurrence_groups)}]" if len(occurrence_groups) < len(groups) else ""
+        result += f"*{occurrence.day_title}* {occurrence.subject}{suffix}\n"
+    return result
+
+
+def _rebuild(group: str, schedule) -> None:
+    _indexes[group] = _build_index(schedule)
+
+
+parser.add_refresh_listener(_rebuild)
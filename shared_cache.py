@@ -0,0 +1,91 @@
+import os
+import pickle
+import sqlite3
+import logging
+from typing import Optional
+
+# Общий кеш расписаний для нескольких процессов бота на одной машине.
+# Процесс-обновлятор (BOT_ROLE=refresher) один ходит на сайт и публикует сюда каждое новое расписание,
+# воркеры (BOT_ROLE=worker) на сайт не ходят и только забирают отсюда свежие версии.
+logger = logging.getLogger(__name__)
+
+# Путь к файлу общего кеша
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "schedule_cache.db")
+# Как часто воркер проверяет, не появилась ли новая версия расписания группы, секунды
+POLL_INTERVAL = float(os.getenv("SHARED_CACHE_POLL_INTERVAL", "30"))
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(SHARED_CACHE_PATH, timeout=10)
+    # WAL: читатели не блокируют писателя и друг друга
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def init_store() -> None:
+    conn = None
+    try:
+        conn = _connect()
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS schedules (
+            group_name TEXT PRIMARY KEY,
+            created_at REAL NOT NULL,
+            payload BLOB NOT NULL
+        )
+        ''')
+        conn.commit()
+        logger.info("Общий кеш расписаний инициализирован успешно.")
+    except Exception as e:
+        logger.error(f"Ошибка при инициализации общего кеша расписаний: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+def publish(group: str, schedule) -> None:
+    """Сохраняет расписание группы в общий кеш. Подходит как обработчик parser.add_refresh_listener."""
+    conn = None
+    try:
+        payload = pickle.dumps(schedule, protocol=pickle.HIGHEST_PROTOCOL)
+        conn = _connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO schedules (group_name, created_at, payload) VALUES (?, ?, ?)",
+            (group, schedule.created_at, payload)
+        )
+        conn.commit()
+        logger.info(f"Расписание группы {group} опубликовано в общий кеш ({len(payload)} байт)")
+    except Exception as e:
+        logger.error(f"Ошибка при публикации расписания группы {group} в общий кеш: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+def load(group: str, newer_than: Optional[float] = None):
+    """
+    Расписание группы из общего кеша или None.
+    newer_than - created_at локальной копии: если в кеше не новее, payload даже не читаем.
+    """
+    conn = None
+    try:
+        conn = _connect()
+        cursor = conn.cursor()
+        if newer_than is None:
+            cursor.execute("SELECT payload FROM schedules WHERE group_name = ?", (group,))
+        else:
+            cursor.execute(
+                "SELECT payload FROM schedules WHERE group_name = ? AND created_at > ?",
+                (group, newer_than)
+            )
+        row = cursor.fetchone()
+        if not row:
+            return None
+        logger.info(f"Загружена новая версия расписания группы {group} из общего кеша")
+        # Файл пишет только наш процесс-обновлятор, чужие данные сюда не попадают
+        return pickle.loads(row[0])
+    except Exception as e:
+        logger.error(f"Ошибка при чтении расписания группы {group} из общего кеша: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
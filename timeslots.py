@@ -0,0 +1,133 @@
+import bisect
+import logging
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import parser
+import profiling
+
+# Индекс занятий группы на сегодня по минутам начала: "что сейчас и что дальше" ищется бинарным поиском,
+# а не перебором всего дня. Индекс пересобирается при обновлении расписания и при смене даты.
+logger = logging.getLogger(__name__)
+
+_TIME_RE = re.compile(r'(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})')
+
+
+class DayIndex:
+    """Занятия одного дня, отсортированные по времени начала. starts/ends - минуты от полуночи."""
+    def __init__(self, date: str, subjects: list):
+        slots = []
+        for subject in subjects:
+            slot = parse_slot(subject.time)
+            if slot is None:
+                logger.warning(f"Не удалось распознать время занятия: {subject.time}")
+                continue
+            slots.append((slot[0], slot[1], subject))
+        slots.sort(key=lambda slot: (slot[0], slot[1]))
+
+        self.date = date
+        self.starts = [slot[0] for slot in slots]
+        self.ends = [slot[1] for slot in slots]
+        self.subjects = [slot[2] for slot in slots]
+        # max_ends[i] - самый поздний конец среди занятий 0..i
+        self.max_ends = []
+        for end in self.ends:
+            self.max_ends.append(max(end, self.max_ends[-1]) if self.max_ends else end)
+
+    def current(self, minute: int) -> List[Tuple[int, object]]:
+        """(минута конца, занятие) для занятий, которые идут в эту минуту (у подгрупп их может быть несколько)"""
+        result = []
+        i = bisect.bisect_right(self.starts, minute) - 1
+        # Идем влево, пока среди более ранних занятий есть хоть одно, которое еще не кончилось
+        while i >= 0 and self.max_ends[i] > minute:
+            if self.ends[i] > minute:
+                result.append((self.ends[i], self.subjects[i]))
+            i -= 1
+        result.reverse()
+        return result
+
+    def upcoming(self, minute: int) -> Tuple[Optional[int], list]:
+        """(минута начала, занятия) ближайшего еще не начавшегося слота"""
+        i = bisect.bisect_right(self.starts, minute)
+        if i == len(self.starts):
+            return None, []
+        start = self.starts[i]
+        j = bisect.bisect_right(self.starts, start)
+        return start, self.subjects[i:j]
+
+
+# Группа -> (версия расписания, дата, индекс на эту дату)
+_indexes: Dict[str, Tuple[int, str, Optional[DayIndex]]] = {}
+
+
+def parse_slot(time_str: str) -> Optional[Tuple[int, int]]:
+    match = _TIME_RE.search(time_str or "")
+    if not match:
+        return None
+    h1, m1, h2, m2 = (int(x) for x in match.groups())
+    return h1 * 60 + m1, h2 * 60 + m2
+
+
+def _build_index(group: str, schedule, date: datetime) -> Optional[DayIndex]:
+    with profiling.span("build_timeslot_index"):
+        day = schedule.day_on(date.date())
+        index = DayIndex(day.date, day.subjects) if day else None
+    _indexes[group] = (schedule.version, date.strftime("%d.%m.%y"), index)
+    return index
+
+
+def _rebuild(group: str, schedule) -> None:
+    _build_index(group, schedule, parser.schedule_now())
+
+
+def day_index(group: str, schedule, now: Optional[datetime] = None) -> Optional[DayIndex]:
+    """Индекс на сегодня. Пересобирается, только если расписание обновилось или наступил новый день."""
+    now = now or parser.schedule_now()
+    cached = _indexes.get(group)
+    if cached and cached[0] == schedule.version and cached[1] == now.strftime("%d.%m.%y"):
+        return cached[2]
+    return _build_index(group, schedule, now)
+
+
+def _format_minutes(minutes: int) -> str:
+    if minutes < 60:
+        return f"{minutes} мин"
+    return f"{minutes // 60} ч {minutes % 60} мин"
+
+
+def now_text(group: str, schedule, now: Optional[datetime] = None) -> str:
+    now = now or parser.schedule_now()
+    minute = now.hour * 60 + now.minute
+    index = day_index(group, schedule, now)
+
+    result = f"*Группа {group}, {now.strftime('%H:%M')}*\n\n"
+    if index is None or not index.subjects:
+        return result + "Сегодня занятий нет"
+
+    current = index.current(minute)
+    if current:
+        left = max(end for end, _ in current) - minute
+        result += f"*Сейчас* (до конца {_format_minutes(left)}):\n"
+        result += "".join(f"{subject}\n" for _, subject in current)
+    else:
+        result += "Сейчас занятий нет\n"
+
+    start, upcoming = index.upcoming(minute)
+    if upcoming:
+        result += f"\n*Дальше* (через {_format_minutes(start - minute)}):\n"
+        result += "".join(f"{subject}\n" for subject in upcoming)
+    elif not current:
+        result += "\nНа сегодня занятия закончились"
+    return result
+
+
+def get_text(group: str) -> str:
+    """Текущее и следующее занятие группы"""
+    with profiling.span("parse_schedule"):
+        schedule = parser.parse_schedule(group)
+    if not schedule:
+        return f"Не удалось получить расписание для группы {group}"
+    return now_text(group, schedule)
+
+
+parser.add_refresh_listener(_rebuild)
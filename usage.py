@@ -0,0 +1,273 @@
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+import argparse
+from typing import List, Optional, Tuple
+import db
+
+# Журнал использования бота: кто, какую группу и какой вид смотрел, сколько заняла обработка и было ли
+# расписание в кеше. В обработчике событие только дописывается в список в памяти (пара микросекунд),
+# в SQLite события уходят пачками из фоновой задачи в отдельном потоке. Раз в ROLLUP_INTERVAL сырые
+# события сворачиваются в почасовую сводку по группе и виду, а старше RAW_RETENTION удаляются.
+logger = logging.getLogger(__name__)
+
+# Путь к файлу журнала
+USAGE_DB_PATH = os.getenv("USAGE_DB_PATH", "usage.db")
+# Как часто буфер сбрасывается в базу и как часто считается почасовая сводка, секунды
+FLUSH_INTERVAL = 10
+ROLLUP_INTERVAL = 300
+# Час сворачивается, когда с его конца прошло столько секунд (чтобы успели записаться все его события)
+ROLLUP_DELAY = 300
+# Сколько хранить сырые события, секунды
+RAW_RETENTION = int(os.getenv("USAGE_RAW_RETENTION_DAYS", "7")) * 24 * 3600
+# Больше событий в памяти не держим: если база не успевает, новые события отбрасываются
+MAX_BUFFER = 100000
+
+# (время, user_id, группа, вид, длительность в мс, попадание в кеш: 1/0/None)
+Event = Tuple[float, Optional[int], Optional[str], str, float, Optional[int]]
+
+_buffer: List[Event] = []
+dropped = 0
+
+
+def record(name: str, args: tuple, duration_ms: float, attrs: dict) -> None:
+    """Обработчик profiling.add_trace_listener: дописывает событие в буфер"""
+    global dropped
+    if len(_buffer) >= MAX_BUFFER:
+        dropped += 1
+        return
+    update = args[0] if args else None
+    user = getattr(update, "effective_user", None)
+    cache_hit = attrs.get("cache_hit")
+    _buffer.append((
+        time.time(),
+        user.id if user else None,
+        attrs.get("group"),
+        attrs.get("view") or attrs.get("handler") or name,
+        duration_ms,
+        None if cache_hit is None else int(cache_hit),
+    ))
+
+
+def _take() -> List[Event]:
+    # Вызывается из потока цикла событий, там же, где record, поэтому подмена списка ничего не теряет
+    global _buffer
+    events, _buffer = _buffer, []
+    return events
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(USAGE_DB_PATH, timeout=10)
+    # WAL: отчеты читают журнал, не мешая записи
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def init_store() -> None:
+    conn = None
+    try:
+        conn = _connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS events (
+            ts REAL NOT NULL,
+            user_id INTEGER,
+            group_name TEXT,
+            view TEXT NOT NULL,
+            latency_ms REAL NOT NULL,
+            cache_hit INTEGER
+        )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_ts ON events (ts)")
+        # Почасовая сводка; hour - unix-время начала часа, группа '' - апдейты без группы (выбор группы, /help)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS usage_hourly (
+            hour INTEGER NOT NULL,
+            group_name TEXT NOT NULL,
+            view TEXT NOT NULL,
+            requests INTEGER NOT NULL,
+            users INTEGER NOT NULL,
+            cache_hits INTEGER NOT NULL,
+            cache_misses INTEGER NOT NULL,
+            latency_avg_ms REAL NOT NULL,
+            latency_max_ms REAL NOT NULL,
+            PRIMARY KEY (hour, group_name, view)
+        )
+        ''')
+        # До какого часа сводка уже посчитана
+        cursor.execute("CREATE TABLE IF NOT EXISTS usage_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.commit()
+        logger.info("Журнал использования инициализирован успешно.")
+    except Exception as e:
+        logger.error(f"Ошибка при инициализации журнала использования: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+def write_events(events: List[Event]) -> None:
+    """Записывает пачку событий одной транзакцией"""
+    if not events:
+        return
+    conn = None
+    try:
+        conn = _connect()
+        conn.executemany(
+            "INSERT INTO events (ts, user_id, group_name, view, latency_ms, cache_hit) VALUES (?, ?, ?, ?, ?, ?)",
+            events
+        )
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при записи журнала использования ({len(events)} событий потеряно): {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+def rollup(now: Optional[float] = None) -> int:
+    """
+    Сворачивает закончившиеся часы в usage_hourly и удаляет сырые события старше RAW_RETENTION.
+    Час пересчитывается целиком из сырых событий, так что повторный запуск (и из другого процесса) ничего не задвоит.
+    Возвращает, сколько строк сводки записано.
+    """
+    now = time.time() if now is None else now
+    cutoff = int((now - ROLLUP_DELAY) // 3600 * 3600)
+    conn = None
+    try:
+        conn = _connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT value FROM usage_meta WHERE key = 'rolled_up_to'")
+        row = cursor.fetchone()
+        start = row[0] if row else 0
+        if start >= cutoff:
+            return 0
+
+        cursor.execute('''
+        INSERT OR REPLACE INTO usage_hourly
+        SELECT CAST(ts / 3600 AS INTEGER) * 3600, COALESCE(group_name, ''), view,
+               COUNT(*), COUNT(DISTINCT user_id),
+               COALESCE(SUM(cache_hit = 1), 0), COALESCE(SUM(cache_hit = 0), 0),
+               AVG(latency_ms), MAX(latency_ms)
+        FROM events
+        WHERE ts >= ? AND ts < ?
+        GROUP BY 1, 2, 3
+        ''', (start, cutoff))
+        written = cursor.rowcount
+        cursor.execute("INSERT OR REPLACE INTO usage_meta (key, value) VALUES ('rolled_up_to', ?)", (cutoff,))
+        # Сырые события за уже свернутые часы храним только RAW_RETENTION
+        cursor.execute("DELETE FROM events WHERE ts < ?", (min(cutoff, now - RAW_RETENTION),))
+        deleted = cursor.rowcount
+        conn.commit()
+        logger.info(f"Журнал использования свернут: строк сводки {written}, удалено старых событий {deleted}")
+        return written
+    except Exception as e:
+        logger.error(f"Ошибка при сворачивании журнала использования: {e}")
+        return 0
+    finally:
+        if conn:
+            conn.close()
+
+
+def _write(events: List[Event]) -> None:
+    write_events(events)
+    # Заодно last_seen пользователей: одна запись на пользователя за сброс, а не на каждый апдейт
+    db.touch_users({event[1] for event in events if event[1] is not None})
+
+
+async def flush() -> None:
+    """Сбрасывает буфер в базу в отдельном потоке"""
+    events = _take()
+    if events:
+        await asyncio.to_thread(_write, events)
+
+
+async def run() -> None:
+    """Фоновая задача бота: сброс буфера раз в FLUSH_INTERVAL и сводка раз в ROLLUP_INTERVAL"""
+    rolled_at = 0.0
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        try:
+            await flush()
+            if time.monotonic() - rolled_at >= ROLLUP_INTERVAL:
+                rolled_at = time.monotonic()
+                await asyncio.to_thread(rollup)
+        except Exception as e:
+            logger.error(f"Ошибка в фоновой задаче журнала использования: {e}")
+
+
+def report(hours: int = 24, limit: int = 20) -> List[Tuple]:
+    """
+    Сводка за последние hours часов: (группа, вид, запросов, пользователей, доля попаданий в кеш, средняя и макс. задержка).
+    Пользователи - сумма уникальных по часам, один человек за два часа считается дважды.
+    """
+    since = int(time.time() // 3600 * 3600) - hours * 3600
+    conn = None
+    try:
+        conn = _connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT group_name, view, SUM(requests), SUM(users),
+               CAST(SUM(cache_hits) AS REAL) / MAX(1, SUM(cache_hits) + SUM(cache_misses)),
+               SUM(latency_avg_ms * requests) / SUM(requests), MAX(latency_max_ms)
+        FROM usage_hourly
+        WHERE hour >= ?
+        GROUP BY group_name, view
+        ORDER BY SUM(requests) DESC
+        LIMIT ?
+        ''', (since, limit))
+        return cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Ошибка при построении сводки использования: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+
+def hourly_load(hours: int = 24) -> List[Tuple[int, int]]:
+    """Запросов по часам за последние hours часов: [(начало часа, запросов), ...]"""
+    since = int(time.time() // 3600 * 3600) - hours * 3600
+    conn = None
+    try:
+        conn = _connect()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT hour, SUM(requests) FROM usage_hourly WHERE hour >= ? GROUP BY hour ORDER BY hour",
+            (since,)
+        )
+        return cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Ошибка при построении нагрузки по часам: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+
+def main(argv=None) -> None:
+    global USAGE_DB_PATH
+
+    arg_parser = argparse.ArgumentParser(prog="python -m usage", description="Сводка использования бота по группам, видам и часам")
+    arg_parser.add_argument("--db", default=USAGE_DB_PATH, help=f"путь к журналу (по умолчанию {USAGE_DB_PATH})")
+    arg_parser.add_argument("--hours", type=int, default=24, help="за сколько последних часов")
+    arg_parser.add_argument("--limit", type=int, default=20, help="сколько строк по группам и видам")
+    arg_parser.add_argument("--rollup", action="store_true", help="сначала свернуть накопившиеся события")
+    args = arg_parser.parse_args(argv)
+
+    USAGE_DB_PATH = args.db
+    if args.rollup:
+        rollup()
+
+    print(f"{'группа':<10} {'вид':<20} {'запросов':>9} {'польз.':>7} {'кеш':>5} {'ср. мс':>8} {'макс. мс':>9}")
+    for group, view, requests, users, hit_ratio, avg_ms, max_ms in report(args.hours, args.limit):
+        print(f"{group or '-':<10} {view:<20} {requests:>9} {users:>7} {hit_ratio:>5.0%} {avg_ms:>8.1f} {max_ms:>9.1f}")
+
+    print("\nПо часам:")
+    for hour, requests in hourly_load(args.hours):
+        print(f"{time.strftime('%d.%m %H:00', time.localtime(hour))}  {requests}")
+
+
+if __name__ == "__main__":
+    main()